@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""vectorized anomaly detection over polled channel metrics.
+
+works on a timeseries.TimeSeriesStore fed with sysinfo polls: the recent
+samples of every channel are stacked in one numpy matrix per metric, and
+all channels of the fleet are checked in one pass.
+
+requires numpy, e.g. `pip install epipearl[analysis]`.
+"""
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+BITRATE_DROP = 'bitrate_drop'
+FPS_DEVIATION = 'fps_deviation'
+RECORDER_STALLED = 'recorder_stalled'
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError(
+                'anomaly detection requires numpy; '
+                'pip install epipearl[analysis]')
+
+
+def recent_matrix(store, metric, window):
+    """returns (keys, matrix) with last `window` samples per channel.
+
+    keys: sorted list of (device, channel) with a series for metric
+    matrix: len(keys) x window floats, oldest first; rows of series with
+        fewer samples are left-padded with nan.
+
+    rows are read straight from the ring buffer blocks of the store, with
+    one numpy gather per block.
+    """
+    _require_numpy()
+    keys = []
+    parts = []
+    offsets = np.arange(window) - window
+    for (block_keys, block) in store.blocks(metric):
+        n = len(block_keys)
+        if n == 0:
+            continue
+        capacity = block.capacity
+        values = np.frombuffer(block.values, dtype='d').reshape(
+                block.rows, capacity)[:n]
+        starts = np.frombuffer(block.starts, dtype='l')[:n, np.newaxis]
+        counts = np.frombuffer(block.counts, dtype='l')[:n, np.newaxis]
+        # logical index of each column; negative ones are padding
+        logical = counts + offsets
+        cols = (starts + np.maximum(logical, 0)) % capacity
+        part = values[np.arange(n)[:, np.newaxis], cols]
+        part[logical < 0] = np.nan
+        keys.extend(block_keys)
+        parts.append(part)
+    if not parts:
+        return ([], np.full((0, window), np.nan))
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+    matrix = np.concatenate(parts)[order]
+    return ([keys[i] for i in order], matrix)
+
+
+def _flagged(kind, keys, mask, values, baselines):
+    return [{
+        'type': kind,
+        'device': keys[i][0],
+        'channel': keys[i][1],
+        'value': float(values[i]),
+        'baseline': float(baselines[i])}
+        for i in np.flatnonzero(mask)]
+
+
+def bitrate_drops(store, window=60, ratio=0.5, metric='video_bitrate'):
+    """channels whose last bitrate is below ratio * mean of the window."""
+    (keys, m) = recent_matrix(store, metric, window)
+    if not keys:
+        return []
+    last = m[:, -1]
+    with np.errstate(invalid='ignore'):
+        baseline = np.nanmean(m[:, :-1], axis=1) if window > 1 \
+            else np.full(len(keys), np.nan)
+        mask = (baseline > 0) & (last < ratio * baseline)
+    return _flagged(BITRATE_DROP, keys, mask, last, baseline)
+
+
+def fps_deviations(store, expected_fps=30.0, tolerance=0.1):
+    """channels whose last fps deviates from expected by more than
+    tolerance (fraction of expected).
+
+    expected_fps: number for all channels, or dict
+        {(device, channel): fps}; channels missing in the dict are skipped.
+    """
+    (keys, m) = recent_matrix(store, 'fps', 1)
+    if not keys:
+        return []
+    last = m[:, -1]
+    if isinstance(expected_fps, dict):
+        expected = np.array(
+                [expected_fps.get(k, np.nan) for k in keys], dtype='d')
+    else:
+        expected = np.full(len(keys), float(expected_fps))
+    with np.errstate(invalid='ignore'):
+        mask = np.abs(last - expected) > tolerance * expected
+    return _flagged(FPS_DEVIATION, keys, mask, last, expected)
+
+
+def stalled_recorders(store, samples=3):
+    """channels recording for the last `samples` polls, but whose
+    recorder time did not increase in that span."""
+    (keys, time_m) = recent_matrix(store, 'recorder_time', samples)
+    (enabled_keys, enabled_m) = recent_matrix(
+            store, 'recorder_enabled', samples)
+    if not keys or keys != enabled_keys:
+        # align rows when some channels lack one of the series
+        common = sorted(set(keys) & set(enabled_keys))
+        if not common:
+            return []
+        time_m = time_m[[keys.index(k) for k in common]]
+        enabled_m = enabled_m[[enabled_keys.index(k) for k in common]]
+        keys = common
+    with np.errstate(invalid='ignore'):
+        recording = np.all(enabled_m == 1.0, axis=1)
+        mask = recording & (time_m[:, -1] <= time_m[:, 0])
+    return _flagged(RECORDER_STALLED, keys, mask, time_m[:, -1], time_m[:, 0])
+
+
+def detect_anomalies(
+        store, window=60, bitrate_ratio=0.5, expected_fps=30.0,
+        fps_tolerance=0.1, stall_samples=3):
+    """runs all checks on the whole store; returns list of dicts
+    {'type', 'device', 'channel', 'value', 'baseline'}."""
+    return bitrate_drops(store, window=window, ratio=bitrate_ratio) + \
+        fps_deviations(
+            store, expected_fps=expected_fps, tolerance=fps_tolerance) + \
+        stalled_recorders(store, samples=stall_samples)
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""incremental offload of recorder archives from many devices.
+
+works like rsync for recorder archives: a local index remembers what was
+already pulled from each device and recorder, so each run fetches only new
+files and the appended tail of files that grew since the last run.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+from urlparse import urlparse
+
+import requests
+
+from errors import TransferError
+from fleet import KeyedSemaphore
+from fleet import map_concurrently
+from transfer import file_hash
+from transfer import reopen_for_append
+
+logger = logging.getLogger(__name__)
+
+_index_filename = 'archive_index.json'
+
+
+class ArchiveIndex(object):
+    """local json record of archive files pulled from devices.
+
+    {device_url: {recorder_id: {filename: entry}}}, where entry is
+    {'listed_size', 'size', 'hash', 'hash_name', 'synced_at', 'deleted'};
+    listed_size is the size shown by the device web ui at sync time.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._data = {}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                self._data = json.load(f)
+
+    def get(self, device, recorder_id, name):
+        with self._lock:
+            return self._data.get(device, {}).get(
+                    str(recorder_id), {}).get(name)
+
+    def put(self, device, recorder_id, name, entry):
+        with self._lock:
+            self._data.setdefault(device, {}).setdefault(
+                    str(recorder_id), {})[name] = entry
+            self._save()
+
+    def _save(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self._data, f, indent=1, sort_keys=True)
+        os.rename(tmp, self.path)
+
+
+def local_path(dest_dir, device, recorder_id, name):
+    """returns dest_dir/<device host>/recorder<id>/<name>."""
+    host = urlparse(device).netloc or device
+    return os.path.join(
+            dest_dir, host.replace(':', '_'),
+            'recorder%s' % recorder_id, name)
+
+
+def plan_sync(client, index, recorder_ids=None, delete_verified=False):
+    """returns list of jobs for one device, comparing archive to index.
+
+    a job is a dict {'client', 'recorder_id', 'file', 'entry', 'action'}
+    where action is one of:
+        'download': file not in index
+        'resume': file listed with a different size than last run, or
+            without size; only bytes appended since are fetched
+        'delete': file unchanged since last run, i.e. done recording,
+            and delete_verified is set; listed sizes are rounded, so the
+            exact length is checked with the device before deleting
+    """
+    if recorder_ids is None:
+        recorder_ids = [r['id'] for r in client.get_infocfg()['recorders']]
+
+    jobs = []
+    for recorder_id in recorder_ids:
+        for f in client.list_recorder_files(recorder_id):
+            entry = index.get(client.url, recorder_id, f['name'])
+            if entry is None:
+                action = 'download'
+            elif entry['deleted']:
+                continue
+            elif f['size'] is None or f['size'] != entry['listed_size']:
+                action = 'resume'
+            elif delete_verified:
+                action = 'delete'
+            else:
+                continue
+            jobs.append({
+                'client': client, 'recorder_id': recorder_id,
+                'file': f, 'entry': entry, 'action': action})
+    return jobs
+
+
+def _archive_path(recorder_id, name):
+    return '/admin/recorder%s/archive/%s' % (recorder_id, name)
+
+
+def _grew(client, recorder_id, name, size):
+    """false if device file is exactly size bytes, i.e. a range request
+    past its end is refused with 416."""
+    try:
+        r = client.get(
+                _archive_path(recorder_id, name), stream=True,
+                extra_headers={'Accept-Encoding': 'identity',
+                               'Range': 'bytes=%d-' % size})
+    except requests.HTTPError as e:
+        if e.response is not None and e.response.status_code == 416:
+            return False
+        raise
+    r.close()
+    return True
+
+
+def _run_job(job, dest_dir, index, hash_name):
+    client = job['client']
+    recorder_id = job['recorder_id']
+    name = job['file']['name']
+    entry = job['entry']
+    dest = local_path(dest_dir, client.url, recorder_id, name)
+
+    if job['action'] == 'delete':
+        if file_hash(dest, entry['hash_name']) != entry['hash']:
+            msg = 'checksum mismatch for local copy(%s); not deleting %s' % (
+                    dest, name)
+            logger.error(msg)
+            raise TransferError(msg)
+        if not _grew(client, recorder_id, name, entry['size']):
+            client.delete_recorder_file(recorder_id, name)
+            entry = dict(entry, deleted=True)
+            index.put(client.url, recorder_id, name, entry)
+            return entry
+        # grew by less than the rounding of the listed size
+        logger.info('file(%s) in device(%s) grew past %s bytes; resuming '
+                    'instead of deleting' % (name, client.url, entry['size']))
+        job['action'] = 'resume'
+
+    if not os.path.isdir(os.path.dirname(dest)):
+        try:
+            os.makedirs(os.path.dirname(dest))
+        except OSError:
+            if not os.path.isdir(os.path.dirname(dest)):
+                raise
+    if job['action'] == 'resume' and os.path.exists(dest) and \
+            entry['hash_name'] == hash_name:
+        reopen_for_append(dest, entry['size'])
+
+    r = client.download_recorder_file(
+            recorder_id, name, dest, hash_name=hash_name)
+    entry = {
+            'listed_size': job['file']['size'],
+            'size': r['size'],
+            'hash': r['hash'],
+            'hash_name': hash_name,
+            'synced_at': time.time(),
+            'deleted': False}
+    index.put(client.url, recorder_id, name, entry)
+    return entry
+
+
+def _interleave(lists):
+    """round-robin merge, so consecutive jobs hit different devices."""
+    merged = []
+    for i in range(max([len(jobs) for jobs in lists] or [0])):
+        merged.extend([jobs[i] for jobs in lists if i < len(jobs)])
+    return merged
+
+
+def sync_archives(
+        clients, dest_dir, index_path=None, recorder_ids=None,
+        per_device=2, concurrency=8, delete_verified=False,
+        hash_name='sha256'):
+    """pulls new or grown recorder archive files from many devices.
+
+    clients: list of epipearl clients
+    dest_dir: local dir; files go to dest_dir/<host>/recorder<id>/<name>
+    index_path: defaults to dest_dir/archive_index.json
+    recorder_ids: recorders to sync; default is all recorders per device
+    per_device: max simultaneous transfers per device
+    concurrency: max simultaneous transfers overall
+    delete_verified: delete a file from device, once it stopped growing
+        and its local copy matches the recorded checksum.
+
+    returns list of dicts {'device', 'recorder_id', 'name', 'action',
+    'size', 'error'} for each file acted upon, plus an entry with only
+    'device' and 'error' for devices that could not be listed.
+    """
+    if not os.path.isdir(dest_dir):
+        os.makedirs(dest_dir)
+    index = ArchiveIndex(index_path or os.path.join(dest_dir, _index_filename))
+
+    results = []
+    planned = []
+    for (client, jobs, error) in map_concurrently(
+            lambda c: plan_sync(c, index, recorder_ids, delete_verified),
+            clients, concurrency=concurrency):
+        if error is not None:
+            logger.error('failed to list archives in device(%s) - %s' % (
+                client.url, error))
+            results.append({'device': client.url, 'error': str(error)})
+        else:
+            planned.append(jobs)
+
+    limiter = KeyedSemaphore(per_device)
+
+    def transfer(job):
+        with limiter.hold(job['client'].url):
+            return _run_job(job, dest_dir, index, hash_name)
+
+    for (job, entry, error) in map_concurrently(
+            transfer, _interleave(planned), concurrency=concurrency):
+        if error is not None:
+            logger.error('failed to %s file(%s) from device(%s) - %s' % (
+                job['action'], job['file']['name'], job['client'].url, error))
+        results.append({
+            'device': job['client'].url,
+            'recorder_id': job['recorder_id'],
+            'name': job['file']['name'],
+            'action': job['action'],
+            'size': entry['size'] if entry else None,
+            'error': str(error) if error is not None else None})
+    return results
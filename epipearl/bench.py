@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""small benchmark runner for client hot paths.
+
+measures ops/sec as the best of several timed rounds, plus allocations of
+one call, and compares results against a saved baseline so a change that
+slows a hot path by more than a threshold can fail a build.
+
+allocations are bytes and blocks from tracemalloc where the interpreter
+has it; otherwise the net count of new gc-tracked objects.
+"""
+
+import gc
+import json
+import math
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+_default_min_time = 0.2
+_default_rounds = 5
+_default_threshold = 0.2
+
+
+def _calibrate(func, min_time):
+    """iterations per round so a round takes at least min_time."""
+    n = 1
+    while True:
+        start = time.time()
+        for i in xrange(n):
+            func()
+        elapsed = time.time() - start
+        if elapsed >= min_time:
+            return n
+        n = n * 2 if elapsed < min_time / 10 else \
+            int(math.ceil(n * min_time / max(elapsed, 1e-9)))
+
+
+def measure_allocations(func):
+    """allocations of one call: dict {'bytes', 'blocks'} or {'objects'}."""
+    if tracemalloc is not None:
+        tracemalloc.start()
+        try:
+            before = tracemalloc.take_snapshot()
+            func()
+            after = tracemalloc.take_snapshot()
+        finally:
+            tracemalloc.stop()
+        stats = after.compare_to(before, 'filename')
+        return {
+                'bytes': sum(s.size_diff for s in stats if s.size_diff > 0),
+                'blocks': sum(s.count_diff for s in stats
+                              if s.count_diff > 0)}
+    enabled = gc.isenabled()
+    gc.collect()
+    gc.disable()
+    try:
+        before = len(gc.get_objects())
+        result = func()
+        after = len(gc.get_objects())
+    finally:
+        if enabled:
+            gc.enable()
+    del result
+    return {'objects': after - before}
+
+
+def run_benchmark(name, func, min_time=_default_min_time,
+                  rounds=_default_rounds):
+    """times func(); returns dict with ops/sec and per call stats."""
+    func()      # warm up caches and imports
+    n = _calibrate(func, min_time)
+    per_call = []
+    for r in range(rounds):
+        start = time.time()
+        for i in xrange(n):
+            func()
+        per_call.append((time.time() - start) / n)
+    mean = sum(per_call) / len(per_call)
+    stdev = math.sqrt(sum((t - mean) ** 2 for t in per_call) / len(per_call))
+    return {
+            'name': name,
+            'ops_per_sec': 1.0 / min(per_call),
+            'min': min(per_call),
+            'mean': mean,
+            'stdev': stdev,
+            'iterations': n,
+            'rounds': rounds,
+            'allocations': measure_allocations(func)}
+
+
+def run_suite(benchmarks, min_time=_default_min_time, rounds=_default_rounds):
+    """runs [(name, func)]; returns {name: result}."""
+    return dict(
+            (name, run_benchmark(name, func, min_time, rounds))
+            for (name, func) in benchmarks)
+
+
+def save_results(path, results):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def load_results(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def compare(results, baseline, threshold=_default_threshold):
+    """returns regressions: benchmarks whose ops/sec dropped by more than
+    threshold (fraction) from baseline; new benchmarks are ignored.
+
+    each regression is a dict {'name', 'ops_per_sec', 'baseline', 'change'}.
+    """
+    regressions = []
+    for (name, r) in sorted(results.items()):
+        base = baseline.get(name)
+        if not base or not base.get('ops_per_sec'):
+            continue
+        change = r['ops_per_sec'] / base['ops_per_sec'] - 1.0
+        if change < -threshold:
+            regressions.append({
+                'name': name, 'ops_per_sec': r['ops_per_sec'],
+                'baseline': base['ops_per_sec'], 'change': change})
+    return regressions
+
+
+def format_results(results, baseline=None):
+    """text table of results, with change against baseline if given."""
+    lines = ['%-36s %12s %12s %14s %9s' % (
+        'benchmark', 'ops/sec', 'mean(us)', 'allocations', 'change')]
+    for (name, r) in sorted(results.items()):
+        alloc = r['allocations']
+        alloc = '%sB/%s' % (alloc['bytes'], alloc['blocks']) \
+            if 'bytes' in alloc else '%s objs' % alloc['objects']
+        change = ''
+        base = (baseline or {}).get(name)
+        if base and base.get('ops_per_sec'):
+            change = '%+.1f%%' % (
+                    100.0 * (r['ops_per_sec'] / base['ops_per_sec'] - 1))
+        lines.append('%-36s %12.1f %12.1f %14s %9s' % (
+            name, r['ops_per_sec'], r['mean'] * 1e6, alloc, change))
+    return '\n'.join(lines)
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""firmware capability detection, cached per device and firmware version.
+
+endpoints were written against firmware 3.15.3f, and mhcfg exists only in
+dce custom firmware. a probe reads firmware version and product from
+sysinfo and checks which optional endpoints the device serves; a client
+created with capabilities=Capabilities() then fails fast with
+UnsupportedOperationError rather than sending calls the device cannot
+serve:
+
+    caps = Capabilities(store=StateCache('state.db'))   # store is optional
+    c = Epipearl(url, user, passwd, capabilities=caps)
+    c.set_mhpearl_settings(...)     # raises at once on stock firmware
+"""
+
+import logging
+import threading
+import time
+
+import requests
+
+from endpoints.admin import AdminAjax
+from errors import UnsupportedOperationError
+
+logger = logging.getLogger(__name__)
+
+# feature: (path of endpoint, text expected in its page)
+endpoint_probes = {
+        'mhcfg': ('admin/mhcfg', 'mh_host'),
+}
+
+_default_recheck_interval = 600.0
+_default_unknown_ttl = 60.0
+
+
+def _get(client, path):
+    """response of GET path, or None if device has no such endpoint."""
+    try:
+        return client.get(path)
+    except requests.HTTPError as e:
+        if e.response is not None and e.response.status_code == 404:
+            return None
+        raise
+
+
+def _read_sysinfo(client):
+    r = _get(client, AdminAjax.sysinfo_path)
+    if r is None:
+        return None
+    try:
+        return r.json()
+    except ValueError:
+        return None
+
+
+def _version(sysinfo):
+    return (sysinfo or {}).get('system', {}).get('firmware', {}).get(
+            'version')
+
+
+def _describe(client, sysinfo):
+    info = {
+            'firmware_version': _version(sysinfo),
+            'product': (sysinfo or {}).get('system', {}).get('product'),
+            'features': {'sysinfo_json': sysinfo is not None}}
+    for (feature, (path, marker)) in endpoint_probes.items():
+        r = _get(client, path)
+        info['features'][feature] = r is not None and marker in r.text
+    return info
+
+
+def probe(client):
+    """reads firmware and optional endpoints of client device.
+
+    returns dict
+        {'firmware_version': str, 'product': str,
+         'features': {'sysinfo_json': bool, 'mhcfg': bool}}
+    where version and product are None without sysinfo json. errors other
+    than a missing endpoint, e.g. a refused connection, are raised.
+    """
+    return _describe(client, _read_sysinfo(client))
+
+
+class Capabilities(object):
+    """probed capabilities of devices, shared by many clients.
+
+    each device is probed on its first check; endpoints are probed once per
+    firmware version, and later only its sysinfo is read to learn the
+    version.
+
+    store: optional state_cache.StateCache to keep probe results across
+        processes, as key 'capabilities/<firmware version>' of device url
+    recheck_interval: seconds before the firmware version of a device is
+        read again; a new version is probed again
+    unknown_ttl: seconds to keep results probed without a firmware
+        version, e.g. while the device reboots and has no sysinfo yet
+    """
+
+    def __init__(self, store=None, recheck_interval=_default_recheck_interval,
+                 unknown_ttl=_default_unknown_ttl):
+        self.store = store
+        self.recheck_interval = recheck_interval
+        self.unknown_ttl = unknown_ttl
+        self._devices = {}
+        self._probing = {}
+        self._lock = threading.Lock()
+
+    def _cached(self, url):
+        """(info, fresh) known for device url, or (None, False)."""
+        entry = self._devices.get(url)
+        if entry is None:
+            return (None, False)
+        return (entry['info'], entry['expires'] > time.time())
+
+    def get(self, client):
+        """probe result for client device; see probe()."""
+        with self._lock:
+            (info, fresh) = self._cached(client.url)
+            if fresh:
+                return info
+            lock = self._probing.setdefault(client.url, threading.Lock())
+        with lock:
+            with self._lock:
+                (info, fresh) = self._cached(client.url)
+            if fresh:
+                return info
+            sysinfo = _read_sysinfo(client)
+            if info is None or info['firmware_version'] is None or \
+                    _version(sysinfo) != info['firmware_version']:
+                info = self._probe(client, sysinfo)
+            ttl = self.unknown_ttl if info['firmware_version'] is None \
+                else self.recheck_interval
+            with self._lock:
+                self._devices[client.url] = {
+                        'info': info, 'expires': time.time() + ttl}
+        return info
+
+    def _probe(self, client, sysinfo):
+        key = 'capabilities/%s' % _version(sysinfo)
+        cached = self.store is not None and _version(sysinfo) is not None
+        if cached:
+            entry = self.store.get(client.url, key)
+            if entry is not None:
+                return entry[0]
+        info = _describe(client, sysinfo)
+        logger.info('device(%s) firmware(%s) capabilities: %s' % (
+            client.url, info['firmware_version'], info['features']))
+        if cached:
+            self.store.put(client.url, key, info)
+        return info
+
+    def supports(self, client, feature):
+        """false if device lacks feature; features not probed are true."""
+        return self.get(client)['features'].get(feature, True)
+
+    def require(self, client, feature, operation):
+        """raises UnsupportedOperationError if device lacks feature."""
+        if self.supports(client, feature):
+            return
+        info = self.get(client)
+        msg = '%s not supported by device(%s) product(%s) firmware(%s) ' \
+            '- no %s' % (operation, client.url, info['product'],
+                         info['firmware_version'], feature)
+        logger.error(msg)
+        raise UnsupportedOperationError(msg)
+
+    def forget(self, url):
+        """drops what is known of device, e.g. after a firmware update."""
+        with self._lock:
+            self._devices.pop(url, None)
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""epipearl command line: run calls across a fleet of devices.
+
+devices come from an inventory json file (see fleet.load_inventory); the
+call runs on up to --concurrency devices at a time, and one json line per
+device is printed as soon as its call completes:
+
+    {"device": "room-101", "url": "http://10.0.0.1", "ok": true,
+     "result": {...}, "error": null, "elapsed": 0.25}
+
+exit status is 1 if the call failed on any device.
+
+    epipearl -i devices.json get-params 1 publish_type rec_enabled
+    epipearl -i devices.json set-params 1 publish_type=6
+    epipearl -i devices.json provision --spec room.json
+    epipearl -i devices.json --only room-101 reboot
+    epipearl -i devices.json clone --golden room-101
+"""
+
+import argparse
+import json
+import logging
+import sys
+import time
+
+from fleet import clients_from_inventory
+from fleet import load_inventory
+from fleet import map_concurrently
+from fleet import provision
+from reachability import NegativeCache
+
+_default_concurrency = 16
+
+
+def _key_values(pairs):
+    params = {}
+    for pair in pairs:
+        if '=' not in pair:
+            raise argparse.ArgumentTypeError(
+                    'expected key=value, got(%s)' % pair)
+        (key, value) = pair.split('=', 1)
+        params[key] = value
+    return params
+
+
+def get_params(client, device, args):
+    return client.get_params(args.channel, dict((k, '') for k in args.keys))
+
+
+def set_params(client, device, args):
+    return client.set_params(args.channel, _key_values(args.params))
+
+
+def inventory(client, device, args):
+    sysinfo = client.get_sysinfo()
+    infocfg = client.get_infocfg()
+    return {
+            'firmware_version': sysinfo.get('system', {}).get(
+                'firmware', {}).get('version'),
+            'channels': infocfg.get('channels', []),
+            'recorders': infocfg.get('recorders', []),
+            'sources': infocfg.get('sources', [])}
+
+
+def capabilities(client, device, args):
+    from capabilities import probe
+    return probe(client)
+
+
+def provision_device(client, device, args):
+    return provision(
+            client, args.spec_data, replace=not args.keep_existing,
+            name=device['name'])
+
+
+def reboot(client, device, args):
+    return client.reboot()
+
+
+def delete_by_name(client, device, args):
+    return client.delete_channel_or_recorder_by_name(args.name)
+
+
+def snapshot(client, device, args):
+    from snapshot import take_snapshot
+    return take_snapshot(client, secrets=args.secrets)
+
+
+def clone_device(client, device, args):
+    from clone import clone
+    return clone(args.golden_snapshot, client, dry_run=args.dry_run)
+
+
+def _golden_snapshot(args):
+    """snapshot of the golden device, from inventory or file."""
+    from snapshot import pick
+    from snapshot import load
+    from snapshot import take_snapshot
+    if args.golden_snapshot_file:
+        return pick(load(args.golden_snapshot_file), None)
+    devices = [d for d in load_inventory(args.inventory)
+               if args.golden in (d['name'], d['url'])]
+    if not devices:
+        raise ValueError('golden device(%s) not in inventory' % args.golden)
+    (client,) = clients_from_inventory(
+            devices[:1], timeout=args.timeout,
+            connect_timeout=args.connect_timeout)
+    return take_snapshot(client, secrets=True)
+
+
+def _parser():
+    parser = argparse.ArgumentParser(
+            prog='epipearl',
+            description='run epiphan pearl calls across a fleet of devices')
+    parser.add_argument('-i', '--inventory', required=True,
+                        help='json file with devices')
+    parser.add_argument('-c', '--concurrency', type=int,
+                        default=_default_concurrency,
+                        help='devices called at the same time')
+    parser.add_argument('--timeout', type=float,
+                        help='seconds to wait for each device response')
+    parser.add_argument('--connect-timeout', type=float,
+                        help='seconds to wait for each device connection')
+    parser.add_argument('--unreachable-window', type=float, default=30.0,
+                        help='seconds calls to a device that failed to '
+                        'connect fail fast')
+    parser.add_argument('--only', action='append', metavar='NAME',
+                        help='run only on device with this name or url; '
+                        'can be repeated')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    commands = parser.add_subparsers(dest='command', metavar='command')
+
+    p = commands.add_parser('get-params', help='get channel params')
+    p.add_argument('channel', help="channel id; 'm<id>' for a recorder")
+    p.add_argument('keys', nargs='*', help='params to get; all if none')
+    p.set_defaults(func=get_params)
+
+    p = commands.add_parser('set-params', help='set channel params')
+    p.add_argument('channel', help="channel id; 'm<id>' for a recorder")
+    p.add_argument('params', nargs='+', metavar='key=value')
+    p.set_defaults(func=set_params)
+
+    p = commands.add_parser(
+            'inventory', help='firmware, channels, recorders and sources')
+    p.set_defaults(func=inventory)
+
+    p = commands.add_parser(
+            'capabilities', help='firmware, product and optional endpoints '
+            'like mhcfg')
+    p.set_defaults(func=capabilities)
+
+    p = commands.add_parser(
+            'provision', help='configure devices from a json spec',
+            description='configure devices from a json spec; see '
+            'fleet.provision for its format. {name} in spec strings is '
+            'replaced by the device name.')
+    p.add_argument('--spec', required=True, help='json file with spec')
+    p.add_argument('--keep-existing', action='store_true',
+                   help='do not delete channels and recorders named in spec')
+    p.set_defaults(func=provision_device)
+
+    p = commands.add_parser('reboot', help='reboot devices')
+    p.set_defaults(func=reboot)
+
+    p = commands.add_parser(
+            'delete-by-name', help='delete channels and recorders by name')
+    p.add_argument('name')
+    p.set_defaults(func=delete_by_name)
+
+    p = commands.add_parser(
+            'snapshot', help='all settings of channels, recorders and '
+            'config forms')
+    p.add_argument('--save', metavar='PATH',
+                   help='also save snapshots by device url to file; '
+                   'gzipped if PATH ends in .gz')
+    p.add_argument('--secrets', action='store_true',
+                   help='keep password fields; redacted by default')
+    p.set_defaults(func=snapshot)
+
+    p = commands.add_parser(
+            'clone', help='configure devices like a golden device',
+            description='copy channels, layouts, rtmp, recorder settings, '
+            'ntp, touchscreen and mhcfg of a golden device; only settings '
+            'that differ are written.')
+    golden = p.add_mutually_exclusive_group(required=True)
+    golden.add_argument('--golden', metavar='NAME',
+                        help='golden device name or url in inventory')
+    golden.add_argument('--golden-snapshot', metavar='PATH',
+                        dest='golden_snapshot_file',
+                        help='file with snapshot of golden device')
+    p.add_argument('--dry-run', action='store_true',
+                   help='print steps without applying them')
+    p.set_defaults(func=clone_device)
+    return parser
+
+
+def run(args, out=sys.stdout):
+    """runs parsed args; writes json lines to out.
+
+    returns number of devices where the call failed.
+    """
+    devices = load_inventory(args.inventory)
+    if args.only:
+        devices = [d for d in devices
+                   if d['name'] in args.only or d['url'] in args.only]
+    clients = clients_from_inventory(
+            devices, timeout=args.timeout,
+            connect_timeout=args.connect_timeout,
+            negative_cache=NegativeCache(window=args.unreachable_window))
+    by_client = dict(zip(map(id, clients), devices))
+
+    def call(client):
+        start = time.time()
+        try:
+            return (args.func(client, by_client[id(client)], args), None,
+                    time.time() - start)
+        except Exception as e:
+            return (None, e, time.time() - start)
+
+    save = getattr(args, 'save', None)
+    results = {}
+    failed = 0
+    for (client, (result, error, elapsed), e) in map_concurrently(
+            call, clients, concurrency=args.concurrency):
+        device = by_client[id(client)]
+        if error is not None:
+            failed += 1
+        elif save:
+            results[device['url']] = result
+        out.write(json.dumps({
+            'device': device['name'],
+            'url': device['url'],
+            'ok': error is None,
+            'result': result,
+            'error': None if error is None else '%s: %s' % (
+                error.__class__.__name__, error),
+            'elapsed': round(elapsed, 6)}, sort_keys=True) + '\n')
+        out.flush()
+    if save:
+        from snapshot import save as save_snapshots
+        save_snapshots(save, results)
+    return failed
+
+
+def main(argv=None, out=sys.stdout):
+    parser = _parser()
+    args = parser.parse_args(argv)
+    if args.func is set_params:
+        try:
+            _key_values(args.params)
+        except argparse.ArgumentTypeError as e:
+            parser.error(str(e))
+    if args.func is provision_device:
+        with open(args.spec, 'r') as f:
+            args.spec_data = json.load(f)
+
+    logging.basicConfig(
+            level=logging.INFO if args.verbose else logging.CRITICAL)
+    if args.func is clone_device:
+        args.golden_snapshot = _golden_snapshot(args)
+    return 1 if run(args, out=out) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+"""golden-device cloning: copies one device's configuration onto others.
+
+the golden device and each target are read with snapshot.take_snapshot;
+channels and recorders are matched by name, so ids are translated to the
+ones in the target, and only settings that differ are written. names shared
+by several channels are keyed 'name#id' in the golden, as in snapshot diffs,
+and matched to the target channels of that name in id order:
+
+    channels: params, layout, rtmp
+    recorders: channels, archive settings
+    forms: ntp server and timezone, touchscreen timeout, mhcfg
+
+channels and recorders missing in a target are created; extra ones are left
+alone. mhcfg keeps the device name of the target, unless one is given.
+passwords redacted in the golden snapshot are left as they are in targets;
+a golden client is read with its passwords.
+
+    from epipearl.clone import clone_fleet
+    results = clone_fleet(golden_client, target_clients, concurrency=8)
+"""
+
+import json
+import logging
+
+from errors import SettingConfigError
+from fleet import KeyedSemaphore
+from fleet import map_concurrently
+from snapshot import _name_keys
+from snapshot import redacted
+from snapshot import take_snapshot
+
+logger = logging.getLogger(__name__)
+
+_default_concurrency = 16
+
+# params that are device state rather than settings, e.g. recording now
+_state_params = ('rec_enabled',)
+
+_rtmp_args = (
+        ('rtmp_url', 'rtmp_url'), ('rtmp_stream', 'rtmp_stream'),
+        ('rtmp_username', 'rtmp_usr'), ('rtmp_password', 'rtmp_pwd'))
+
+# mhcfg form field name to set_mhpearl_settings arg; DEVICE_USERNAME and
+# DEVICE_PASSWORD are always the credentials of the client
+_mhcfg_args = (
+        ('FILE_SEARCH_RANGE', 'file_search_range_in_seconds'),
+        ('ADMIN_SERVER_URL', 'admin_server_url'),
+        ('ADMIN_SERVER_USER', 'admin_server_usr'),
+        ('ADMIN_SERVER_PASSWD', 'admin_server_pwd'),
+        ('UPDATE_FREQUENCY', 'update_frequency_in_seconds'))
+
+
+def _id_order(item_id):
+    """sort key of numeric id strings."""
+    return (len(item_id), item_id)
+
+
+def _target_keys(items, golden_items, golden_keys):
+    """{id: key} of target channels or recorders, keyed like golden.
+
+    the target items of a name take the keys golden has for that name, in
+    id order; extra items of a name shared with golden get (name, id),
+    which matches no golden key.
+    """
+    wanted = {}
+    for i in sorted(golden_items, key=_id_order):
+        wanted.setdefault(golden_items[i]['name'], []).append(golden_keys[i])
+    keys = _name_keys(items)
+    for i in sorted(items, key=_id_order):
+        name = items[i]['name']
+        if name in wanted:
+            keys[i] = wanted[name].pop(0) if wanted[name] else (name, i)
+    return keys
+
+
+def _by_name(snap, kind, keys):
+    return dict((keys[i], (i, item)) for (i, item) in snap[kind].items())
+
+
+def _params(item):
+    return dict((k, v) for (k, v) in item.get('params', {}).items()
+                if k not in _state_params)
+
+
+def _changed_params(golden, target):
+    want = _params(golden)
+    have = _params(target) if 'params' in target else {}
+    return dict((k, v) for (k, v) in want.items() if have.get(k) != v)
+
+
+def _rtmp(channel):
+    form = channel.get('streamsetup', {})
+    return dict((arg, form.get(field, '')) for (field, arg) in _rtmp_args)
+
+
+def _unredacted(want, have):
+    """want, with the redacted values taken from have."""
+    return dict((k, have.get(k, '') if v == redacted else v)
+                for (k, v) in want.items())
+
+
+def _timelimit_minutes(timelimit):
+    """minutes in a recorder time limit, 'MM:SS' or 'H:MM:SS'."""
+    fields = [int(f) for f in timelimit.split(':')]
+    if len(fields) == 2:
+        fields.insert(0, 0)
+    (hours, minutes, seconds) = fields
+    return hours * 60 + minutes + seconds // 60
+
+
+def recorder_settings(archive):
+    """set_recorder_settings args from the recorder archive form values."""
+    return {
+            'recording_timelimit_in_minutes': _timelimit_minutes(
+                archive['timelimit']),
+            'recording_sizelimit_in_kbytes': int(archive['sizelimit']),
+            'output_format': archive['output_format'],
+            'user_prefix': archive.get('user_prefix', ''),
+            # '' when the box is checked, that is auto-upload on
+            'afu_enabled': archive.get('afu_enabled', 'on'),
+            # set_recorder_settings cannot enable upnp
+            'upnp_enabled': ''}
+
+
+def _mhpearl(form, recorder_names):
+    """set_mhpearl_settings args from the mhcfg form values."""
+    args = dict((arg, form.get(field, '')) for (field, arg) in _mhcfg_args)
+    args['device_name'] = form.get('DEVICE_NAME', '')
+    args['device_channel'] = recorder_names.get(
+            form.get('DEVICE_CHANNEL', ''), form.get('DEVICE_CHANNEL', ''))
+    args['backup_agent'] = bool(form.get('BACKUP_AGENT'))
+    return args
+
+
+def plan_clone(golden, target, device_name=None):
+    """steps to make target configured like golden; both are snapshots.
+
+    device_name: mhcfg device name for target; keeps the current if None
+
+    returns {'ids': {'channels': {name: id}, 'recorders': {name: id}},
+             'steps': [step]}
+    where ids are those already in target and each step is a dict
+        {'op': client method, 'channel': name, 'recorder': name,
+         'channels': [name], 'args': {..}}
+    with channel and recorder names to be translated to target ids; names
+    shared by several golden channels or recorders are 'name#id'. create
+    steps also hold the 'name' to create.
+    """
+    steps = []
+    ids = {'channels': {}, 'recorders': {}}
+    keys = {}
+    for kind in ('channels', 'recorders'):
+        golden_keys = _name_keys(golden[kind])
+        keys[kind] = (golden_keys, _target_keys(
+            target[kind], golden[kind], golden_keys))
+    have_channels = _by_name(target, 'channels', keys['channels'][1])
+    have_recorders = _by_name(target, 'recorders', keys['recorders'][1])
+
+    for (name, (cid, channel)) in sorted(
+            _by_name(golden, 'channels', keys['channels'][0]).items()):
+        if name in have_channels:
+            (ids['channels'][name], have) = have_channels[name]
+        else:
+            steps.append({'op': 'create_channel', 'channel': name,
+                          'name': channel['name']})
+            have = {}
+        params = _changed_params(channel, have)
+        if params:
+            steps.append({'op': 'set_params', 'channel': name,
+                          'args': {'params': params}})
+        layout = channel.get('layout')
+        if layout and layout != have.get('layout'):
+            if not isinstance(layout, basestring):
+                layout = json.dumps(layout)
+            steps.append({'op': 'set_channel_layout', 'channel': name,
+                          'args': {'layout': layout}})
+        if 'streamsetup' in channel:
+            rtmp = _unredacted(_rtmp(channel), _rtmp(have))
+            if rtmp != _rtmp(have):
+                steps.append({'op': 'set_channel_rtmp', 'channel': name,
+                              'args': rtmp})
+
+    (golden_names, target_names) = keys['channels']
+    for (name, (rid, recorder)) in sorted(
+            _by_name(golden, 'recorders', keys['recorders'][0]).items()):
+        if name in have_recorders:
+            (ids['recorders'][name], have) = have_recorders[name]
+        else:
+            steps.append({'op': 'create_recorder', 'recorder': name,
+                          'name': recorder['name']})
+            have = {}
+        params = _changed_params(recorder, have)
+        if params:
+            steps.append({'op': 'set_params', 'recorder': name,
+                          'args': {'params': params}})
+        archive = recorder.get('archive')
+        if archive is None:
+            continue
+        channels = sorted(golden_names[c] for c in archive.get('rc[]', [])
+                          if c in golden_names)
+        if channels != sorted(
+                target_names[c] for c in have.get('archive', {}).get(
+                    'rc[]', []) if c in target_names):
+            steps.append({'op': 'set_recorder_channels', 'recorder': name,
+                          'channels': channels})
+        settings = recorder_settings(archive)
+        if 'archive' not in have or \
+                settings != recorder_settings(have['archive']):
+            steps.append({'op': 'set_recorder_settings', 'recorder': name,
+                          'args': settings})
+
+    want = golden['forms'].get('timesynccfg', {})
+    have = target['forms'].get('timesynccfg', {})
+    if want.get('server') and want.get('rdate_proto', 'NTP') == 'NTP' and \
+            [want.get(k) for k in ('server', 'tz', 'rdate_proto')] != \
+            [have.get(k) for k in ('server', 'tz', 'rdate_proto')]:
+        steps.append({'op': 'set_ntp', 'args': {
+            'server': want['server'], 'timezone': want['tz']}})
+
+    want = golden['forms'].get('touchscreencfg', {})
+    have = target['forms'].get('touchscreencfg', {})
+    if want.get('epiScreenTimeout') and \
+            want['epiScreenTimeout'] != have.get('epiScreenTimeout'):
+        steps.append({'op': 'set_touchscreen', 'args': {
+            'screen_timeout': int(want['epiScreenTimeout'])}})
+
+    if 'ADMIN_SERVER_URL' in golden['forms'].get('mhcfg', {}):
+        (recorder_names, target_recorder_names) = keys['recorders']
+        want = _mhpearl(golden['forms']['mhcfg'], recorder_names)
+        have = _mhpearl(
+                target['forms'].get('mhcfg', {}), target_recorder_names)
+        if device_name is not None:
+            want['device_name'] = device_name
+        else:
+            want['device_name'] = have['device_name']
+        want = _unredacted(want, have)
+        if want != have:
+            step = {'op': 'set_mhpearl_settings', 'args': want}
+            if want['device_channel'] in recorder_names.values():
+                step['recorder'] = want.pop('device_channel')
+            steps.append(step)
+
+    return {'ids': ids, 'steps': steps}
+
+
+def _call_args(step, ids):
+    """args of client call for step, with names translated to ids."""
+    args = dict(step.get('args', {}))
+    op = step['op']
+    if op == 'set_params':
+        if 'channel' in step:
+            args['channel'] = ids['channels'][step['channel']]
+        else:
+            args['channel'] = 'm' + ids['recorders'][step['recorder']]
+    elif op == 'set_mhpearl_settings':
+        if 'recorder' in step:
+            args['device_channel'] = ids['recorders'][step['recorder']]
+    else:
+        if 'channel' in step:
+            args['channel_id'] = ids['channels'][step['channel']]
+        if 'recorder' in step:
+            args['recorder_id'] = ids['recorders'][step['recorder']]
+        if 'channels' in step:
+            args['channel_list'] = [
+                    ids['channels'][name] for name in step['channels']]
+    return args
+
+
+def apply_plan(client, plan):
+    """runs plan steps in order on client device.
+
+    returns dict {'channels': {name: id}, 'recorders': {name: id}} of the
+    channels and recorders in plan, including the ones created.
+    """
+    ids = {'channels': dict(plan['ids']['channels']),
+           'recorders': dict(plan['ids']['recorders'])}
+    for step in plan['steps']:
+        op = step['op']
+        if op == 'create_channel':
+            ids['channels'][step['channel']] = client.create_channel(
+                    step.get('name', step['channel']))
+        elif op == 'create_recorder':
+            ids['recorders'][step['recorder']] = client.create_recorder(
+                    step.get('name', step['recorder']))
+        else:
+            r = getattr(client, op)(**_call_args(step, ids))
+            if op == 'set_params' and not r:
+                # set_params returns false rather than raise
+                msg = 'set_params failed in device(%s) for %s' % (
+                        client.url, step.get('channel') or step['recorder'])
+                logger.error(msg)
+                raise SettingConfigError(msg)
+    return ids
+
+
+def clone(golden, client, device_name=None, dry_run=False):
+    """configures client device like golden, a snapshot.
+
+    returns dict {'steps': [..], 'ids': {..}}; see plan_clone. with
+    dry_run, steps are planned but not applied.
+    """
+    plan = plan_clone(golden, take_snapshot(client, secrets=True),
+                      device_name=device_name)
+    if not dry_run:
+        plan['ids'] = apply_plan(client, plan)
+    return plan
+
+
+def clone_fleet(
+        golden, clients, concurrency=_default_concurrency, device_names=None,
+        dry_run=False, limiter=None, tracer=None):
+    """configures many devices like golden, concurrently.
+
+    golden: client of the reference device, or a snapshot of it, e.g.
+        loaded from a file saved by the snapshot command
+    device_names: optional dict {client.url: mhcfg device name}
+    limiter: optional fleet.KeyedSemaphore to share with other jobs; calls
+        to a device are serialized, one clone at a time per device url
+
+    returns dict {client.url: {'steps', 'ids', 'error'}}, where error is
+    None or the error string of a device that failed; steps done before
+    the error are kept in the device.
+    """
+    if not isinstance(golden, dict):
+        golden = take_snapshot(golden, secrets=True)
+    device_names = device_names or {}
+    limiter = limiter or KeyedSemaphore(1)
+
+    def clone_one(client):
+        with limiter.hold(client.url):
+            return clone(golden, client, dry_run=dry_run,
+                         device_name=device_names.get(client.url))
+
+    results = {}
+    for (client, plan, error) in map_concurrently(
+            clone_one, clients, concurrency=concurrency,
+            tracer=tracer, name='clone'):
+        if error is not None:
+            logger.error('failed to clone into device(%s) - %s' % (
+                client.url, error))
+            results[client.url] = {
+                    'steps': None, 'ids': None, 'error': str(error)}
+        else:
+            plan['error'] = None
+            results[client.url] = plan
+    return results
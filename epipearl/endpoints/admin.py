@@ -1,6 +1,11 @@
 # -*- coding: utf-8 -*-
 """http api calls to epiphan pearl."""
 
+import logging
+
+from epipearl.errors import IndiscernibleResponseFromWebUiError
+from epipearl.metrics import operation
+
 
 class Admin(object):
     """calls to admin api documented in epiphan user guide.
@@ -19,6 +24,7 @@ class Admin(object):
     """
 
     @classmethod
+    @operation('get_params')
     def get_params(cls, client, channel, params=None):
         if params is None:
             params = {}
@@ -30,6 +36,7 @@ class Admin(object):
                 'response_text': r.text}
 
     @classmethod
+    @operation('set_params')
     def set_params(cls, client, channel, params):
         r = client.get(
                 'admin/channel%s/set_params.cgi' % channel,
@@ -42,10 +49,29 @@ class Admin(object):
 class AdminAjax(object):
     """non documented ajax calls to epiphan pearl."""
 
+    sysinfo_path = 'admin/sysinfo.cgi'
+
+    @classmethod
+    @operation('get_sysinfo')
+    def get_sysinfo(cls, client):
+        """returns dict with device system info json.
+
+        e.g. firmware version is in sysinfo['system']['firmware']['version']
+        """
+        r = client.get(cls.sysinfo_path)
+        try:
+            return r.json()
+        except ValueError as e:
+            msg = 'failed call to %s/%s - expect json response: %s' % (
+                    client.url, cls.sysinfo_path, e)
+            logging.getLogger(__name__).error(msg)
+            raise IndiscernibleResponseFromWebUiError(msg)
+
     @classmethod
+    @operation('reboot')
     def reboot(cls, client):
         r = client.get('admin/reboot.cgi?noaction=yes')
-        if r.status_code == 200 and 'Rebooting...' in r.text():
+        if r.status_code == 200 and 'Rebooting...' in r.text:
             return {'status_code': 200, 'error_msg': '', 'response': None}
         else:
             # TODO: what kind of errors can happen in this call???
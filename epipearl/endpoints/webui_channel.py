@@ -1,12 +1,14 @@
 # -*- coding: utf-8 -*-
 """http api and web ui calls to epiphan pearl."""
 
-from bs4 import BeautifulSoup
 import logging
 import re
 
 from epipearl.errors import IndiscernibleResponseFromWebUiError
+from epipearl.errors import SettingConfigError
 from epipearl.endpoints.webui_config import WebUiConfig
+from epipearl.metrics import operation
+from epipearl.metrics import parse_html
 
 logger = logging.getLogger(__name__)
 
@@ -23,6 +25,7 @@ class WebUiChannel(object):
     """
 
     @classmethod
+    @operation('create_channel_or_recorder')
     def create_channel_or_recorder(cls, client, create_channel=True):
         """returns channel_id or recorder_id just created or exception."""
         path = '/admin/add_recorder.cgi'
@@ -79,12 +82,14 @@ class WebUiChannel(object):
 
 
     @classmethod
+    @operation('create_channel')
     def create_channel(cls, client):
         """returns channel_id just created or exception."""
         return cls.create_channel_or_recorder(client)
 
 
     @classmethod
+    @operation('rename_channel')
     def rename_channel(cls, client, channel_id, channel_name):
         """returns channel_name when success."""
         path = '/admin/ajax/rename_channel.cgi'
@@ -94,6 +99,7 @@ class WebUiChannel(object):
 
 
     @classmethod
+    @operation('set_channel_layout')
     def set_channel_layout(cls, client, channel_id, layout, layout_id='1'):
         """returns the json layout set.
 
@@ -108,6 +114,21 @@ class WebUiChannel(object):
 
 
     @classmethod
+    @operation('get_channel_layout')
+    def get_channel_layout(cls, client, channel_id, layout_id='1'):
+        """returns the json layout string of channel."""
+        path = '/admin/channel%s/layouts/%s' % (channel_id, layout_id)
+        r = client.get(path=path)
+        if r.status_code != 200:
+            msg = 'error in call %s/%s - response status(%s)' % (
+                    client.url, path, r.status_code)
+            logger.error(msg)
+            raise IndiscernibleResponseFromWebUiError(msg)
+        return r.text
+
+
+    @classmethod
+    @operation('set_channel_rtmp')
     def set_channel_rtmp(
             cls, client, channel_id,
             rtmp_url, rtmp_stream, rtmp_usr, rtmp_pwd):
@@ -147,6 +168,7 @@ class WebUiChannel(object):
 
 
     @classmethod
+    @operation('delete_channel')
     def delete_channel(cls, client, channel_id):
         """returns true or raises exception.
 
@@ -188,16 +210,19 @@ class WebUiChannel(object):
 
 
     @classmethod
+    @operation('create_recorder')
     def create_recorder(cls, client):
         return cls.create_channel_or_recorder(client, create_channel=False)
 
 
     @classmethod
+    @operation('rename_recorder')
     def rename_recorder(cls, client, recorder_id, recorder_name):
         return cls.rename_channel(client, 'm%s' % recorder_id, recorder_name)
 
 
     @classmethod
+    @operation('set_recorder_channels')
     def set_recorder_channels(cls, client, recorder_id, channel_list):
         """returns true or raise exception."""
 
@@ -224,6 +249,7 @@ class WebUiChannel(object):
 
 
     @classmethod
+    @operation('set_recorder_settings')
     def set_recorder_settings(
             cls, client,
             recorder_id,  # number id (without usual prefix 'm')
@@ -242,9 +268,13 @@ class WebUiChannel(object):
         # -- to be implemented in epipearl.endpoints.webui_config.
         #
 
-        timelimit = '%d:%02d:00' % (
-                recording_timelimit_in_minutes / 60,
-                recording_timelimit_in_minutes % 60)
+        # the device lists limits under an hour as MM:SS
+        if recording_timelimit_in_minutes < 60:
+            timelimit = '%02d:00' % recording_timelimit_in_minutes
+        else:
+            timelimit = '%d:%02d:00' % (
+                    recording_timelimit_in_minutes / 60,
+                    recording_timelimit_in_minutes % 60)
 
         check_success = [
                 {
@@ -309,6 +339,7 @@ class WebUiChannel(object):
 
 
     @classmethod
+    @operation('delete_recorder')
     def delete_recorder(cls, client, recorder_id):
         """returns true or raises exception.
 
@@ -360,6 +391,7 @@ class WebUiChannel(object):
         return resp
 
     @classmethod
+    @operation('get_infocfg')
     def get_infocfg(cls, client):
         """scrape infocfg ui page to get channel/recorder ids."""
         path = 'admin/infocfg'
@@ -372,7 +404,7 @@ class WebUiChannel(object):
             raise IndiscernibleResponseFromWebUiError(msg)
 
         # parse page to find channel info
-        soup = BeautifulSoup(r.text, 'html.parser')
+        soup = parse_html(client, r.text)
         infocfg = {
                 'channels': cls._find_channels_with_prefix(
                     soup, 'menu_channel_'),
@@ -383,3 +415,86 @@ class WebUiChannel(object):
                 }
 
         return infocfg
+
+
+    _size_units = {
+            'b': 1, 'byte': 1, 'bytes': 1,
+            'kb': 1024, 'mb': 1024 ** 2, 'gb': 1024 ** 3, 'tb': 1024 ** 4}
+
+    @classmethod
+    def _parse_size(cls, text):
+        """returns bytes for sizes like '812.4 MB', or None."""
+        m = re.search(r'(\d+(?:\.\d+)?)\s*(bytes|byte|[kmgt]?b)\b', text, re.I)
+        if m is None:
+            return None
+        return int(float(m.group(1)) * cls._size_units[m.group(2).lower()])
+
+
+    @classmethod
+    @operation('get_recorder_files')
+    def get_recorder_files(cls, client, recorder_id):
+        """scrape recorder archive page to list recorded files.
+
+        returns list of dicts {'name', 'path', 'size'}, where size is in
+        bytes as displayed by the web ui; it is rounded for large files,
+        or None if the page does not show it.
+        """
+        path = '/admin/recorder%s/archive' % recorder_id
+        r = client.get(path=path)
+
+        if r.status_code != 200:
+            msg = 'failed call to %s/%s - expect response' % (client.url, path)
+            msg += ' status 200, but GOT (%s)' % r.status_code
+            logger.error(msg)
+            raise IndiscernibleResponseFromWebUiError(msg)
+
+        href = re.compile(r'^%s/([^/?#]+\.\w+)$' % re.escape(path))
+        soup = parse_html(client, r.text)
+        files = []
+        for a in soup.find_all('a', href=href):
+            row = a.find_parent('tr')
+            size = None
+            if row is not None:
+                for td in row.find_all('td'):
+                    if td.find('a') is None:
+                        size = cls._parse_size(td.get_text())
+                        if size is not None:
+                            break
+            files.append({
+                'name': href.match(a['href']).group(1),
+                'path': a['href'],
+                'size': size})
+        return files
+
+
+    @classmethod
+    @operation('delete_recorder_file')
+    def delete_recorder_file(cls, client, recorder_id, filename):
+        """returns true or raises exception.
+
+        deletes a recorded file from recorder archive; success means the
+        file is not listed in the archive page returned by the device.
+        """
+        path = '/admin/recorder%s/archive' % recorder_id
+        r = client.post(
+                path, data={'deletefile': filename, 'deletemode': 'trash'},
+                extra_headers={
+                    'Content-Type': 'application/x-www-form-urlencoded'})
+
+        msg = 'error from call %s/%s ' % (client.url, path)
+        if r.status_code != 200:
+            msg += '- response status(%s)' % r.status_code
+            logger.error(msg)
+            raise IndiscernibleResponseFromWebUiError(msg)
+
+        soup = parse_html(client, r.text)
+        emsg = WebUiConfig._scrape_error(soup)
+        if emsg:
+            msg += '\n'.join([x['msg'] for x in emsg if 'msg' in x])
+            logger.error(msg)
+            raise SettingConfigError(msg)
+        if soup.find('a', href='%s/%s' % (path, filename)):
+            msg += '- file(%s) still listed after delete' % filename
+            logger.error(msg)
+            raise SettingConfigError(msg)
+        return True
@@ -1,11 +1,15 @@
 # -*- coding: utf-8 -*-
 """http api and web ui calls to epiphan pearl."""
 
-from bs4 import BeautifulSoup
 import logging
+import time
 
 from epipearl.errors import IndiscernibleResponseFromWebUiError
 from epipearl.errors import SettingConfigError
+from epipearl.metrics import operation
+from epipearl.metrics import parse_html
+from epipearl.timing import add_phase
+from epipearl.transfer import MultipartFileBody
 
 
 class WebUiConfig(object):
@@ -63,6 +67,7 @@ class WebUiConfig(object):
 
 
     @classmethod
+    @operation('set_ntp')
     def set_ntp(cls, client, server, timezone):
         params = {
                 'server': server, 'tz': timezone,
@@ -94,6 +99,7 @@ class WebUiConfig(object):
 
 
     @classmethod
+    @operation('set_touchscreen')
     def set_touchscreen(cls, client, screen_timeout=600):
         params = {
                 'pdf_form_id': 'fn_episcreen',
@@ -139,6 +145,7 @@ class WebUiConfig(object):
                 check_success=check_success)
 
     @classmethod
+    @operation('set_remote_support_and_permanent_logs')
     def set_remote_support_and_permanent_logs(cls, client, log_enabled=True):
         _default_server = 'epiphany.epiphan.com'
         _default_port = '30'
@@ -169,8 +176,35 @@ class WebUiConfig(object):
 
 
     @classmethod
-    def update_firmware(cls, client, params, check_success):
-        raise NotImplementedError('update_firmware() not implemented yet.')
+    @operation('update_firmware')
+    def update_firmware(
+            cls, client, image, progress=None, throttle=None,
+            chunk_size=None, timeout=None):
+        """streams firmware image to device as a multipart form post.
+
+        image: epipearl.transfer.FirmwareImage; can be shared among
+            concurrent uploads.
+        progress: optional callable(bytes_sent, total_bytes)
+        throttle: optional rate limiter, e.g. epipearl.fleet.TokenBucket
+        timeout: optional (connect, read) seconds for the upload
+
+        returns true or raises exception. the device reboots to apply the
+        new firmware, so the version must be checked afterwards.
+        """
+        kwargs = {'progress': progress, 'throttle': throttle}
+        if chunk_size:
+            kwargs['chunk_size'] = chunk_size
+        body = MultipartFileBody(
+                image, field_name='firmware', fields={'fn': 'upgrade'},
+                **kwargs)
+
+        return cls.configuration(
+                client=client,
+                path='admin/firmwarecfg',
+                params=body,
+                check_success=[],
+                content_type=body.content_type,
+                timeout=timeout)
 
     @classmethod
     def set_afu(cls, client):
@@ -183,6 +217,7 @@ class WebUiConfig(object):
                 'set_universal_plug_and_play() not implemented yet.')
 
     @classmethod
+    @operation('set_source_deinterlacing')
     def set_source_deinterlacing(cls, client, source_name, enabled=True):
         params = {'pfd_form_id': 'vsource'}
         check_success = []
@@ -211,7 +246,11 @@ class WebUiConfig(object):
 
 
     @classmethod
-    def configuration(cls, client, params, check_success, path):
+    @operation('configuration')
+    def configuration(
+            cls, client, params, check_success, path,
+            content_type='application/x-www-form-urlencoded',
+            timeout=None):
         """generic request to config form
 
         client: epipearl client instance
@@ -220,31 +259,37 @@ class WebUiConfig(object):
         check_success: list of dicts
             [{ 'func': <function for BeautifulSoup.find>
                'emsg': string error msg if func returns false }]
+        content_type: of posted form
+        timeout: optional (connect, read) seconds, instead of client ones
         """
         r = client.post(
                 path, data=params,
-                extra_headers={
-                    'Content-Type': 'application/x-www-form-urlencoded'})
+                extra_headers={'Content-Type': content_type},
+                timeout=timeout)
 
         msg = 'error from call %s/%s ' % (client.url, path)
         logger = logging.getLogger(__name__)
         # still have to check errors in response html
         if r.status_code == 200:
-            soup = BeautifulSoup(r.text, 'html.parser')
-            emsg = cls._scrape_error(soup)
-            if len(emsg) > 0:     # concat error messages
-                allmsgs = [x['msg'] for x in emsg if 'msg' in x]
-                msg += '\n'.join(allmsgs)
-                logger.error(msg)
-                raise SettingConfigError(msg)
-            else:
-                # no error msg, check that updates took place
-                for c in check_success:
-                    tags = soup.find_all(c['func'])
-                    if not tags:
-                        msg += '- %s' % c['emsg']
-                        logger.error(msg)
-                        raise SettingConfigError(msg)
+            soup = parse_html(client, r.text)
+            start = time.time()
+            try:
+                emsg = cls._scrape_error(soup)
+                if len(emsg) > 0:     # concat error messages
+                    allmsgs = [x['msg'] for x in emsg if 'msg' in x]
+                    msg += '\n'.join(allmsgs)
+                    logger.error(msg)
+                    raise SettingConfigError(msg)
+                else:
+                    # no error msg, check that updates took place
+                    for c in check_success:
+                        tags = soup.find_all(c['func'])
+                        if not tags:
+                            msg += '- %s' % c['emsg']
+                            logger.error(msg)
+                            raise SettingConfigError(msg)
+            finally:
+                add_phase('verify', time.time() - start)
             # all is well
             return True
 
@@ -254,6 +299,84 @@ class WebUiConfig(object):
         raise IndiscernibleResponseFromWebUiError(msg)
 
 
+    @classmethod
+    @operation('get_form')
+    def get_form(cls, client, path, redact=None):
+        """current values of the form fields in web ui page.
+
+        returns dict {field name: value}; a checkbox is its value if
+        checked, else the value of a same-name hidden input or ''; fields
+        named 'x[]' and multiple selects are lists of the checked or
+        selected values. if redact is not None, it is the value of every
+        password input instead of the password.
+        """
+        r = client.get(path)
+        if r.status_code != 200:
+            msg = 'error in call %s/%s - response status(%s)' % (
+                    client.url, path, r.status_code)
+            logging.getLogger(__name__).error(msg)
+            raise IndiscernibleResponseFromWebUiError(msg)
+        return cls._form_values(parse_html(client, r.text), redact=redact)
+
+
+    _skip_input_types = frozenset(
+            ('submit', 'button', 'reset', 'image', 'file'))
+
+    @classmethod
+    def _form_values(cls, soup, redact=None):
+        values = {}
+        # a checked checkbox wins over the same-name hidden input that web
+        # ui pages post when the box is unchecked
+        checked = set()
+        for tag in soup.find_all(('input', 'select', 'textarea')):
+            name = tag.get('name')
+            if not name or name in checked:
+                continue
+            many = name.endswith('[]')
+            if tag.name == 'input':
+                kind = tag.get('type', 'text').lower()
+                if kind in cls._skip_input_types:
+                    continue
+                if kind in ('checkbox', 'radio'):
+                    value = tag.get('value', 'on') \
+                            if tag.has_attr('checked') else None
+                    if many or kind == 'radio':
+                        values.setdefault(name, [] if many else '')
+                        if value is not None:
+                            if many:
+                                values[name].append(value)
+                            else:
+                                values[name] = value
+                        continue
+                    if value is None:
+                        values.setdefault(name, '')
+                        continue
+                    checked.add(name)
+                elif kind == 'password' and redact is not None:
+                    value = redact
+                else:
+                    value = tag.get('value', '')
+            elif tag.name == 'select':
+                options = tag.find_all('option')
+                selected = [o.get('value', o.get_text())
+                            for o in options if o.has_attr('selected')]
+                if tag.has_attr('multiple'):
+                    many = True
+                    value = selected
+                else:
+                    value = selected[0] if selected else (
+                            options[0].get('value', options[0].get_text())
+                            if options else '')
+            else:
+                value = tag.get_text()
+
+            if many and not isinstance(value, list):
+                values.setdefault(name, []).append(value)
+            else:
+                values[name] = value
+        return values
+
+
     @classmethod
     def _scrape_error(cls, soup):
         """webscrape for error msg in returned html."""
@@ -2,6 +2,7 @@
 """http api and web ui calls to epiphan pearl."""
 
 from epipearl.endpoints.webui_config import WebUiConfig
+from epipearl.metrics import operation
 
 
 class WebUiMhPearl(object):
@@ -14,6 +15,7 @@ class WebUiMhPearl(object):
     """
 
     @classmethod
+    @operation('set_mhpearl_settings')
     def set_mhpearl_settings(
             cls, client,
             device_name='',       # device name for mh admin
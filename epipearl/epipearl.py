@@ -10,24 +10,42 @@ from . import __version__
 
 import logging
 import sys
-import platform
 import requests
+import time
 
-from requests.auth import HTTPBasicAuth
 from urlparse import urljoin
 
+from errors import EpipearlError
+from errors import FirmwareUpdateError
 from errors import IndiscernibleResponseFromWebUiError
 from endpoints.admin import Admin
 from endpoints.admin import AdminAjax
-from endpoints.webui_channel import WebUiChannel
-from endpoints.webui_config import WebUiConfig
-from endpoints.webui_mhpearl import WebUiMhPearl
+from metrics import observe_parse
+from metrics import operation
+from reachability import connect_failed
+from timing import current as current_timing
+from transport import make_transport
+
+# web ui endpoints (and bs4), preview and transfer are imported on first
+# use, so short-lived http api callers only pay for requests at import.
 
 _default_timeout = 5
+_default_connect_timeout = 2
+_default_upload_timeout = 600
+
+_useragent = None
 
 
 def default_useragent():
     """Return a string representing the default user agent."""
+    global _useragent
+    if _useragent is None:
+        _useragent = _make_useragent()
+    return _useragent
+
+
+def _make_useragent():
+    import platform
     _implementation = platform.python_implementation()
 
     if _implementation == 'CPython':
@@ -67,18 +85,50 @@ def default_useragent():
 
 class Epipearl(object):
 
-    def __init__(self, base_url, user, passwd, timeout=None):
+    def __init__(self, base_url, user, passwd, timeout=None, transport=None,
+                 metrics=None, timing=None, tracer=None, capabilities=None,
+                 connect_timeout=None, negative_cache=None,
+                 adaptive_timeouts=None):
+        """timeout: seconds to wait for a response once connected.
+        connect_timeout: seconds to wait for a connection; short by default,
+        as a device that does not connect is likely down.
+        transport: transport.Transport instance or registered name;
+        defaults to a requests session per client.
+        metrics: optional metrics.Metrics to record calls into; may be
+        shared by many clients.
+        timing: optional timing.Timing to record phase timings of calls
+        into; may be shared by many clients.
+        tracer: optional tracing.Tracer to open spans for operations and
+        requests; may be shared by many clients.
+        capabilities: optional capabilities.Capabilities to check device
+        firmware supports a call before sending it; may be shared by many
+        clients.
+        negative_cache: optional reachability.NegativeCache to fail fast on
+        devices that recently failed to connect; may be shared by many
+        clients.
+        adaptive_timeouts: optional timeouts.AdaptiveTimeouts to wait for
+        each response as long as its endpoint needs, learned from latency;
+        may be shared by many clients."""
         self.url = base_url
         self.user = user
         self.passwd = passwd
         self.timeout = timeout or _default_timeout
+        self.connect_timeout = connect_timeout or min(
+                _default_connect_timeout, self.timeout)
+        self.negative_cache = negative_cache
+        self.adaptive_timeouts = adaptive_timeouts
+        self.transport = make_transport(transport)
+        self.metrics = metrics
+        self.timing = timing
+        self.tracer = tracer
+        self.capabilities = capabilities
         self.default_headers = {
                 'User-Agent': default_useragent(),
                 'Accept-Encoding': ', '.join(('gzip', 'deflate')),
                 'Accept': 'text/html, text/*, video/avi',
                 'X-REQUESTED-AUTH': 'Basic'}
 
-    def get(self, path, params=None, extra_headers=None):
+    def get(self, path, params=None, extra_headers=None, stream=False):
         if params is None:
             params = {}
         if extra_headers is None:
@@ -87,18 +137,17 @@ class Epipearl(object):
         headers.update(extra_headers)
 
         url = urljoin(self.url, path)
-        auth = HTTPBasicAuth(self.user, self.passwd)
-        resp = requests.get(
-                url,
+        return self._send(
+                'GET', url,
                 params=params,
-                auth=auth,
+                auth=(self.user, self.passwd),
                 headers=headers,
-                timeout=self.timeout)
+                timeout=self._timeout('GET', url),
+                stream=stream)
 
-        resp.raise_for_status()
-        return resp
-
-    def post(self, path, data=None, extra_headers=None):
+    def post(self, path, data=None, extra_headers=None, timeout=None):
+        """timeout: (connect, read) seconds, instead of the client ones;
+        e.g. for big uploads, sent while the connect timeout applies."""
         if data is None:
             data = {}
         if extra_headers is None:
@@ -107,16 +156,87 @@ class Epipearl(object):
         headers.update(extra_headers)
 
         url = urljoin(self.url, path)
-        auth = HTTPBasicAuth(self.user, self.passwd)
-        resp = requests.post(
-                url,
+        return self._send(
+                'POST', url,
                 data=data,
-                auth=auth,
+                auth=(self.user, self.passwd),
                 headers=headers,
-                timeout=self.timeout)
-
-        resp.raise_for_status()
-        return resp
+                timeout=timeout or self._timeout('POST', url))
+
+    def _timeout(self, method, url):
+        """(connect, read) timeouts for request."""
+        if self.adaptive_timeouts is None:
+            return (self.connect_timeout, self.timeout)
+        return (self.connect_timeout, self.adaptive_timeouts.timeout(
+            self.url, method, url, default=self.timeout))
+
+    def _send(self, method, url, **kwargs):
+        if self.tracer is None:
+            return self._measured_send(method, url, **kwargs)
+        with self.tracer.span('HTTP %s' % method, {
+                'http.method': method,
+                'http.url': url,
+                'server.address': self.url}) as span:
+            resp = None
+            try:
+                resp = self._measured_send(method, url, **kwargs)
+                return resp
+            except requests.RequestException as e:
+                resp = e.response
+                raise
+            finally:
+                if resp is not None:
+                    span.set_attribute('http.status_code', resp.status_code)
+                    # requests follows redirects but does not retry, so
+                    # this is not the semconv http.resend_count
+                    span.set_attribute(
+                            'http.redirect_count', len(resp.history))
+
+    def _measured_send(self, method, url, **kwargs):
+        def send():
+            if self.negative_cache is not None:
+                self.negative_cache.check(self.url)
+            try:
+                resp = self.transport.request(method, url, **kwargs)
+            except requests.ConnectionError as e:
+                if self.negative_cache is not None and connect_failed(e):
+                    self.negative_cache.failed(self.url, e)
+                raise
+            except requests.ReadTimeout:
+                # waited the whole timeout: at least that much latency
+                if self.adaptive_timeouts is not None:
+                    self.adaptive_timeouts.observe(
+                            self.url, method, url, kwargs['timeout'][1])
+                raise
+            if self.negative_cache is not None:
+                self.negative_cache.succeeded(self.url)
+            if self.adaptive_timeouts is not None:
+                self.adaptive_timeouts.observe(
+                        self.url, method, url, resp.elapsed.total_seconds())
+            resp.raise_for_status()
+            return resp
+        record = None if self.timing is None else current_timing()
+        if record is None:
+            if self.metrics is None:
+                return send()
+            return self.metrics.track(self.url, method, send)
+
+        connect = record.phases['connect']
+        start = time.time()
+        resp = None
+        try:
+            if self.metrics is None:
+                resp = send()
+            else:
+                resp = self.metrics.track(self.url, method, send)
+            return resp
+        except requests.HTTPError as e:
+            resp = e.response
+            raise
+        finally:
+            record.add_request(
+                    time.time() - start, record.phases['connect'] - connect,
+                    resp)
 
     def put(self, path, data={}, extra_headers={}):
         raise NotImplementedError()
@@ -124,20 +244,59 @@ class Epipearl(object):
     def delete(self, path, params={}, extra_headers={}):
         raise NotImplementedError()
 
+    @operation('get_params', client_arg=0)
     def get_params(self, channel, params=None):
         if params is None:
             params = {}
         response = Admin.get_params(self, channel, params)
+        start = time.time()
         r = {}
         for line in response['response_text'].splitlines():
             (key, value) = [x.strip() for x in line.split('=')]
             r[key] = value
+        if self.metrics is not None or self.timing is not None:
+            observe_parse(self, time.time() - start)
         return r
 
     def set_params(self, channel, params):
         response = Admin.set_params(self, channel, params)
         return 2 == (response['status_code']/100)
 
+    def supports(self, feature):
+        """false if device is known to lack feature, e.g. 'mhcfg'."""
+        if self.capabilities is None:
+            return True
+        return self.capabilities.supports(self, feature)
+
+    def _require(self, feature, operation):
+        if self.capabilities is not None:
+            self.capabilities.require(self, feature, operation)
+
+    def get_sysinfo(self):
+        """returns dict with device system info json."""
+        self._require('sysinfo_json', 'get_sysinfo')
+        return AdminAjax.get_sysinfo(self)
+
+    def reboot(self):
+        """reboots device; returns True if device acknowledged it."""
+        response = AdminAjax.reboot(self)
+        if response['error_msg']:
+            msg = 'failed to reboot device(%s) - %s, status(%s)' % (
+                    self.url, response['error_msg'], response['status_code'])
+            logging.getLogger(__name__).error(msg)
+            raise IndiscernibleResponseFromWebUiError(msg)
+        return True
+
+    def get_firmware_version(self):
+        sysinfo = self.get_sysinfo()
+        try:
+            return sysinfo['system']['firmware']['version']
+        except (KeyError, TypeError):
+            msg = 'missing firmware version in sysinfo for device(%s)' % \
+                    self.url
+            logging.getLogger(__name__).error(msg)
+            raise IndiscernibleResponseFromWebUiError(msg)
+
     #
     # calls done to the web ui
     # some functionality is not available via http api;
@@ -148,6 +307,7 @@ class Epipearl(object):
 
     def set_ntp(self, server, timezone):
         """sets ntp server and timezone in epiphan."""
+        from endpoints.webui_config import WebUiConfig
         return WebUiConfig.set_ntp(
                 client=self,
                 server=server,
@@ -156,6 +316,7 @@ class Epipearl(object):
 
     def set_touchscreen(self, screen_timeout=600):
         """disables settings changes and recording via touchscreen."""
+        from endpoints.webui_config import WebUiConfig
         return WebUiConfig.set_touchscreen(
                 client=self,
                 screen_timeout=screen_timeout)
@@ -163,6 +324,7 @@ class Epipearl(object):
 
     def set_permanent_logs(self, log_enabled=True):
         """enables/disables permanent logs."""
+        from endpoints.webui_config import WebUiConfig
         return WebUiConfig.set_remote_support_and_permanent_logs(
                 client=self,
                 log_enabled=log_enabled)
@@ -170,12 +332,15 @@ class Epipearl(object):
 
     def set_deinterlacing_source(self, source_name, deinterlacing=True):
         """deinterlacing on/off for given video source."""
+        from endpoints.webui_config import WebUiConfig
         return WebUiConfig.set_source_deinterlacing(
                 client=self, source_name=source_name, enabled=deinterlacing)
 
 
+    @operation('create_channel', client_arg=0)
     def create_channel(self, channel_name):
         """creates new channel with given channel_name."""
+        from endpoints.webui_channel import WebUiChannel
         logger = logging.getLogger(__name__)
         channel_id = None
         try:
@@ -203,6 +368,7 @@ class Epipearl(object):
 
         layout must be a json string.
         """
+        from endpoints.webui_channel import WebUiChannel
         return WebUiChannel.set_channel_layout(
                 client=self,
                 channel_id=channel_id,
@@ -210,9 +376,17 @@ class Epipearl(object):
                 layout_id=layout_id)
 
 
+    def get_channel_layout(self, channel_id, layout_id='1'):
+        """returns source layout of channel as json string."""
+        from endpoints.webui_channel import WebUiChannel
+        return WebUiChannel.get_channel_layout(
+                client=self, channel_id=channel_id, layout_id=layout_id)
+
+
     def set_channel_rtmp(
             self, channel_id, rtmp_url, rtmp_stream, rtmp_usr, rtmp_pwd):
         """configs rtmp-push for live streaming in given channel."""
+        from endpoints.webui_channel import WebUiChannel
         return WebUiChannel.set_channel_rtmp(
                 client=self,
                 channel_id=channel_id,
@@ -222,8 +396,10 @@ class Epipearl(object):
                 rtmp_pwd=rtmp_pwd)
 
 
+    @operation('create_recorder', client_arg=0)
     def create_recorder(self, recorder_name):
         """creates new recorder with given recorder_name."""
+        from endpoints.webui_channel import WebUiChannel
         recorder_id = None
         try:
             recorder_id = WebUiChannel.create_recorder(client=self)
@@ -247,6 +423,7 @@ class Epipearl(object):
 
 
     def set_recorder_channels(self, recorder_id, channel_list):
+        from endpoints.webui_channel import WebUiChannel
         return WebUiChannel.set_recorder_channels(
                 client=self,
                 recorder_id=recorder_id,
@@ -261,6 +438,7 @@ class Epipearl(object):
             afu_enabled='on',     # this means auto-upload disabled!
             upnp_enabled=''):
         """configs settings for give recorder_id."""
+        from endpoints.webui_channel import WebUiChannel
         return WebUiChannel.set_recorder_settings(
                 client=self,
                 recorder_id=recorder_id,
@@ -274,12 +452,14 @@ class Epipearl(object):
 
     def delete_recorder(self, recorder_id):
         """deletes given recorder_id."""
+        from endpoints.webui_channel import WebUiChannel
         return WebUiChannel.delete_recorder(
                 client=self, recorder_id=recorder_id)
 
 
     def delete_channel(self, channel_id):
         """deletes given channel_id."""
+        from endpoints.webui_channel import WebUiChannel
         return WebUiChannel.delete_channel(
                 client=self, channel_id=channel_id)
 
@@ -301,6 +481,8 @@ class Epipearl(object):
         this is a custom api call and it's not available in out-of-the-box
         firmware for epiphan-pearl.
         """
+        self._require('mhcfg', 'set_mhpearl_settings')
+        from endpoints.webui_mhpearl import WebUiMhPearl
         return WebUiMhPearl.set_mhpearl_settings(
                 client=self,
                 device_name=device_name,
@@ -314,6 +496,7 @@ class Epipearl(object):
 
 
     def get_infocfg(self):
+        from endpoints.webui_channel import WebUiChannel
         try:
             r_infocfg = WebUiChannel.get_infocfg(client=self)
         except Exception as e:
@@ -325,12 +508,14 @@ class Epipearl(object):
         return r_infocfg
 
 
+    @operation('delete_channel_or_recorder_by_name', client_arg=0)
     def delete_channel_or_recorder_by_name(self, channel_name, infocfg=None):
         """deletes all channels or recorders by given channel name.
 
         ignores when there's no id for a matched channel name,
         or when there are no channels in the returned json.
         """
+        from endpoints.webui_channel import WebUiChannel
         if infocfg is None:
             # query device for configured channels
             try:
@@ -370,3 +555,136 @@ class Epipearl(object):
                         logging.getLogger(__name__).error(msg)
                         raise e
         return True
+
+
+    def update_firmware(
+            self, image, expected_version=None, progress=None,
+            throttle=None, verify_timeout=900, verify_interval=15,
+            upload_timeout=_default_upload_timeout):
+        """uploads firmware image and waits for device to come back.
+
+        image: path to firmware image, or a transfer.FirmwareImage to
+            share one memory map among concurrent uploads.
+        expected_version: firmware version expected after upgrade; if not
+            given, waits for a version other than the one before upload.
+        progress: optional callable(bytes_sent, total_bytes)
+        throttle: optional rate limiter, e.g. fleet.TokenBucket
+        upload_timeout: seconds to wait on the connection while the image
+            is sent and the device answers the upload.
+
+        returns firmware version read back from device sysinfo.
+        """
+        from endpoints.webui_config import WebUiConfig
+        from transfer import FirmwareImage
+        own_image = not isinstance(image, FirmwareImage)
+        if own_image:
+            image = FirmwareImage(image)
+        try:
+            previous_version = None
+            if expected_version is None:
+                previous_version = self.get_firmware_version()
+            WebUiConfig.update_firmware(
+                    client=self, image=image,
+                    progress=progress, throttle=throttle,
+                    timeout=(upload_timeout, upload_timeout))
+        except Exception as e:
+            msg = 'failed to upload firmware(%s) to device(%s) - %s' % (
+                    image.name, self.url, e)
+            logging.getLogger(__name__).error(msg)
+            raise e
+        finally:
+            if own_image:
+                image.close()
+
+        if self.capabilities is not None:
+            self.capabilities.forget(self.url)
+
+        return self.wait_for_firmware_version(
+                expected_version=expected_version,
+                previous_version=previous_version,
+                timeout=verify_timeout, interval=verify_interval)
+
+
+    def wait_for_firmware_version(
+            self, expected_version=None, timeout=900, interval=15,
+            previous_version=None):
+        """polls sysinfo until device reports expected firmware version.
+
+        without expected_version, waits for any version other than
+        previous_version, i.e. the one running before the upgrade.
+        errors while polling are taken as the device still rebooting.
+        raises FirmwareUpdateError if timeout(seconds) expires.
+        """
+        deadline = time.time() + timeout
+        version = None
+        last_error = None
+        while True:
+            try:
+                version = self.get_firmware_version()
+            except (requests.RequestException, EpipearlError) as e:
+                last_error = e
+            else:
+                if expected_version is None:
+                    if version != previous_version:
+                        return version
+                elif version == expected_version:
+                    return version
+
+            if time.time() >= deadline:
+                msg = 'device(%s) firmware expected(%s), ' % (
+                        self.url, expected_version or
+                        'other than %s' % previous_version)
+                msg += 'but got(%s) after %ss' % (version, timeout)
+                if last_error is not None:
+                    msg += ' - last error: %s' % last_error
+                logging.getLogger(__name__).error(msg)
+                raise FirmwareUpdateError(msg)
+            time.sleep(interval)
+
+
+    def list_recorder_files(self, recorder_id):
+        """lists files in recorder archive.
+
+        returns list of dicts {'name', 'path', 'size'}
+        """
+        from endpoints.webui_channel import WebUiChannel
+        return WebUiChannel.get_recorder_files(
+                client=self, recorder_id=recorder_id)
+
+
+    def download_recorder_file(
+            self, recorder_id, filename, dest, resume=True,
+            hash_name='sha256', progress=None):
+        """streams a recorder archive file to dest path on local disk.
+
+        an interrupted download resumes from where it stopped, unless
+        resume is False.
+
+        returns dict {'path': dest, 'size': bytes, 'hash': hexdigest}
+        """
+        from transfer import download
+        return download(
+                client=self,
+                path='/admin/recorder%s/archive/%s' % (recorder_id, filename),
+                dest=dest, resume=resume, hash_name=hash_name,
+                progress=progress)
+
+
+    def delete_recorder_file(self, recorder_id, filename):
+        """deletes a recorded file from recorder archive in device."""
+        from endpoints.webui_channel import WebUiChannel
+        return WebUiChannel.delete_recorder_file(
+                client=self, recorder_id=recorder_id, filename=filename)
+
+
+    def get_preview(self, channel, buf=None):
+        """returns preview.Frame with current preview image of channel.
+
+        buf: optional bytearray to read the image into, for reuse.
+        """
+        from preview import Frame
+        from preview import grab_frame
+        if buf is None:
+            buf = bytearray(256 * 1024)
+        (buf, size, content_type) = grab_frame(self, channel, buf)
+        return Frame(self, channel, buf, size, content_type)
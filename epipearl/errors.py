@@ -4,7 +4,11 @@
 __all__ = [
         'EpipearlError',
         'SettingConfigError',
-        'IndiscernibleResponseFromWebUiError'
+        'IndiscernibleResponseFromWebUiError',
+        'FirmwareUpdateError',
+        'TransferError',
+        'UnsupportedOperationError',
+        'DeviceUnreachableError'
         ]
 
 
@@ -18,3 +22,19 @@ class SettingConfigError(EpipearlError):
 
 class IndiscernibleResponseFromWebUiError(EpipearlError):
     """unexpected result from epiphan device; call failed"""
+
+
+class FirmwareUpdateError(EpipearlError):
+    """firmware upload failed or device did not come back upgraded."""
+
+
+class TransferError(EpipearlError):
+    """file transfer to or from device was incomplete or inconsistent."""
+
+
+class UnsupportedOperationError(EpipearlError):
+    """device firmware does not support the call; nothing was sent."""
+
+
+class DeviceUnreachableError(EpipearlError):
+    """device failed to connect recently; call failed fast, nothing sent."""
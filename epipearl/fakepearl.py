@@ -0,0 +1,707 @@
+# -*- coding: utf-8 -*-
+"""stateful fake epiphan pearl, for offline and load tests.
+
+FakePearl keeps channels, recorders, recorded files and web ui settings,
+and answers the http api and web ui calls made by the epipearl client with
+pages shaped like the device ones. it can add latency and failures, and
+handles one request at a time like the device web ui does.
+
+in-process, without sockets:
+
+    fake = FakePearl()
+    client = Epipearl('http://pearl', 'admin', 'secret',
+                      transport=fake.transport())
+
+over http, many devices on their own ports:
+
+    fleet = FakePearlFleet(200, latency=0.05).start()
+    clients = clients_from_inventory(fleet.inventory())
+
+or as a subprocess:
+
+    python -m epipearl.fakepearl --count 200 --inventory devices.json
+"""
+
+import argparse
+import base64
+import json
+import logging
+import random
+import re
+import threading
+import time
+
+from BaseHTTPServer import BaseHTTPRequestHandler
+from cgi import escape
+
+from gateway import ThreadingHTTPServer
+from transport import MemoryRequest
+from transport import MemoryTransport
+
+logger = logging.getLogger(__name__)
+
+_default_user = 'admin'
+_default_passwd = 'secret'
+_default_firmware_version = '3.15.3f'
+_disk_total_kbytes = 975022608  # sysinfo reports KiB, like the device
+
+_default_params = {
+        'publish_type': '0',
+        'rec_enabled': 'off',
+        'framesize': '1280x720',
+        'vbitrate': '3000',
+        'fps': '30',
+        'audio': 'on',
+        'audiobitrate': '160',
+        }
+
+
+class _NoLock(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+def _page(body):
+    return '<html><head><title>fake pearl</title></head><body>' \
+        '<div id="main_win">%s</div></body></html>' % body
+
+
+def _input(tag_id, value, name=None, kind='text'):
+    return '<input id="%s" name="%s" type="%s" value="%s">' % (
+            tag_id, name or tag_id, kind, escape(str(value), quote=True))
+
+
+def _checkbox(tag_id, checked, name=None, value='on'):
+    return '<input type="checkbox" id="%s" name="%s" value="%s" %s/>' % (
+            tag_id, name or tag_id, escape(value, quote=True),
+            'checked' if checked else '')
+
+
+def _select(tag_id, value):
+    return '<select id="%s" name="%s"><option value="%s" selected>' \
+        '%s</option></select>' % (tag_id, tag_id, escape(str(value), True),
+                                  escape(str(value)))
+
+
+def _error(msg, code='error'):
+    return (200, {'Content-Type': 'text/html'}, _page(
+        '<div class="wui-message-error">'
+        '<div class="wui-message-banner-inner">%s<br>%s</div></div>' % (
+            escape(msg), code)))
+
+
+def _html(body):
+    return (200, {'Content-Type': 'text/html'}, _page(body))
+
+
+def _human_size(size):
+    for (unit, factor) in (('GB', 1024 ** 3), ('MB', 1024 ** 2),
+                           ('KB', 1024)):
+        if size >= factor:
+            return '%.1f %s' % (size / float(factor), unit)
+    return '%d bytes' % size
+
+
+def _file_bytes(name, start, end):
+    """deterministic content of a fake recorded file, bytes [start, end)."""
+    pattern = '%s\n' % name
+    n = end - start
+    if n <= 0:
+        return ''
+    offset = start % len(pattern)
+    repeat = (n + offset) // len(pattern) + 1
+    return (pattern * repeat)[offset:offset + n]
+
+
+class FakePearl(object):
+    """in-memory device state plus request handling.
+
+    latency: seconds added to every request, plus up to `jitter` seconds
+    failure_rate: probability of answering a request with http 500
+    serialize: if true, requests are handled one at a time
+    """
+
+    def __init__(self, user=_default_user, passwd=_default_passwd,
+                 channels=2, recorders=1, latency=0.0, jitter=0.0,
+                 failure_rate=0.0, serialize=True, seed=None,
+                 firmware_version=_default_firmware_version,
+                 name='fakepearl'):
+        self.user = user
+        self.passwd = passwd
+        self.name = name
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.firmware_version = firmware_version
+        self.random = random.Random(seed)
+        self.started = time.time()
+        self.stats = {'requests': 0, 'failures': 0}
+        self._fail_next = []
+        self._lock = threading.Lock()
+        self._serial = threading.Lock() if serialize else _NoLock()
+
+        self.channels = {}
+        self.recorders = {}
+        self.sources = ['D2P280762.hdmi-a', 'D2P280762.sdi-a']
+        self.settings = {
+                'timesynccfg': {}, 'touchscreencfg': {},
+                'remotesupport.cgi': {}, 'mhcfg': {}, 'sources': {}}
+        self.firmware_uploads = []
+        self._next_id = {'channel': 1, 'recorder': 1}
+        for i in range(channels):
+            self.add_channel('channel %s' % (i + 1))
+        for i in range(recorders):
+            self.add_recorder(
+                    'recorder %s' % (i + 1), sorted(self.channels)[:2])
+
+        self._routes = [
+            (r'^/admin/channel(m?\d+)/get_params\.cgi$', self._get_params),
+            (r'^/admin/channel(m?\d+)/set_params\.cgi$', self._set_params),
+            (r'^/admin/add_channel\.cgi$', self._add_channel),
+            (r'^/admin/add_recorder\.cgi$', self._add_recorder),
+            (r'^/admin/ajax/rename_channel\.cgi$', self._rename),
+            (r'^/admin/channel(\d+)/layouts/(\d+)$', self._layout),
+            (r'^/admin/channel(\d+)/streamsetup$', self._streamsetup),
+            (r'^/admin/channel(\d+)/(status|mediasources)$', self._channel),
+            (r'^/admin/recorder(\d+)/archive$', self._archive),
+            (r'^/admin/recorder(\d+)/archive/([^/]+)$', self._archive_file),
+            (r'^/admin/infocfg$', self._infocfg),
+            (r'^/admin/mhcfg$', self._mhcfg),
+            (r'^/admin/(timesynccfg|touchscreencfg|remotesupport\.cgi)$',
+                self._config_form),
+            (r'^/admin/sources/([^/]+)$', self._source),
+            (r'^/admin/firmwarecfg$', self._firmware),
+            (r'^/admin/sysinfo\.cgi$', self._sysinfo),
+            (r'^/admin/reboot\.cgi$', self._reboot),
+            (r'^/preview\.cgi$', self._preview),
+            ]
+        self._routes = [(re.compile(p), h) for (p, h) in self._routes]
+
+    #
+    # state
+    #
+
+    def _new_id(self, kind):
+        with self._lock:
+            i = self._next_id[kind]
+            self._next_id[kind] += 1
+        return str(i)
+
+    def add_channel(self, name):
+        channel_id = self._new_id('channel')
+        self.channels[channel_id] = {
+                'name': name, 'params': dict(_default_params),
+                'layouts': {}, 'rtmp': {}, 'rec_started': None}
+        return channel_id
+
+    def add_recorder(self, name, channel_ids=None):
+        recorder_id = self._new_id('recorder')
+        self.recorders[recorder_id] = {
+                'name': name, 'channels': list(channel_ids or []),
+                'params': {'rec_enabled': 'off'}, 'rec_started': None,
+                'files': [],
+                'settings': {
+                    'timelimit': '6:00:00', 'sizelimit': '64000000',
+                    'output_format': 'mp4', 'user_prefix': '',
+                    'afu_enabled': 'on', 'upnp_enabled': ''}}
+        return recorder_id
+
+    def add_file(self, recorder_id, name, size, date=None):
+        self.recorders[str(recorder_id)]['files'].append({
+            'name': name, 'size': int(size),
+            'date': date or time.strftime('%Y-%m-%d %H:%M:%S')})
+
+    def _target(self, channel_id):
+        """channel or recorder state for ids like '1' or 'm2'."""
+        if channel_id.startswith('m'):
+            return self.recorders.get(channel_id[1:])
+        return self.channels.get(channel_id)
+
+    def _write_rate(self, channel):
+        p = channel['params']
+        return (int(p.get('vbitrate') or 0) +
+                int(p.get('audiobitrate') or 0)) * 1000 / 8.0
+
+    def _recording_rate(self, recorder):
+        return sum(self._write_rate(self.channels[c])
+                   for c in recorder['channels'] if c in self.channels)
+
+    def _set_recording(self, recorder_id, enabled):
+        recorder = self.recorders[recorder_id]
+        now = time.time()
+        if enabled and recorder['rec_started'] is None:
+            recorder['rec_started'] = now
+        elif not enabled and recorder['rec_started'] is not None:
+            elapsed = now - recorder['rec_started']
+            recorder['rec_started'] = None
+            self.add_file(
+                    recorder_id,
+                    '%srecorder%s_%s.%s' % (
+                        recorder['settings']['user_prefix'], recorder_id,
+                        time.strftime('%Y-%m-%d_%H-%M-%S'),
+                        recorder['settings']['output_format']),
+                    max(1024, int(elapsed * self._recording_rate(recorder))))
+
+    def used_bytes(self):
+        now = time.time()
+        used = 0
+        for r in self.recorders.values():
+            used += sum(f['size'] for f in r['files'])
+            if r['rec_started'] is not None:
+                used += (now - r['rec_started']) * self._recording_rate(r)
+        return int(used)
+
+    def sysinfo(self):
+        now = time.time()
+        channels = []
+        for (cid, c) in sorted(self.channels.items()):
+            p = c['params']
+            channels.append({
+                'id': cid, 'name': c['name'], 'state': 'OK',
+                'codecs': {
+                    'video': {
+                        'name': 'H264', 'framesize': p.get('framesize'),
+                        'bitrate': str(int(p.get('vbitrate') or 0) * 1000),
+                        'fps': '%.1f' % float(p.get('fps') or 0)},
+                    'audio': {
+                        'name': 'AAC', 'bitrate': p.get('audiobitrate')}},
+                'recorder': {'state': '', 'enabled': False, 'time': 0}})
+        for (rid, r) in sorted(self.recorders.items()):
+            started = r['rec_started']
+            channels.append({
+                'id': 'm%s' % rid, 'name': r['name'], 'state': 'OK',
+                'recorder': {
+                    'state': 'recording' if started else '',
+                    'enabled': started is not None,
+                    'time': int(now - started) if started else 0}})
+        free = max(0, _disk_total_kbytes - self.used_bytes() // 1024)
+        return {
+            'time': now,
+            'channels': channels,
+            'inputs': [{'id': s} for s in self.sources],
+            'system': {
+                'product': 'Pearl', 'serial': self.name,
+                'uptime': int(now - self.started),
+                'firmware': {'version': self.firmware_version},
+                'data': {
+                    'total': _disk_total_kbytes, 'free': free,
+                    'available': free,
+                    'mountpoint': '/data'}}}
+
+    #
+    # request handling
+    #
+
+    def fail_next(self, count=1, status=500):
+        """answers the next `count` requests with `status`."""
+        with self._lock:
+            self._fail_next.extend([status] * count)
+
+    def _authorized(self, request):
+        if self.user is None:
+            return True
+        expected = 'Basic %s' % base64.b64encode(
+                '%s:%s' % (self.user, self.passwd))
+        return request.headers.get('Authorization') == expected
+
+    def handle(self, request):
+        """returns (status, headers, body) for a MemoryRequest."""
+        with self._serial:
+            delay = self.latency + (
+                    self.random.uniform(0, self.jitter) if self.jitter else 0)
+            if delay:
+                time.sleep(delay)
+            with self._lock:
+                self.stats['requests'] += 1
+                status = self._fail_next.pop(0) if self._fail_next else None
+                if status is None and self.failure_rate and \
+                        self.random.random() < self.failure_rate:
+                    status = 500
+                if status is not None:
+                    self.stats['failures'] += 1
+            if status is not None:
+                return (status, {}, 'fake failure')
+            if not self._authorized(request):
+                return (401, {'WWW-Authenticate': 'Basic realm="pearl"'},
+                        'unauthorized')
+            for (pattern, handler) in self._routes:
+                m = pattern.match(request.path)
+                if m is not None:
+                    return handler(request, *m.groups())
+            return (404, {}, 'not found')
+
+    def transport(self):
+        """in-process transport to this device, no sockets."""
+        return MemoryTransport(app=self.handle)
+
+    def _get_params(self, request, channel_id):
+        target = self._target(channel_id)
+        if target is None:
+            return (404, {}, 'not found')
+        keys = request.query.keys() or target['params'].keys()
+        return (200, {'Content-Type': 'text/plain'}, ''.join(
+            '%s = %s\n' % (k, target['params'].get(k, '')) for k in keys))
+
+    def _set_params(self, request, channel_id):
+        target = self._target(channel_id)
+        if target is None:
+            return (404, {}, 'not found')
+        target['params'].update(request.query)
+        if channel_id.startswith('m') and 'rec_enabled' in request.query:
+            self._set_recording(
+                    channel_id[1:], request.query['rec_enabled'] == 'on')
+        return (200, {'Content-Type': 'text/plain'}, '')
+
+    def _add_channel(self, request):
+        channel_id = self.add_channel(
+                'Channel %s' % self._next_id['channel'])
+        return (302, {'Location': '/admin/channel%s/mediasources' %
+                      channel_id}, '')
+
+    def _add_recorder(self, request):
+        recorder_id = self.add_recorder(
+                'Recorder %s' % self._next_id['recorder'])
+        return (302, {'Location': '/admin/recorder%s/archive' % recorder_id},
+                '')
+
+    def _rename(self, request):
+        target = self._target(request.form.get('channel', ''))
+        if target is None:
+            return (404, {}, 'not found')
+        target['name'] = request.form.get('value', '')
+        return (200, {'Content-Type': 'text/plain'}, target['name'])
+
+    def _layout(self, request, channel_id, layout_id):
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            return (404, {}, 'not found')
+        if request.method == 'POST':
+            channel['layouts'][layout_id] = request.body
+        return (200, {'Content-Type': 'application/json'},
+                channel['layouts'].get(layout_id, '{}'))
+
+    def _streamsetup(self, request, channel_id):
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            return (404, {}, 'not found')
+        fields = ('rtmp_url', 'rtmp_stream', 'rtmp_username',
+                  'rtmp_password')
+        if request.method == 'POST':
+            for f in fields:
+                if f in request.form:
+                    channel['rtmp'][f] = request.form[f]
+        return _html('<form method="POST">%s</form>' % ''.join(
+            _input(f, channel['rtmp'].get(f, ''),
+                   kind='password' if f == 'rtmp_password' else 'text')
+            for f in fields))
+
+    def _channel(self, request, channel_id, page):
+        if request.method == 'POST' and 'deleteid' in request.form:
+            channel = self.channels.pop(channel_id, None)
+            name = channel['name'] if channel else 'Channel %s' % channel_id
+            return _html('<strong>Channel &laquo;%s&raquo; successfully '
+                         'deleted.</strong>' % escape(name))
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            return (404, {}, 'not found')
+        return _html('<h1>%s</h1>' % escape(channel['name']))
+
+    def _archive(self, request, recorder_id):
+        recorder = self.recorders.get(recorder_id)
+        if request.method == 'POST' and 'deleteid' in request.form:
+            self.recorders.pop(recorder_id, None)
+            name = recorder['name'] if recorder else 'Recorder %s' % \
+                recorder_id
+            return _html('<strong>Recorder &laquo;%s&raquo; successfully '
+                         'deleted.</strong>' % escape(name))
+        if recorder is None:
+            return (404, {}, 'not found')
+
+        if request.method == 'POST':
+            form_id = request.form.get('pfd_form_id')
+            if form_id == 'recorder_channels':
+                recorder['channels'] = [
+                        c for c in request.getlist('rc[]')
+                        if c in self.channels]
+            elif form_id == 'rec_settings':
+                for k in recorder['settings']:
+                    if k in request.form:
+                        recorder['settings'][k] = request.form[k]
+            elif 'deletefile' in request.form:
+                recorder['files'] = [
+                        f for f in recorder['files']
+                        if f['name'] != request.form['deletefile']]
+        return _html(self._archive_page(recorder_id, recorder))
+
+    def _archive_page(self, recorder_id, recorder):
+        s = recorder['settings']
+        channels = ''.join(
+            '<li>%s&nbsp;%s</li>' % (
+                _checkbox('channel_%s' % c, c in recorder['channels'],
+                          name='rc[]', value=c),
+                escape(self.channels[c]['name']))
+            for c in sorted(self.channels))
+        files = ''.join(
+            '<tr><td><a href="/admin/recorder%s/archive/%s">%s</a></td>'
+            '<td>%s</td><td>%s</td></tr>' % (
+                recorder_id, f['name'], f['name'], _human_size(f['size']),
+                f['date'])
+            for f in recorder['files'])
+        return (
+            '<h1>%s</h1>'
+            '<form method="POST"><input name="pfd_form_id" type="hidden" '
+            'value="recorder_channels"><ul>%s</ul></form>'
+            '<form id="rec_settings" method="POST">%s%s%s%s%s%s</form>'
+            '<table id="archive_files"><tr><th>File name</th><th>Size</th>'
+            '<th>Date</th></tr>%s</table>') % (
+                escape(recorder['name']), channels,
+                _select('timelimit', s['timelimit']),
+                _select('sizelimit', s['sizelimit']),
+                _select('output_format', s['output_format']),
+                _input('user_prefix', s['user_prefix']),
+                # 'on' means automatic file upload is _disabled_; as on the
+                # device, a hidden input posts the unchecked value
+                _checkbox('afu_enabled', s['afu_enabled'] != 'on', value='')
+                + _input('afu_enabled_unchecked', 'on', name='afu_enabled',
+                         kind='hidden'),
+                _checkbox('upnp_enabled', s['upnp_enabled'] == 'on')
+                + _input('upnp_enabled_unchecked', '', name='upnp_enabled',
+                         kind='hidden'),
+                files)
+
+    def _archive_file(self, request, recorder_id, name):
+        recorder = self.recorders.get(recorder_id)
+        files = [f for f in (recorder or {}).get('files', [])
+                 if f['name'] == name]
+        if not files:
+            return (404, {}, 'not found')
+        size = files[0]['size']
+        m = re.match(r'bytes=(\d+)-(\d*)$', request.headers.get('Range', ''))
+        if m is None:
+            return (200, {'Content-Type': 'video/mp4'},
+                    _file_bytes(name, 0, size))
+        start = int(m.group(1))
+        end = min(size, int(m.group(2)) + 1) if m.group(2) else size
+        if start >= size:
+            return (416, {'Content-Range': 'bytes */%s' % size}, '')
+        return (206, {
+            'Content-Type': 'video/mp4',
+            'Content-Range': 'bytes %s-%s/%s' % (start, end - 1, size)},
+            _file_bytes(name, start, end))
+
+    def _infocfg(self, request):
+        links = ''.join(
+            '<a id="menu_channel_%s" href="/admin/channel%s/status">%s</a>'
+            % (c, c, escape(self.channels[c]['name']))
+            for c in sorted(self.channels))
+        links += ''.join(
+            '<a id="menu_mrecorder_%s" href="/admin/recorder%s/archive">%s'
+            '</a>' % (r, r, escape(self.recorders[r]['name']))
+            for r in sorted(self.recorders))
+        links += ''.join(
+            '<a id="menu_dev_%s" href="/admin/sources/%s">%s</a>' % (
+                s, s, s) for s in self.sources)
+        return _html(links)
+
+    # (field name, tag id, input type) as in the dce firmware page
+    _mhcfg_fields = (
+            ('DEVICE_NAME', 'ca_name', 'text'),
+            ('DEVICE_USERNAME', 'ca_user', 'text'),
+            ('DEVICE_PASSWORD', 'ca_pass', 'password'),
+            ('DEVICE_CHANNEL', 'ca_chan', 'text'),
+            ('FILE_SEARCH_RANGE', 'ca_range', 'text'),
+            ('ADMIN_SERVER_URL', 'mh_host', 'text'),
+            ('ADMIN_SERVER_USER', 'mh_user', 'text'),
+            ('ADMIN_SERVER_PASSWD', 'mh_pass', 'password'),
+            ('UPDATE_FREQUENCY', 'mh_freq', 'text'))
+
+    def _mhcfg(self, request):
+        cfg = self.settings['mhcfg']
+        if request.method == 'POST':
+            cfg.update(request.form)
+            cfg['BACKUP_AGENT'] = request.form.get('BACKUP_AGENT', '')
+        return _html('<form method="POST">%s%s</form>' % (
+            ''.join(_input(tag_id, cfg.get(field, ''), name=field, kind=kind)
+                    for (field, tag_id, kind) in self._mhcfg_fields),
+            _checkbox('mh_backup', cfg.get('BACKUP_AGENT') == 'on',
+                      name='BACKUP_AGENT')))
+
+    def _config_form(self, request, page):
+        cfg = self.settings[page]
+        if request.method == 'POST':
+            if page == 'timesynccfg' and request.form.get(
+                    'rdate_proto', 'NTP') not in ('NTP', 'PTP'):
+                return _error('Invalid time sync protocol', 'invalid_proto')
+            cfg.update(request.form)
+        if page == 'timesynccfg':
+            return _html('<form method="POST">%s%s%s%s</form>' % (
+                _select('tz', cfg.get('tz', 'US/Eastern')),
+                _select('rdate_proto', cfg.get('rdate_proto', 'NTP')),
+                _checkbox('rdate_auto', cfg.get('rdate') == 'auto'),
+                _input('server', cfg.get('server', ''))))
+        if page == 'touchscreencfg':
+            checks = ''.join(
+                _checkbox(k, cfg.get(k) == 'on') for k in (
+                    'epiScreenEnable', 'showVideo', 'showInfo',
+                    'changeSettings', 'recordControl'))
+            return _html('<form method="POST">%s%s</form>' % (
+                checks, _input('epiScreenTimeout',
+                               cfg.get('epiScreenTimeout', '600'))))
+        return _html('<meta http-equiv="refresh" content="0">')
+
+    def _source(self, request, source):
+        if source not in self.sources:
+            return (404, {}, 'not found')
+        cfg = self.settings['sources'].setdefault(source, {})
+        if request.method == 'POST':
+            cfg['deinterlacing'] = request.form.get('deinterlacing', '')
+        return _html('<form method="POST">%s</form>' % _checkbox(
+            'deinterlacing', cfg.get('deinterlacing') == 'on'))
+
+    def _firmware(self, request):
+        if request.method == 'POST':
+            self.firmware_uploads.append(len(request.body))
+        return _html('<p>firmware upload</p>')
+
+    def _sysinfo(self, request):
+        return (200, {'Content-Type': 'application/json'},
+                json.dumps(self.sysinfo()))
+
+    def _reboot(self, request):
+        return (200, {'Content-Type': 'text/html'}, _page('Rebooting...'))
+
+    def _preview(self, request):
+        channel = request.query.get('channel', '')
+        if channel not in self.channels:
+            return (404, {}, 'not found')
+        frame = '\xff\xd8' + ('preview %s ' % channel) * 64 + '\xff\xd9'
+        return (200, {'Content-Type': 'image/jpeg'}, frame)
+
+
+class FakePearlRequestHandler(BaseHTTPRequestHandler):
+
+    fake = None
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _handle(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else ''
+        request = MemoryRequest(
+                self.command, 'http://%s%s' % (
+                    self.headers.get('Host', ''), self.path),
+                dict(self.headers.items()), body)
+        (status, headers, body) = self.fake.handle(request)
+        self.send_response(status)
+        for (k, v) in headers.items():
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = _handle
+    do_POST = _handle
+
+
+def make_server(fake, host='127.0.0.1', port=0):
+    """http server for a FakePearl; port 0 picks a free port."""
+
+    class Handler(FakePearlRequestHandler):
+        pass
+    Handler.fake = fake   # handler classes are classic in py2
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+class FakePearlFleet(object):
+    """many FakePearl devices, each served on its own port.
+
+    base_port: first port to use, or 0 for free ports
+    kwargs: passed to each FakePearl
+    """
+
+    def __init__(self, count, host='127.0.0.1', base_port=0, **kwargs):
+        self.host = host
+        self.base_port = base_port
+        self.devices = [
+                FakePearl(name='fakepearl%03d' % i, **kwargs)
+                for i in range(count)]
+        self.servers = []
+
+    def start(self):
+        for (i, fake) in enumerate(self.devices):
+            port = self.base_port + i if self.base_port else 0
+            server = make_server(fake, self.host, port)
+            t = threading.Thread(target=server.serve_forever)
+            t.daemon = True
+            t.start()
+            self.servers.append(server)
+        return self
+
+    def stop(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        self.servers = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    @property
+    def urls(self):
+        return ['http://%s:%s' % s.server_address for s in self.servers]
+
+    def inventory(self):
+        """devices as in fleet.load_inventory."""
+        return [{'name': fake.name, 'url': url,
+                 'user': fake.user, 'passwd': fake.passwd}
+                for (fake, url) in zip(self.devices, self.urls)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+            description='fake epiphan pearl devices for load testing')
+    parser.add_argument('--count', type=int, default=1)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--base-port', type=int, default=0,
+                        help='first port, or 0 for free ports')
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--channels', type=int, default=2)
+    parser.add_argument('--recorders', type=int, default=1)
+    parser.add_argument('--inventory',
+                        help='write devices json to this file')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    fleet = FakePearlFleet(
+            args.count, host=args.host, base_port=args.base_port,
+            latency=args.latency, jitter=args.jitter,
+            failure_rate=args.failure_rate, channels=args.channels,
+            recorders=args.recorders).start()
+    if args.inventory:
+        with open(args.inventory, 'w') as f:
+            json.dump(fleet.inventory(), f, indent=2)
+    logger.info('serving %s fake devices from %s' % (
+        args.count, fleet.urls[0] if fleet.urls else '-'))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fleet.stop()
+
+
+if __name__ == '__main__':
+    main()
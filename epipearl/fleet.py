@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+"""helpers to run epipearl calls across many devices."""
+
+import json
+import logging
+import threading
+import time
+
+from Queue import Empty
+from Queue import Queue
+
+from epipearl import Epipearl
+from epipearl import _default_upload_timeout
+
+logger = logging.getLogger(__name__)
+
+_default_concurrency = 8
+
+
+def load_inventory(path):
+    """reads device inventory json file.
+
+    the file holds a list of devices:
+        [{"name": "room-101", "url": "http://10.0.0.1",
+          "user": "admin", "passwd": "secret"}, ...]
+    name is optional and defaults to url.
+    """
+    with open(path, 'r') as f:
+        devices = json.load(f)
+    for d in devices:
+        d.setdefault('name', d['url'])
+    return devices
+
+
+def clients_from_inventory(devices, timeout=None, transport_factory=None,
+                           metrics=None, timing=None, tracer=None,
+                           capabilities=None, connect_timeout=None,
+                           negative_cache=None, adaptive_timeouts=None):
+    """returns list of Epipearl clients for inventory devices.
+
+    transport_factory: optional callable() returning a transport for each
+        client; defaults to one requests session per client.
+    metrics: optional metrics.Metrics shared by all clients
+    timing: optional timing.Timing shared by all clients
+    tracer: optional tracing.Tracer shared by all clients
+    capabilities: optional capabilities.Capabilities shared by all clients
+    negative_cache: optional reachability.NegativeCache shared by all
+        clients
+    adaptive_timeouts: optional timeouts.AdaptiveTimeouts shared by all
+        clients
+    """
+    return [Epipearl(
+        d['url'], d['user'], d['passwd'], timeout=timeout,
+        connect_timeout=connect_timeout, negative_cache=negative_cache,
+        adaptive_timeouts=adaptive_timeouts,
+        transport=transport_factory() if transport_factory else None,
+        metrics=metrics, timing=timing, tracer=tracer,
+        capabilities=capabilities)
+        for d in devices]
+
+
+def map_concurrently(func, items, concurrency=_default_concurrency,
+                     tracer=None, name='fleet_job'):
+    """calls func(item) for each item in up to `concurrency` threads.
+
+    yields (item, result, error) tuples as soon as each call completes;
+    error is the exception raised by func, or None if it returned.
+
+    tracer: optional tracing.Tracer; the job runs in span `name`, with a
+        child span per item, parent of the spans the call opens.
+    """
+    items = list(items)
+    if not items:
+        return
+    if tracer is None:
+        for r in _map_concurrently(func, items, concurrency):
+            yield r
+        return
+
+    with tracer.span(name, {'epipearl.items': len(items)}) as job:
+        def traced(item):
+            with tracer.span('%s item' % name, {
+                    'epipearl.device': getattr(item, 'url', str(item))},
+                    parent=job):
+                return func(item)
+        errors = 0
+        for (item, result, error) in _map_concurrently(
+                traced, items, concurrency):
+            if error is not None:
+                errors += 1
+            yield (item, result, error)
+        job.set_attribute('epipearl.errors', errors)
+
+
+def _map_concurrently(func, items, concurrency):
+
+    pending = Queue()
+    for item in items:
+        pending.put(item)
+    done = Queue()
+
+    def worker():
+        while True:
+            try:
+                item = pending.get_nowait()
+            except Empty:
+                return
+            try:
+                done.put((item, func(item), None))
+            except Exception as e:
+                logger.debug('call for item(%s) failed - %s' % (item, e))
+                done.put((item, None, e))
+
+    for i in range(max(1, min(concurrency, len(items)))):
+        t = threading.Thread(target=worker)
+        t.daemon = True
+        t.start()
+
+    for i in range(len(items)):
+        yield done.get()
+
+
+class TokenBucket(object):
+    """thread-safe rate limiter shared by many concurrent consumers.
+
+    rate: units (usually bytes) per second allowed across all consumers
+    burst: max units that can be consumed without waiting; default is
+        one second worth of rate.
+    """
+
+    def __init__(self, rate, burst=None):
+        if rate <= 0:
+            raise ValueError('rate must be positive, got(%s)' % rate)
+        self.rate = float(rate)
+        self.capacity = float(burst or rate)
+        self._tokens = self.capacity
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def consume(self, amount):
+        """blocks until `amount` units can be consumed."""
+        with self._lock:
+            now = time.time()
+            self._tokens = min(
+                    self.capacity,
+                    self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            # reserve now and pay the debt by sleeping; later callers
+            # see the debt and wait their turn.
+            self._tokens -= amount
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class KeyedSemaphore(object):
+    """one bounded semaphore per key, e.g. per device url.
+
+    use as `with sem.hold(key): ...` to cap concurrent calls per key.
+    """
+
+    def __init__(self, limit=1):
+        self.limit = limit
+        self._sems = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._sems:
+                self._sems[key] = threading.BoundedSemaphore(self.limit)
+            return self._sems[key]
+
+    def hold(self, key):
+        return self.get(key)
+
+
+def update_firmware(
+        clients, image_path, expected_version=None,
+        concurrency=4, bandwidth_limit=None, progress=None,
+        verify_timeout=900, verify_interval=15, tracer=None,
+        upload_timeout=_default_upload_timeout):
+    """upgrades firmware of many devices from one image file.
+
+    the image is memory-mapped once and shared by all uploads.
+
+    clients: list of epipearl clients
+    concurrency: max simultaneous uploads
+    bandwidth_limit: max bytes/sec summed over all uploads; None for no cap
+    progress: optional callable(client, bytes_sent, total_bytes)
+    tracer: optional tracing.Tracer for a span over the whole upgrade
+    upload_timeout: seconds each upload waits on its connection; see
+        Epipearl.update_firmware
+
+    returns dict {client.url: {'firmware_version': str, 'error': str}}
+    where one of the values is None.
+    """
+    from transfer import FirmwareImage
+    throttle = TokenBucket(bandwidth_limit) if bandwidth_limit else None
+
+    def upgrade(client):
+        cb = None
+        if progress is not None:
+            def _report(sent, total):
+                progress(client, sent, total)
+            cb = _report
+        return client.update_firmware(
+                image=image, expected_version=expected_version,
+                progress=cb, throttle=throttle,
+                verify_timeout=verify_timeout,
+                verify_interval=verify_interval,
+                upload_timeout=upload_timeout)
+
+    results = {}
+    with FirmwareImage(image_path) as image:
+        for (client, version, error) in map_concurrently(
+                upgrade, clients, concurrency=concurrency,
+                tracer=tracer, name='update_firmware'):
+            results[client.url] = {
+                    'firmware_version': version,
+                    'error': str(error) if error is not None else None}
+    return results
+
+
+def _expand(value, variables):
+    """replaces {key} by variables[key] in all strings of value."""
+    if isinstance(value, basestring):
+        for (k, v) in variables.items():
+            value = value.replace('{%s}' % k, v)
+        return value
+    if isinstance(value, dict):
+        return dict((k, _expand(v, variables)) for (k, v) in value.items())
+    if isinstance(value, list):
+        return [_expand(v, variables) for v in value]
+    return value
+
+
+def provision(client, spec, replace=True, **variables):
+    """configures a device as described by spec.
+
+    spec is a dict, e.g. loaded from json; all keys are optional:
+        {"channels": [{"name": "{name}-presenter",
+                       "rtmp": {"url": .., "stream": .., "user": ..,
+                                "passwd": ..},
+                       "layout": {..}}],
+         "recorders": [{"name": "{name}-vod",
+                        "channels": ["{name}-presenter"],
+                        "settings": {"output_format": "mp4"}}],
+         "mhpearl": {"device_name": "{name}", "device_channel": "{name}-vod",
+                     "admin_server_url": .., ..},
+         "ntp": {"server": .., "timezone": ..},
+         "touchscreen": {"screen_timeout": 600}}
+
+    strings in spec have {key} replaced by variables, e.g. name='room-101'.
+    recorder channels and mhpearl device_channel may name channels and
+    recorders created by the spec. replace: first deletes channels and
+    recorders with the names in spec.
+
+    returns dict {'channels': {name: id}, 'recorders': {name: id}}
+    """
+    spec = _expand(spec, variables)
+    channels = {}
+    recorders = {}
+    if replace:
+        infocfg = client.get_infocfg()
+        for c in spec.get('channels', []) + spec.get('recorders', []):
+            client.delete_channel_or_recorder_by_name(
+                    c['name'], infocfg=infocfg)
+
+    for c in spec.get('channels', []):
+        channel_id = client.create_channel(c['name'])
+        channels[c['name']] = channel_id
+        if 'layout' in c:
+            layout = c['layout']
+            if not isinstance(layout, basestring):
+                layout = json.dumps(layout)
+            client.set_channel_layout(channel_id, layout)
+        if 'rtmp' in c:
+            rtmp = c['rtmp']
+            client.set_channel_rtmp(
+                    channel_id, rtmp['url'], rtmp['stream'],
+                    rtmp.get('user', ''), rtmp.get('passwd', ''))
+
+    for r in spec.get('recorders', []):
+        recorder_id = client.create_recorder(r['name'])
+        recorders[r['name']] = recorder_id
+        if r.get('channels'):
+            client.set_recorder_channels(
+                    recorder_id,
+                    [channels.get(c, c) for c in r['channels']])
+        if 'settings' in r:
+            client.set_recorder_settings(recorder_id, **r['settings'])
+
+    if 'mhpearl' in spec:
+        settings = dict(spec['mhpearl'])
+        if 'device_channel' in settings:
+            settings['device_channel'] = recorders.get(
+                    settings['device_channel'], settings['device_channel'])
+        client.set_mhpearl_settings(**settings)
+    if 'ntp' in spec:
+        client.set_ntp(spec['ntp']['server'], spec['ntp']['timezone'])
+    if 'touchscreen' in spec:
+        client.set_touchscreen(**spec['touchscreen'])
+
+    return {'channels': channels, 'recorders': recorders}
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""disk capacity forecasting across the fleet.
+
+fed incrementally with polled sysinfo, the forecaster keeps per device the
+free space on the data mount, a smoothed observed fill rate and the write
+rate implied by the bitrates of channels that are recording; the larger of
+the two rates predicts when the device fills up.
+
+sysinfo reports disk sizes in KiB; they are kept in bytes.
+"""
+
+import threading
+import time
+
+_default_smoothing = 0.3
+
+
+def _bytes(kbytes):
+    return None if kbytes is None else int(kbytes) * 1024
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def channel_write_rate(channel):
+    """bytes/sec written when recording a sysinfo channel.
+
+    video bitrate is reported in bits/sec, audio bitrate in kbits/sec.
+    """
+    codecs = channel.get('codecs') or {}
+    video = _float((codecs.get('video') or {}).get('bitrate'))
+    audio = _float((codecs.get('audio') or {}).get('bitrate'))
+    return (video + audio * 1000) / 8.0
+
+
+class DeviceDiskState(object):
+
+    __slots__ = ('device', 'timestamp', 'total', 'free', 'observed_rate',
+                 'recording_rate', 'sizelimit_kbytes')
+
+    def __init__(self, device):
+        self.device = device
+        self.timestamp = None
+        self.total = None
+        self.free = None
+        self.observed_rate = None
+        self.recording_rate = 0.0
+        self.sizelimit_kbytes = {}
+
+    @property
+    def fill_rate(self):
+        """bytes/sec; max of observed and recording estimate."""
+        return max(self.observed_rate or 0.0, self.recording_rate)
+
+    def hours_left(self):
+        rate = self.fill_rate
+        if self.free is None or rate <= 0:
+            return None
+        return self.free / rate / 3600.0
+
+    def report(self):
+        limits = [k * 1024 for k in self.sizelimit_kbytes.values()]
+        return {
+                'device': self.device,
+                'timestamp': self.timestamp,
+                'total': self.total,
+                'free': self.free,
+                'fill_rate': self.fill_rate,
+                'observed_rate': self.observed_rate,
+                'recording_rate': self.recording_rate,
+                'hours_left': self.hours_left(),
+                'sizelimit_exceeds_free': bool(
+                    limits and self.free is not None and
+                    max(limits) > self.free)}
+
+
+class DiskForecaster(object):
+    """tracks free space per device from polled sysinfo.
+
+    smoothing: weight of the newest observation in the exponentially
+        smoothed fill rate.
+    """
+
+    def __init__(self, smoothing=_default_smoothing):
+        self.smoothing = smoothing
+        self.devices = {}
+        self._recorder_channels = {}
+        self._lock = threading.Lock()
+
+    def _state(self, device):
+        with self._lock:
+            if device not in self.devices:
+                self.devices[device] = DeviceDiskState(device)
+            return self.devices[device]
+
+    def set_recorder(self, device, recorder_id, channel_ids=None,
+                     sizelimit_kbytes=None):
+        """records config of a recorder, as given to set_recorder_channels
+        and set_recorder_settings; recorders report no bitrate of their own.
+        """
+        if channel_ids is not None:
+            self._recorder_channels[(device, 'm%s' % recorder_id)] = \
+                list(channel_ids)
+        if sizelimit_kbytes is not None:
+            self._state(device).sizelimit_kbytes[str(recorder_id)] = \
+                int(sizelimit_kbytes)
+
+    def update(self, device, sysinfo, timestamp=None):
+        """folds one sysinfo poll into device state; returns the state."""
+        state = self._state(device)
+        data = sysinfo.get('system', {}).get('data', {})
+        if timestamp is None:
+            timestamp = sysinfo.get('time') or time.time()
+        free = _bytes(data.get('available', data.get('free')))
+
+        channels = dict((c['id'], c) for c in sysinfo.get('channels', []))
+        rate = 0.0
+        for (channel_id, c) in channels.items():
+            if not (c.get('recorder') or {}).get('enabled'):
+                continue
+            mapped = self._recorder_channels.get((device, channel_id))
+            if mapped is None:
+                rate += channel_write_rate(c)
+            else:
+                rate += sum(channel_write_rate(channels[m])
+                            for m in mapped if m in channels)
+
+        if free is not None and state.free is not None and \
+                timestamp > state.timestamp:
+            observed = (state.free - free) / float(
+                    timestamp - state.timestamp)
+            if state.observed_rate is None:
+                state.observed_rate = observed
+            else:
+                state.observed_rate += self.smoothing * (
+                        observed - state.observed_rate)
+
+        state.recording_rate = rate
+        if free is not None:
+            state.free = free
+            state.total = _bytes(data.get('total'))
+            state.timestamp = timestamp
+        return state
+
+    def at_risk(self, hours):
+        """devices predicted to fill up within hours, soonest first.
+
+        also includes devices where a single recording, at its configured
+        size limit, could take more than the free space.
+        """
+        reports = []
+        for state in list(self.devices.values()):
+            r = state.report()
+            left = r['hours_left']
+            if (left is not None and left <= hours) or \
+                    r['sizelimit_exceeds_free']:
+                reports.append(r)
+        reports.sort(key=lambda r: (
+            r['hours_left'] is None, r['hours_left'], r['device']))
+        return reports
@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+"""local gateway that multiplexes many consumers onto one client per device.
+
+dashboards, cron jobs and operators talk to the gateway instead of the
+devices. reads are served from a shared cache with stale-while-revalidate,
+writes go through one serialized queue per device, and each device is
+reached through a single pooled connection set, however many consumers
+there are. with --state-cache, reads are also kept in a sqlite file, so a
+restarted gateway serves them at once while it revalidates.
+
+http/json api:
+    GET  /devices                          device names
+    GET  /devices/<name>/inventory         channels, recorders, sources
+    GET  /devices/<name>/status            sysinfo
+    GET  /devices/<name>/params/<channel>?keys=k1,k2
+    POST /devices/<name>/params/<channel>  json body {"k1": "v1", ...}
+
+run with:
+    python -m epipearl.gateway --inventory devices.json --port 8080 \
+        --state-cache /var/cache/epipearl/gateway.db
+"""
+
+import argparse
+import json
+import logging
+import threading
+import time
+
+from BaseHTTPServer import BaseHTTPRequestHandler
+from BaseHTTPServer import HTTPServer
+from Queue import Queue
+from SocketServer import ThreadingMixIn
+from urlparse import parse_qs
+from urlparse import urlparse
+
+from fleet import clients_from_inventory
+from fleet import load_inventory
+from state_cache import StateCache
+from transport import RequestsTransport
+
+logger = logging.getLogger(__name__)
+
+_default_ttl = 5.0
+_default_stale_ttl = 60.0
+
+
+class StaleWhileRevalidateCache(object):
+    """cache of values fetched by key.
+
+    an entry younger than ttl is served as is; one younger than stale_ttl
+    is served while a background refresh runs; older or missing entries
+    are fetched before returning. concurrent requests for the same key
+    share one fetch. a fetch that started before an invalidate() of its
+    key, e.g. a read racing a write, does not store its result.
+
+    store: optional state_cache.StateCache where fetched values persist,
+        for keys that are tuples (device, ..); a key missing in memory is
+        loaded from store and served stale while refreshed, if younger
+        than store_max_age (None for the max_age of store)
+    """
+
+    def __init__(self, ttl=_default_ttl, stale_ttl=_default_stale_ttl,
+                 store=None, store_max_age=None):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.store = store
+        self.store_max_age = store_max_age
+        self._entries = {}
+        self._loaded = set()    # keys with entries from store
+        self._inflight = {}
+        self._generations = {}  # key: number of invalidations
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def get(self, key, fetch):
+        if self._persistent(key):
+            with self._lock:
+                missing = key not in self._entries
+            if missing:
+                self._load(key)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[1] < self.ttl:
+                self.hits += 1
+                return entry[0]
+            (flight, owner) = self._flight(key)
+            if entry is not None and (
+                    now - entry[1] < self.stale_ttl or key in self._loaded):
+                self.stale_hits += 1
+                if owner:
+                    t = threading.Thread(
+                            target=self._fetch, args=(key, fetch, flight))
+                    t.daemon = True
+                    t.start()
+                return entry[0]
+            self.misses += 1
+
+        if owner:
+            self._fetch(key, fetch, flight)
+        flight['done'].wait()
+        if 'error' in flight:
+            raise flight['error']
+        return flight['value']
+
+    def _flight(self, key):
+        """returns (in-flight fetch for key, True if caller must run it).
+
+        called with lock held.
+        """
+        flight = self._inflight.get(key)
+        if flight is not None:
+            return (flight, False)
+        flight = {'done': threading.Event(),
+                  'generation': self._generations.get(key, 0)}
+        self._inflight[key] = flight
+        return (flight, True)
+
+    def _persistent(self, key):
+        return self.store is not None and isinstance(key, tuple)
+
+    def _load(self, key):
+        entry = self.store.get(
+                key[0], json.dumps(key[1:]), max_age=self.store_max_age)
+        if entry is not None:
+            with self._lock:
+                if key not in self._entries:
+                    self._entries[key] = entry
+                    self._loaded.add(key)
+
+    def _fetch(self, key, fetch, flight):
+        try:
+            flight['value'] = fetch()
+        except Exception as e:
+            flight['error'] = e
+            logger.warning('failed to fetch(%s) - %s' % (key, e))
+        else:
+            now = time.time()
+            with self._lock:
+                current = \
+                    flight['generation'] == self._generations.get(key, 0)
+                if current:
+                    self._entries[key] = (flight['value'], now)
+                    self._loaded.discard(key)
+            if not current:
+                logger.debug('dropped fetch(%s) older than invalidation'
+                             % (key,))
+            elif self._persistent(key):
+                (device, k) = (key[0], json.dumps(key[1:]))
+                self.store.put(device, k, flight['value'], updated=now)
+                with self._lock:
+                    current = \
+                        flight['generation'] == self._generations.get(key, 0)
+                if not current:
+                    # invalidated while storing, maybe before the put
+                    self.store.delete(device, k)
+        finally:
+            with self._lock:
+                if self._inflight.get(key) is flight:
+                    del self._inflight[key]
+            flight['done'].set()
+
+    def invalidate(self, match):
+        """drops entries whose key satisfies match(key); fetches of these
+        keys in flight are not stored, and later requests fetch again."""
+        with self._lock:
+            for key in [k for k in self._entries if match(k)]:
+                del self._entries[key]
+                self._loaded.discard(key)
+            for key in [k for k in self._inflight if match(k)]:
+                del self._inflight[key]
+                self._generations[key] = self._generations.get(key, 0) + 1
+        if self.store is not None:
+            for (device, k) in self.store.keys():
+                if match((device,) + tuple(json.loads(k))):
+                    self.store.delete(device, k)
+
+
+class SerialQueue(object):
+    """runs submitted calls one at a time, in submission order."""
+
+    def __init__(self):
+        self._queue = Queue()
+        t = threading.Thread(target=self._run)
+        t.daemon = True
+        t.start()
+
+    def _run(self):
+        while True:
+            (func, result) = self._queue.get()
+            try:
+                result['value'] = func()
+            except Exception as e:
+                result['error'] = e
+            result['done'].set()
+
+    def submit(self, func):
+        """queues func() and waits for its result."""
+        result = {'done': threading.Event()}
+        self._queue.put((func, result))
+        result['done'].wait()
+        if 'error' in result:
+            raise result['error']
+        return result['value']
+
+
+class Gateway(object):
+    """device names mapped to clients, shared cache and write queues.
+
+    devices: dict {name: epipearl client}
+    """
+
+    def __init__(self, devices, ttl=_default_ttl,
+                 stale_ttl=_default_stale_ttl, store=None, store_max_age=None):
+        self.devices = devices
+        self.cache = StaleWhileRevalidateCache(
+                ttl=ttl, stale_ttl=stale_ttl, store=store,
+                store_max_age=store_max_age)
+        self._writes = dict((name, SerialQueue()) for name in devices)
+
+    @classmethod
+    def from_inventory(cls, devices, pool_maxsize=4, **kwargs):
+        clients = clients_from_inventory(
+                devices, transport_factory=lambda: RequestsTransport(
+                    pool_maxsize=pool_maxsize))
+        return cls(dict(
+            (d['name'], c) for (d, c) in zip(devices, clients)), **kwargs)
+
+    def inventory(self, name):
+        client = self.devices[name]
+        return self.cache.get((name, 'inventory'), client.get_infocfg)
+
+    def status(self, name):
+        client = self.devices[name]
+        return self.cache.get((name, 'status'), client.get_sysinfo)
+
+    def get_params(self, name, channel, keys):
+        client = self.devices[name]
+        keys = tuple(sorted(keys))
+        return self.cache.get(
+                (name, 'params', channel, keys),
+                lambda: client.get_params(
+                    channel, dict((k, '') for k in keys)))
+
+    def set_params(self, name, channel, params):
+        client = self.devices[name]
+        ok = self._writes[name].submit(
+                lambda: client.set_params(channel, params))
+        self.cache.invalidate(lambda k: k[0] == name and (
+            k[1] == 'status' or (k[1] == 'params' and k[2] == channel)))
+        return ok
+
+    def make_server(self, host='127.0.0.1', port=8080):
+        gateway = self
+
+        class Handler(GatewayRequestHandler):
+            pass
+        Handler.gateway = gateway   # handler classes are classic in py2
+        return ThreadingHTTPServer((host, port), Handler)
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class GatewayRequestHandler(BaseHTTPRequestHandler):
+
+    gateway = None
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _route(self):
+        url = urlparse(self.path)
+        parts = [p for p in url.path.split('/') if p]
+        return (parts, parse_qs(url.query))
+
+    def _handle(self, method):
+        (parts, query) = self._route()
+        g = self.gateway
+        try:
+            if parts == ['devices'] and method == 'GET':
+                return self._reply(200, sorted(g.devices.keys()))
+            if len(parts) < 3 or parts[0] != 'devices':
+                return self._reply(404, {'error': 'not found'})
+            name = parts[1]
+            if name not in g.devices:
+                return self._reply(404, {'error': 'unknown device(%s)' % name})
+            if parts[2:] == ['inventory'] and method == 'GET':
+                return self._reply(200, g.inventory(name))
+            if parts[2:] == ['status'] and method == 'GET':
+                return self._reply(200, g.status(name))
+            if len(parts) == 4 and parts[2] == 'params':
+                channel = parts[3]
+                if method == 'GET':
+                    keys = ','.join(query.get('keys', [])).split(',')
+                    return self._reply(200, g.get_params(
+                        name, channel, [k for k in keys if k]))
+                length = int(self.headers.get('Content-Length', 0))
+                params = json.loads(self.rfile.read(length) or '{}')
+                return self._reply(200, {
+                    'ok': g.set_params(name, channel, params)})
+            return self._reply(404, {'error': 'not found'})
+        except Exception as e:
+            logger.error('gateway call(%s %s) failed - %s' % (
+                method, self.path, e))
+            return self._reply(502, {'error': str(e)})
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+            description='local caching gateway to epiphan pearl devices')
+    parser.add_argument('--inventory', required=True,
+                        help='json file with devices')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--ttl', type=float, default=_default_ttl,
+                        help='seconds a cached read is fresh')
+    parser.add_argument('--stale-ttl', type=float, default=_default_stale_ttl,
+                        help='seconds a cached read can be served stale')
+    parser.add_argument('--state-cache', metavar='PATH',
+                        help='sqlite file to keep reads across restarts')
+    parser.add_argument('--state-max-age', type=float,
+                        help='seconds a read kept in state cache can be '
+                        'served stale after a restart; no limit if not set')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    store = StateCache(args.state_cache) if args.state_cache else None
+    gateway = Gateway.from_inventory(
+            load_inventory(args.inventory),
+            ttl=args.ttl, stale_ttl=args.stale_ttl, store=store,
+            store_max_age=args.state_max_age)
+    server = gateway.make_server(args.host, args.port)
+    logger.info('gateway listening on %s:%s' % (args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,385 @@
+# -*- coding: utf-8 -*-
+"""scenario-driven load harness for fleet operations.
+
+runs a scenario against N fake devices (see fakepearl) at a given client
+concurrency, and reports makespan, per operation latency percentiles and
+errors, requests per device and peak client memory.
+
+scenarios:
+    provision   full room setup: channels, rtmp, recorder, mhpearl, ntp
+    ntp         fleet-wide set_ntp
+    inventory   get_infocfg sweep
+    poll        rounds of get_sysinfo plus get_params per channel
+
+devices run in-process without sockets (memory), on local http ports in
+this process (http), or in a child process (subprocess), which keeps the
+fake devices out of the client memory numbers.
+
+    python -m epipearl.loadtest --scenario provision --devices 1000 \\
+        --concurrency 64 --latency 0.05 --failure-rate 0.01
+"""
+
+import argparse
+import json
+import logging
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from collections import defaultdict
+from urlparse import urlparse
+
+from epipearl import Epipearl
+from fakepearl import FakePearl
+from fakepearl import FakePearlFleet
+from fleet import clients_from_inventory
+from fleet import map_concurrently
+from stats import percentile
+
+logger = logging.getLogger(__name__)
+
+_default_concurrency = 8
+_default_poll_rounds = 5
+_spawn_timeout = 60
+
+
+def _rss():
+    """current resident memory of this process, in bytes."""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (IOError, OSError):
+        # ru_maxrss is in kbytes on linux, bytes on macos
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == 'darwin' else rss * 1024
+
+
+class MemorySampler(object):
+    """samples process rss in a background thread; keeps the peak."""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.start_rss = None
+        self.peak_rss = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak_rss = max(self.peak_rss, _rss())
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self.start_rss = self.peak_rss = _rss()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.peak_rss = max(self.peak_rss, _rss())
+
+
+class OpRecorder(object):
+    """latencies and errors per operation, plus requests per device."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(lambda: defaultdict(int))
+        self.requests = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def timed(self, op, func, *args, **kwargs):
+        """calls func, recording its latency under op; re-raises errors."""
+        start = time.time()
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            with self._lock:
+                self.errors[op][e.__class__.__name__] += 1
+            raise
+        finally:
+            with self._lock:
+                self.latencies[op].append(time.time() - start)
+
+    def count_request(self, device):
+        with self._lock:
+            self.requests[device] += 1
+
+    def summary(self):
+        ops = {}
+        for (op, values) in sorted(self.latencies.items()):
+            ops[op] = {
+                    'count': len(values),
+                    'errors': dict(self.errors.get(op, {})),
+                    'mean': sum(values) / len(values),
+                    'p50': percentile(values, 50),
+                    'p95': percentile(values, 95),
+                    'p99': percentile(values, 99),
+                    'max': max(values)}
+        counts = list(self.requests.values()) or [0]
+        return {
+                'ops': ops,
+                'requests_total': sum(counts),
+                'requests_per_device': {
+                    'min': min(counts), 'max': max(counts),
+                    'mean': sum(counts) / float(len(counts))}}
+
+
+class CountingTransport(object):
+    """wraps a transport, counting requests per device host."""
+
+    def __init__(self, transport, recorder):
+        self.transport = transport
+        self.recorder = recorder
+
+    def request(self, method, url, **kwargs):
+        self.recorder.count_request(urlparse(url).netloc)
+        return self.transport.request(method, url, **kwargs)
+
+    def close(self):
+        self.transport.close()
+
+
+#
+# scenarios: each is a callable(client, recorder, index)
+#
+
+def provision_room(client, rec, index):
+    """sets up a lecture room: two live channels pushing rtmp, a recorder
+    of both, and matterhorn capture agent, ntp and touchscreen settings."""
+    room = 'room-%04d' % index
+    channels = []
+    for kind in ('presenter', 'presentation'):
+        channel_id = rec.timed(
+                'create_channel', client.create_channel,
+                '%s-%s' % (room, kind))
+        rec.timed(
+                'set_channel_rtmp', client.set_channel_rtmp, channel_id,
+                'rtmp://live.example.edu/%s' % room, kind, 'pushuser',
+                'pushpasswd')
+        channels.append(channel_id)
+    recorder_id = rec.timed(
+            'create_recorder', client.create_recorder, '%s-vod' % room)
+    rec.timed('set_recorder_channels', client.set_recorder_channels,
+              recorder_id, channels)
+    rec.timed('set_recorder_settings', client.set_recorder_settings,
+              recorder_id, output_format='mp4')
+    rec.timed('set_mhpearl_settings', client.set_mhpearl_settings,
+              device_name=room, device_channel=recorder_id,
+              file_search_range_in_seconds='60',
+              admin_server_url='http://mh.example.edu',
+              admin_server_usr='mhuser', admin_server_pwd='mhpasswd')
+    rec.timed('set_ntp', client.set_ntp, 'pool.ntp.org', 'US/Eastern')
+    rec.timed('set_touchscreen', client.set_touchscreen)
+
+
+def set_ntp(client, rec, index):
+    rec.timed('set_ntp', client.set_ntp, 'pool.ntp.org', 'US/Eastern')
+
+
+def inventory_sweep(client, rec, index):
+    rec.timed('get_infocfg', client.get_infocfg)
+
+
+def status_poll(client, rec, index, rounds=_default_poll_rounds,
+                interval=0.0):
+    channels = [c['id'] for c in rec.timed(
+        'get_infocfg', client.get_infocfg)['channels']]
+    for i in range(rounds):
+        rec.timed('get_sysinfo', client.get_sysinfo)
+        for channel in channels:
+            rec.timed('get_params', client.get_params, channel,
+                      {'publish_type': '', 'rec_enabled': ''})
+        if interval:
+            time.sleep(interval)
+
+
+scenarios = {
+        'provision': provision_room,
+        'ntp': set_ntp,
+        'inventory': inventory_sweep,
+        'poll': status_poll,
+        }
+
+
+#
+# devices
+#
+
+def spawn_fleet(count, **kwargs):
+    """starts fake devices in a child process.
+
+    kwargs: fakepearl command line options, e.g. latency=0.05
+    returns (process, inventory); terminate the process when done.
+    """
+    tmpdir = tempfile.mkdtemp()
+    path = os.path.join(tmpdir, 'devices.json')
+    cmd = [sys.executable, '-m', 'epipearl.fakepearl',
+           '--count', str(count), '--inventory', path]
+    for (k, v) in sorted(kwargs.items()):
+        cmd += ['--%s' % k.replace('_', '-'), str(v)]
+    proc = subprocess.Popen(cmd)
+    try:
+        deadline = time.time() + _spawn_timeout
+        while True:
+            if proc.poll() is not None:
+                raise RuntimeError('fake devices exited(%s)' % proc.returncode)
+            if os.path.exists(path):
+                try:
+                    with open(path, 'r') as f:
+                        return (proc, json.load(f))
+                except ValueError:
+                    pass    # still being written
+            if time.time() > deadline:
+                raise RuntimeError('fake devices did not start in time')
+            time.sleep(0.1)
+    except Exception:
+        proc.terminate()
+        raise
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def run_scenario(scenario, clients, concurrency=_default_concurrency,
+                 recorder=None, **kwargs):
+    """runs scenario on every client; returns report dict.
+
+    scenario: name in `scenarios`, or callable(client, recorder, index)
+    kwargs: passed to the scenario callable
+    """
+    func = scenarios[scenario] if scenario in scenarios else scenario
+    rec = recorder or OpRecorder()
+    indexed = list(enumerate(clients))
+    sampler = MemorySampler().start()
+    failed = []
+    start = time.time()
+    try:
+        for ((i, client), result, error) in map_concurrently(
+                lambda item: func(item[1], rec, item[0], **kwargs),
+                indexed, concurrency=concurrency):
+            if error is not None:
+                failed.append({'device': client.url, 'error': '%s: %s' % (
+                    error.__class__.__name__, error)})
+    finally:
+        makespan = time.time() - start
+        sampler.stop()
+
+    report = rec.summary()
+    report.update({
+        'scenario': getattr(func, '__name__', str(scenario)),
+        'devices': len(indexed),
+        'concurrency': concurrency,
+        'makespan': makespan,
+        'failed_devices': failed,
+        'peak_rss_bytes': sampler.peak_rss,
+        'rss_growth_bytes': sampler.peak_rss - sampler.start_rss})
+    return report
+
+
+def run_load(scenario, devices, concurrency=_default_concurrency,
+             mode='memory', latency=0.0, jitter=0.0, failure_rate=0.0,
+             timeout=None, seed=None, **kwargs):
+    """builds a fake fleet of `devices` and runs scenario against it.
+
+    mode: 'memory', 'http' or 'subprocess'
+    """
+    rec = OpRecorder()
+    fake = dict(latency=latency, jitter=jitter, failure_rate=failure_rate)
+    proc = None
+    fleet = None
+    if mode == 'memory':
+        fakes = [FakePearl(name='fakepearl%03d' % i, seed=seed, **fake)
+                 for i in range(devices)]
+        clients = [Epipearl(
+            'http://%s' % f.name, f.user, f.passwd, timeout=timeout,
+            transport=CountingTransport(f.transport(), rec)) for f in fakes]
+    else:
+        if mode == 'http':
+            fleet = FakePearlFleet(devices, **fake).start()
+            inventory = fleet.inventory()
+        elif mode == 'subprocess':
+            (proc, inventory) = spawn_fleet(devices, **fake)
+        else:
+            raise ValueError('unknown mode(%s)' % mode)
+        clients = clients_from_inventory(inventory, timeout=timeout)
+        for c in clients:
+            c.transport = CountingTransport(c.transport, rec)
+    try:
+        report = run_scenario(
+                scenario, clients, concurrency=concurrency, recorder=rec,
+                **kwargs)
+    finally:
+        if fleet is not None:
+            fleet.stop()
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+    report.update({'mode': mode, 'latency': latency, 'jitter': jitter,
+                   'failure_rate': failure_rate})
+    return report
+
+
+def format_report(report):
+    lines = [
+        'scenario(%s) devices(%s) concurrency(%s) mode(%s)' % (
+            report['scenario'], report['devices'], report['concurrency'],
+            report.get('mode', '-')),
+        'makespan %.2fs, %s requests, per device min/mean/max %s/%.1f/%s' % (
+            report['makespan'], report['requests_total'],
+            report['requests_per_device']['min'],
+            report['requests_per_device']['mean'],
+            report['requests_per_device']['max']),
+        'failed devices %s, peak rss %.1f MB (+%.1f MB)' % (
+            len(report['failed_devices']),
+            report['peak_rss_bytes'] / 1048576.0,
+            report['rss_growth_bytes'] / 1048576.0),
+        '%-24s %7s %7s %9s %9s %9s %9s' % (
+            'operation', 'count', 'errors', 'p50(ms)', 'p95(ms)', 'p99(ms)',
+            'max(ms)')]
+    for (op, s) in sorted(report['ops'].items()):
+        lines.append('%-24s %7s %7s %9.1f %9.1f %9.1f %9.1f' % (
+            op, s['count'], sum(s['errors'].values()), s['p50'] * 1000,
+            s['p95'] * 1000, s['p99'] * 1000, s['max'] * 1000))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+            description='load test fleet operations against fake devices')
+    parser.add_argument('--scenario', choices=sorted(scenarios),
+                        default='provision')
+    parser.add_argument('--devices', type=int, default=100)
+    parser.add_argument('--concurrency', type=int,
+                        default=_default_concurrency)
+    parser.add_argument('--mode', choices=('memory', 'http', 'subprocess'),
+                        default='memory')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds per device request')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--rounds', type=int, default=_default_poll_rounds,
+                        help='poll scenario rounds')
+    parser.add_argument('--json', action='store_true',
+                        help='print report as json')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.CRITICAL)
+    kwargs = {'rounds': args.rounds} if args.scenario == 'poll' else {}
+    report = run_load(
+            args.scenario, args.devices, concurrency=args.concurrency,
+            mode=args.mode, latency=args.latency, jitter=args.jitter,
+            failure_rate=args.failure_rate, **kwargs)
+    print(json.dumps(report, indent=2, sort_keys=True) if args.json
+          else format_report(report))
+
+
+if __name__ == '__main__':
+    main()
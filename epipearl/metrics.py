@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""per device and per operation metrics of client calls.
+
+a client created with a Metrics instance records, for every request, the
+device, the logical operation (e.g. 'set_channel_rtmp', 'get_infocfg'),
+latency, response bytes and error class, plus time spent parsing pages.
+metrics export as a dict snapshot or prometheus text exposition.
+
+clients without metrics skip all of it; the cost is a None check per
+request and per endpoint call.
+"""
+
+import functools
+import threading
+import time
+
+from collections import defaultdict
+
+from timing import add_phase
+
+_latency_buckets = (
+        0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+_bytes_buckets = (
+        1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+_local = threading.local()
+
+
+def current_operation():
+    """operation name being run in this thread, or None."""
+    return getattr(_local, 'operation', None)
+
+
+def operation(name, client_arg=1):
+    """decorates an endpoint call so requests it makes are recorded under
+    operation `name`; the outermost decorated call names the operation.
+    with a client tracer, every decorated call opens a span, nested ones
+    as children.
+
+    client_arg: position of the client in the call args; 1 for
+        classmethods (after cls), 0 for plain functions.
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            client = kwargs.get('client')
+            if client is None and len(args) > client_arg:
+                client = args[client_arg]
+            tracer = getattr(client, 'tracer', None)
+            if tracer is None:
+                return _measured(name, client, func, args, kwargs)
+            with tracer.span(name, {'epipearl.operation': name,
+                                    'epipearl.device': client.url}):
+                return _measured(name, client, func, args, kwargs)
+        return wrapper
+    return decorate
+
+
+def _measured(name, client, func, args, kwargs):
+    timing = getattr(client, 'timing', None)
+    if (timing is None and getattr(client, 'metrics', None) is None) or \
+            current_operation() is not None:
+        return func(*args, **kwargs)
+    _local.operation = name
+    try:
+        if timing is None:
+            return func(*args, **kwargs)
+        return timing.run(name, client.url, func, args, kwargs)
+    finally:
+        _local.operation = None
+
+
+def parse_html(client, text):
+    """BeautifulSoup of text, recording parse time in client metrics and
+    timing."""
+    from bs4 import BeautifulSoup
+    metrics = getattr(client, 'metrics', None)
+    if metrics is None and getattr(client, 'timing', None) is None:
+        return BeautifulSoup(text, 'html.parser')
+    start = time.time()
+    soup = BeautifulSoup(text, 'html.parser')
+    observe_parse(client, time.time() - start)
+    return soup
+
+
+def observe_parse(client, seconds):
+    """records seconds spent parsing a page of client's device."""
+    if client.metrics is not None:
+        client.metrics.observe_parse(client.url, seconds)
+    add_phase('parse', seconds)
+
+
+class Histogram(object):
+    """cumulative histogram with fixed upper bounds, as in prometheus."""
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for (i, bound) in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def cumulative(self):
+        """[(upper bound, count of values <= bound)], ending with +Inf."""
+        result = []
+        total = 0
+        for (bound, n) in zip(self.buckets, self.counts):
+            total += n
+            result.append((bound, total))
+        result.append((float('inf'), self.count))
+        return result
+
+    def as_dict(self):
+        return {
+                'buckets': [[('+Inf' if b == float('inf') else b), n]
+                            for (b, n) in self.cumulative()],
+                'sum': self.sum,
+                'count': self.count}
+
+
+class _Series(object):
+
+    __slots__ = ('requests', 'errors', 'latency', 'bytes', 'parse')
+
+    def __init__(self, latency_buckets, bytes_buckets):
+        self.requests = 0
+        self.errors = defaultdict(int)
+        self.latency = Histogram(latency_buckets)
+        self.bytes = Histogram(bytes_buckets)
+        self.parse = Histogram(latency_buckets)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace(
+            '\n', '\\n')
+
+
+def _labels(**labels):
+    return '{%s}' % ','.join(
+            '%s="%s"' % (k, _escape(v)) for (k, v) in sorted(labels.items()))
+
+
+def _bound(b):
+    return '+Inf' if b == float('inf') else repr(float(b))
+
+
+class Metrics(object):
+    """thread-safe registry of request metrics keyed by (device, op).
+
+    requests made outside a decorated operation are recorded under the
+    http method, e.g. 'get'.
+    """
+
+    def __init__(self, latency_buckets=_latency_buckets,
+                 bytes_buckets=_bytes_buckets, prefix='epipearl'):
+        self.latency_buckets = latency_buckets
+        self.bytes_buckets = bytes_buckets
+        self.prefix = prefix
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _get(self, device, op):
+        key = (device, op)
+        s = self._series.get(key)
+        if s is None:
+            s = self._series.setdefault(
+                    key, _Series(self.latency_buckets, self.bytes_buckets))
+        return s
+
+    def track(self, device, method, send):
+        """calls send() -> requests.Response, recording the request."""
+        op = current_operation() or method.lower()
+        start = time.time()
+        error = None
+        resp = None
+        try:
+            resp = send()
+            return resp
+        except Exception as e:
+            error = e.__class__.__name__
+            resp = getattr(e, 'response', None)
+            raise
+        finally:
+            elapsed = time.time() - start
+            nbytes = _response_bytes(resp)
+            with self._lock:
+                s = self._get(device, op)
+                s.requests += 1
+                s.latency.observe(elapsed)
+                if nbytes is not None:
+                    s.bytes.observe(nbytes)
+                if error is not None:
+                    s.errors[error] += 1
+
+    def observe_parse(self, device, seconds):
+        op = current_operation() or 'parse'
+        with self._lock:
+            self._get(device, op).parse.observe(seconds)
+
+    def reset(self):
+        with self._lock:
+            self._series = {}
+
+    def snapshot(self):
+        """returns list of dicts, one per (device, operation)."""
+        with self._lock:
+            items = sorted(self._series.items())
+            return [{
+                'device': device,
+                'operation': op,
+                'requests': s.requests,
+                'errors': dict(s.errors),
+                'latency': s.latency.as_dict(),
+                'bytes': s.bytes.as_dict(),
+                'parse': s.parse.as_dict()}
+                for ((device, op), s) in items]
+
+    def prometheus_text(self):
+        """metrics in prometheus text exposition format, version 0.0.4."""
+        p = self.prefix
+        with self._lock:
+            items = sorted(self._series.items())
+            lines = [
+                '# HELP %s_requests_total Requests sent to devices.' % p,
+                '# TYPE %s_requests_total counter' % p]
+            for ((device, op), s) in items:
+                lines.append('%s_requests_total%s %s' % (
+                    p, _labels(device=device, operation=op), s.requests))
+
+            lines += [
+                '# HELP %s_request_errors_total Failed requests by error '
+                'class.' % p,
+                '# TYPE %s_request_errors_total counter' % p]
+            for ((device, op), s) in items:
+                for (error, n) in sorted(s.errors.items()):
+                    lines.append('%s_request_errors_total%s %s' % (
+                        p, _labels(device=device, operation=op, error=error),
+                        n))
+
+            for (name, attr, help_text) in (
+                    ('request_duration_seconds', 'latency',
+                     'Request latency.'),
+                    ('response_bytes', 'bytes', 'Response body size.'),
+                    ('parse_duration_seconds', 'parse',
+                     'Time parsing device pages.')):
+                metric = '%s_%s' % (p, name)
+                lines += ['# HELP %s %s' % (metric, help_text),
+                          '# TYPE %s histogram' % metric]
+                for ((device, op), s) in items:
+                    h = getattr(s, attr)
+                    if not h.count:
+                        continue
+                    for (bound, n) in h.cumulative():
+                        lines.append('%s_bucket%s %s' % (
+                            metric, _labels(device=device, operation=op,
+                                            le=_bound(bound)), n))
+                    labels = _labels(device=device, operation=op)
+                    lines.append('%s_sum%s %r' % (metric, labels, h.sum))
+                    lines.append('%s_count%s %s' % (metric, labels, h.count))
+        return '\n'.join(lines) + '\n'
+
+
+def _response_bytes(resp):
+    """body size without consuming streamed responses."""
+    if resp is None:
+        return None
+    if getattr(resp, '_content_consumed', False) and resp._content:
+        return len(resp._content)
+    length = resp.headers.get('content-length')
+    try:
+        return int(length) if length is not None else None
+    except ValueError:
+        return None
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""periodic status polling of many devices with adaptive intervals.
+
+reads are kept in a heap ordered by due time. a read whose values changed
+since the previous poll is scheduled sooner next time, and one whose
+values did not change is scheduled later, within [min, max] interval;
+first reads are spread across one interval and random jitter keeps reads
+from bunching up afterwards. calls per device are capped,
+and reads for a busy device wait parked until one of its calls finishes.
+"""
+
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+
+from collections import deque
+from Queue import Empty
+from Queue import Queue
+
+logger = logging.getLogger(__name__)
+
+
+class PollTarget(object):
+    """one periodic read, e.g. get_params for a channel.
+
+    fetch: callable() returning a dict of current values
+    device: key for per device concurrency limit, usually client url
+    """
+
+    __slots__ = ('key', 'device', 'fetch', 'interval', 'due', 'values',
+                 'polls', 'changes', 'errors', 'removed')
+
+    def __init__(self, key, device, fetch, interval):
+        self.key = key
+        self.device = device
+        self.fetch = fetch
+        self.interval = interval
+        self.due = 0
+        self.values = None
+        self.polls = 0
+        self.changes = 0
+        self.errors = 0
+        self.removed = False
+
+
+class Poller(object):
+    """runs periodic reads across the fleet.
+
+    callback: callable(target, values, previous) called after every
+        successful read, in a worker thread; previous is None on first read.
+    on_error: optional callable(target, exception)
+    min_interval, max_interval: bounds, in seconds, for adaptive intervals
+    interval: initial interval for new targets
+    speedup: interval factor after a read that changed values
+    slowdown: interval factor after a read with unchanged values or error
+    jitter: fraction of interval randomly added or subtracted
+    per_device: max simultaneous reads per device
+    concurrency: number of worker threads
+    clock: callable() returning current time in seconds, for due times
+    spread: if true, the first read of a target is at a random time within
+        its interval, so adding a fleet does not read every device at once;
+        if false, it is right away
+    """
+
+    def __init__(
+            self, callback=None, on_error=None,
+            min_interval=2.0, max_interval=120.0, interval=10.0,
+            speedup=0.5, slowdown=1.5, jitter=0.1,
+            per_device=2, concurrency=16, clock=time.time, spread=True):
+        self.callback = callback
+        self.on_error = on_error
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = interval
+        self.speedup = speedup
+        self.slowdown = slowdown
+        self.jitter = jitter
+        self.per_device = per_device
+        self.concurrency = concurrency
+        self.clock = clock
+        self.spread = spread
+
+        self.targets = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._inflight = {}
+        self._parked = {}
+        self._cond = threading.Condition()
+        self._work = Queue()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def add(self, key, device, fetch, interval=None):
+        """schedules fetch() to run periodically, first run within one
+        interval, or right away if not spread."""
+        target = PollTarget(
+                key, device, fetch, interval or self.interval)
+        due = self.clock()
+        if self.spread:
+            due += random.uniform(0, target.interval)
+        with self._cond:
+            if key in self.targets:
+                self.targets[key].removed = True
+            self.targets[key] = target
+            self._push(target, due)
+        return target
+
+    def add_params(self, client, channel, params, interval=None):
+        """polls client.get_params(channel, params)."""
+        names = dict((k, '') for k in params)
+        return self.add(
+                key=(client.url, channel),
+                device=client.url,
+                fetch=lambda: client.get_params(channel, names),
+                interval=interval)
+
+    def add_sysinfo(self, client, interval=None):
+        """polls client.get_sysinfo()."""
+        return self.add(
+                key=(client.url, 'sysinfo'),
+                device=client.url,
+                fetch=client.get_sysinfo,
+                interval=interval)
+
+    def remove(self, key):
+        with self._cond:
+            target = self.targets.pop(key, None)
+            if target is not None:
+                target.removed = True
+
+    def next_interval(self, target, changed):
+        """returns adapted interval for target, without jitter."""
+        factor = self.speedup if changed else self.slowdown
+        return min(self.max_interval,
+                   max(self.min_interval, target.interval * factor))
+
+    def _push(self, target, due):
+        target.due = due
+        heapq.heappush(self._heap, (due, next(self._seq), target))
+        self._cond.notify()
+
+    def start(self):
+        self._stop.clear()
+        self._threads = [threading.Thread(target=self._dispatch)]
+        for i in range(self.concurrency):
+            self._threads.append(threading.Thread(target=self._worker))
+        for t in self._threads:
+            t.daemon = True
+            t.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join()
+        self._threads = []
+
+    def _dispatch(self):
+        with self._cond:
+            while not self._stop.is_set():
+                if not self._heap:
+                    self._cond.wait(1.0)
+                    continue
+                (due, seq, target) = self._heap[0]
+                wait = due - self.clock()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                heapq.heappop(self._heap)
+                if target.removed:
+                    continue
+                if self._inflight.get(target.device, 0) >= self.per_device:
+                    self._parked.setdefault(
+                            target.device, deque()).append(target)
+                    continue
+                self._inflight[target.device] = \
+                    self._inflight.get(target.device, 0) + 1
+                self._work.put(target)
+
+    def _worker(self):
+        while not self._stop.is_set():
+            try:
+                target = self._work.get(True, 0.1)
+            except Empty:
+                continue
+            self._poll(target)
+
+    def _poll(self, target):
+        changed = False
+        try:
+            values = target.fetch()
+        except Exception as e:
+            target.errors += 1
+            logger.warning('failed to poll(%s) - %s' % (target.key, e))
+            if self.on_error is not None:
+                self.on_error(target, e)
+        else:
+            previous = target.values
+            changed = previous is not None and values != previous
+            target.values = values
+            target.polls += 1
+            if changed:
+                target.changes += 1
+            if self.callback is not None:
+                try:
+                    self.callback(target, values, previous)
+                except Exception as e:
+                    logger.error('poll callback for(%s) failed - %s' % (
+                        target.key, e))
+
+        target.interval = self.next_interval(target, changed)
+        spread = target.interval * self.jitter
+        now = self.clock()
+        with self._cond:
+            self._inflight[target.device] -= 1
+            parked = self._parked.get(target.device)
+            if parked:
+                self._push(parked.popleft(), now)
+            if not target.removed:
+                self._push(
+                        target,
+                        now + target.interval + random.uniform(
+                            -spread, spread))
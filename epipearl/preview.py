@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""grab channel preview frames from many devices at a fixed rate.
+
+frames are read into a fixed pool of preallocated buffers and handed out as
+memoryviews, so a wall of hundreds of channels reuses the same memory
+instead of allocating a new string per frame.
+"""
+
+import heapq
+import logging
+import threading
+import time
+
+from Queue import Empty
+from Queue import Queue
+
+from errors import TransferError
+from metrics import operation
+
+logger = logging.getLogger(__name__)
+
+_default_frame_size = 256 * 1024
+_read_chunk_size = 64 * 1024
+
+preview_path = 'preview.cgi'
+
+
+class BufferPool(object):
+    """fixed set of preallocated bytearrays, reused across frames.
+
+    acquire() blocks when all buffers are in use, which throttles grabbing
+    to the pace frames are released by consumers.
+    """
+
+    def __init__(self, count, size=_default_frame_size):
+        self._free = Queue()
+        for i in range(count):
+            self._free.put(bytearray(size))
+
+    def acquire(self, timeout=None):
+        return self._free.get(True, timeout)
+
+    def release(self, buf):
+        self._free.put(buf)
+
+
+class Frame(object):
+    """one preview frame held in a pooled buffer.
+
+    `data` is a memoryview of the frame bytes; it is only valid until
+    release(). copy it, e.g. data.tobytes(), to keep it longer.
+    """
+
+    __slots__ = ('client', 'channel', 'timestamp', 'content_type',
+                 'size', '_buf', '_pool')
+
+    def __init__(self, client, channel, buf, size, content_type, pool=None):
+        self.client = client
+        self.channel = channel
+        self.timestamp = time.time()
+        self.content_type = content_type
+        self.size = size
+        self._buf = buf
+        self._pool = pool
+
+    @property
+    def data(self):
+        return memoryview(self._buf)[:self.size]
+
+    def release(self):
+        if self._pool is not None and self._buf is not None:
+            self._pool.release(self._buf)
+        self._buf = None
+
+
+def read_into(raw, buf):
+    """reads raw response body into buf; returns number of bytes read.
+
+    uses raw.readinto when the http stack provides it.
+    """
+    view = memoryview(buf)
+    size = len(buf)
+    n = 0
+    readinto = getattr(raw, 'readinto', None)
+    while True:
+        if n == size:
+            if raw.read(1):
+                raise TransferError(
+                        'frame larger than buffer(%s bytes)' % size)
+            return n
+        if readinto is not None:
+            got = readinto(view[n:min(size, n + _read_chunk_size)])
+        else:
+            chunk = raw.read(min(size - n, _read_chunk_size))
+            got = len(chunk)
+            view[n:n + got] = chunk
+        if not got:
+            return n
+        n += got
+
+
+@operation('get_preview', client_arg=0)
+def grab_frame(client, channel, buf):
+    """fetches current preview of channel into buf.
+
+    returns (buf, size, content_type); buf is grown in place if the device
+    reports a frame bigger than buf, so a pooled buffer stays pooled.
+    """
+    r = client.get(
+            preview_path, params={'channel': channel},
+            extra_headers={'Accept-Encoding': 'identity'}, stream=True)
+    try:
+        length = r.headers.get('content-length')
+        if length is not None and int(length) > len(buf):
+            buf.extend(bytearray(int(length) - len(buf)))
+        size = read_into(r.raw, buf)
+    finally:
+        r.close()
+    return (buf, size, r.headers.get('content-type'))
+
+
+class PreviewGrabber(object):
+    """grabs previews of (client, channel) targets at a fixed rate.
+
+    targets: list of (epipearl client, channel id)
+    rate: frames per second per target
+    concurrency: number of grabbing threads
+    callback: optional callable(frame), called in a grabbing thread; the
+        frame is released when callback returns.
+
+    without callback, iterate over the grabber to get frames; a frame is
+    released when the next one is requested.
+
+    when grabbing falls behind, a target with a grab still waiting for a
+    thread is skipped rather than queued again.
+    """
+
+    def __init__(
+            self, targets, rate=1.0, concurrency=8, callback=None,
+            frame_size=_default_frame_size, pool_size=None):
+        self.targets = list(targets)
+        self.interval = 1.0 / rate
+        self.concurrency = concurrency
+        self.callback = callback
+        self.pool = BufferPool(
+                pool_size or concurrency * 2, size=frame_size)
+        self.frames = Queue()
+        self.errors = 0
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        due = Queue()
+        self._threads = [threading.Thread(target=self._schedule, args=(due,))]
+        for i in range(self.concurrency):
+            self._threads.append(
+                    threading.Thread(target=self._grab, args=(due,)))
+        for t in self._threads:
+            t.daemon = True
+            t.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        for t in self._threads:
+            t.join()
+        self._threads = []
+
+    def _schedule(self, due):
+        now = time.time()
+        # spread first grabs across one interval to avoid bursts
+        step = self.interval / max(1, len(self.targets))
+        heap = [(now + i * step, i) for i in range(len(self.targets))]
+        heapq.heapify(heap)
+        while heap and not self._stop.is_set():
+            (when, i) = heap[0]
+            wait = when - time.time()
+            if wait > 0:
+                self._stop.wait(wait)
+                continue
+            heapq.heapreplace(heap, (max(when + self.interval,
+                                         time.time()), i))
+            with self._lock:
+                if i in self._pending:
+                    continue
+                self._pending.add(i)
+            due.put(i)
+
+    def _grab(self, due):
+        while not self._stop.is_set():
+            try:
+                i = due.get(True, 0.1)
+            except Empty:
+                continue
+            with self._lock:
+                self._pending.discard(i)
+            (client, channel) = self.targets[i]
+            try:
+                buf = self.pool.acquire(timeout=1.0)
+            except Empty:
+                continue
+            try:
+                (buf, size, content_type) = grab_frame(client, channel, buf)
+            except Exception as e:
+                self.pool.release(buf)
+                with self._lock:
+                    self.errors += 1
+                logger.warning('failed to grab preview channel(%s) from '
+                               'device(%s) - %s' % (channel, client.url, e))
+                continue
+
+            frame = Frame(
+                    client, channel, buf, size, content_type, pool=self.pool)
+            if self.callback is None:
+                self.frames.put(frame)
+                continue
+            try:
+                self.callback(frame)
+            except Exception as e:
+                logger.error('preview callback failed - %s' % e)
+            finally:
+                frame.release()
+
+    def __iter__(self):
+        if not self._threads:
+            self.start()
+        frame = None
+        while not self._stop.is_set():
+            if frame is not None:
+                frame.release()
+            try:
+                frame = self.frames.get(True, 0.1)
+            except Empty:
+                frame = None
+                continue
+            yield frame
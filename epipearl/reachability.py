@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""negative cache of unreachable devices.
+
+in a fleet job, a dead device would cost a connect timeout on every call
+of a multi-step workflow. clients sharing a NegativeCache fail fast with
+DeviceUnreachableError for `window` seconds after a device fails to
+connect; errors after connecting, e.g. a reset mid-response, are not
+cached. a background thread probes failed devices in parallel, backing off
+between probes of each, and clears them as soon as they accept
+connections again:
+
+    unreachable = NegativeCache(window=60)
+    clients = fleet.clients_from_inventory(
+            devices, connect_timeout=1, negative_cache=unreachable)
+"""
+
+import logging
+import socket
+import threading
+import time
+
+from urlparse import urlparse
+
+import requests
+
+from urllib3.exceptions import NewConnectionError
+
+from errors import DeviceUnreachableError
+
+logger = logging.getLogger(__name__)
+
+_default_window = 30.0
+_default_reprobe_interval = 5.0
+_default_probe_timeout = 1.0
+_default_max_reprobe_interval = 60.0
+_default_probe_concurrency = 16
+
+
+def connect_failed(error):
+    """true if a requests error means the connection was never made."""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    if not isinstance(error, requests.ConnectionError) or not error.args:
+        return False
+    # requests wraps urllib3 errors in a MaxRetryError with a reason
+    reason = getattr(error.args[0], 'reason', error.args[0])
+    return isinstance(reason, NewConnectionError)
+
+
+def probe_connect(url, timeout=_default_probe_timeout):
+    """true if device at url accepts a tcp connection."""
+    parsed = urlparse(url)
+    port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+    try:
+        socket.create_connection((parsed.hostname, port), timeout).close()
+        return True
+    except (socket.error, socket.timeout):
+        return False
+
+
+class NegativeCache(object):
+    """devices that recently failed to connect, by url.
+
+    window: seconds calls to a failed device fail fast; after it, the next
+        call goes through and tries to connect again
+    reprobe_interval: seconds before the first background probe of a failed
+        device; doubles after each failed probe, up to max_reprobe_interval.
+        a device that answers a probe is cleared, and devices are no longer
+        probed once their window is over. None to not probe
+    probe: callable(url) true if device accepts connections; defaults to a
+        tcp connect of probe_timeout seconds
+    probe_concurrency: max devices probed at once
+    """
+
+    def __init__(self, window=_default_window,
+                 reprobe_interval=_default_reprobe_interval, probe=None,
+                 probe_timeout=_default_probe_timeout,
+                 max_reprobe_interval=_default_max_reprobe_interval,
+                 probe_concurrency=_default_probe_concurrency):
+        self.window = window
+        self.reprobe_interval = reprobe_interval
+        self.max_reprobe_interval = max_reprobe_interval
+        self.probe_concurrency = probe_concurrency
+        self.probe = probe or (lambda url: probe_connect(url, probe_timeout))
+        self._failed = {}
+        self._lock = threading.Lock()
+        self._prober = None
+
+    def check(self, url):
+        """raises DeviceUnreachableError if url failed within window."""
+        with self._lock:
+            entry = self._failed.get(url)
+        if entry is None:
+            return
+        left = entry['until'] - time.time()
+        if left <= 0:
+            return
+        raise DeviceUnreachableError(
+                'device(%s) unreachable for %.1fs, failing fast for %.1fs '
+                'more - %s' % (url, time.time() - entry['since'], left,
+                               entry['error']))
+
+    def failed(self, url, error):
+        """records that url failed to connect."""
+        now = time.time()
+        with self._lock:
+            entry = self._failed.get(url)
+            self._failed[url] = {
+                    'since': entry['since'] if entry else now,
+                    'until': now + self.window,
+                    'error': '%s: %s' % (error.__class__.__name__, error),
+                    'probes': entry['probes'] if entry else 0,
+                    'next_probe': entry['next_probe'] if entry else now}
+            if entry is None:
+                logger.warning('device(%s) unreachable - %s' % (url, error))
+            if self._prober is None and self.reprobe_interval is not None:
+                self._prober = threading.Thread(target=self._reprobe)
+                self._prober.daemon = True
+                self._prober.start()
+
+    def succeeded(self, url):
+        """clears url, e.g. after a call got through."""
+        if url not in self._failed:
+            return
+        with self._lock:
+            if self._failed.pop(url, None) is not None:
+                logger.info('device(%s) reachable again' % url)
+
+    def unreachable(self):
+        """urls that fail fast now."""
+        now = time.time()
+        with self._lock:
+            return sorted(url for (url, entry) in self._failed.items()
+                          if entry['until'] > now)
+
+    def _reprobe(self):
+        while True:
+            time.sleep(self.reprobe_interval)
+            now = time.time()
+            with self._lock:
+                for (url, entry) in list(self._failed.items()):
+                    if entry['until'] <= now:
+                        # next call tries the device itself
+                        del self._failed[url]
+                if not self._failed:
+                    self._prober = None
+                    return
+                due = [url for (url, entry) in self._failed.items()
+                       if entry['next_probe'] <= now]
+            for i in range(0, len(due), self.probe_concurrency):
+                probes = [threading.Thread(target=self._probe_one, args=(url,))
+                          for url in due[i:i + self.probe_concurrency]]
+                for t in probes:
+                    t.daemon = True
+                    t.start()
+                for t in probes:
+                    t.join()
+
+    def _probe_one(self, url):
+        try:
+            up = self.probe(url)
+        except Exception as e:
+            logger.debug('probe of device(%s) failed - %s' % (url, e))
+            up = False
+        if up:
+            self.succeeded(url)
+            return
+        with self._lock:
+            entry = self._failed.get(url)
+            if entry is not None:
+                entry['probes'] += 1
+                entry['next_probe'] = time.time() + min(
+                        self.max_reprobe_interval,
+                        self.reprobe_interval * 2 ** entry['probes'])
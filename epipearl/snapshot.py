@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""full configuration snapshots of devices, and diffs between them.
+
+a snapshot holds every setting the client can read from a device:
+
+    {"version": 1, "device": url, "taken": epoch seconds,
+     "firmware_version": "4.1.2",
+     "channels": {id: {"name", "params", "streamsetup", "layout"}},
+     "recorders": {id: {"name", "params", "archive"}},
+     "forms": {"timesynccfg": {..}, "touchscreencfg": {..}, "mhcfg": {..}},
+     "errors": {"forms/mhcfg": "HTTPError: .."}}
+
+params are all get_params values; layout is the parsed json of channel
+layout 1; streamsetup, archive and forms are the field values of those
+web ui forms. a part that fails to read is left out and its error kept in
+"errors", e.g. mhcfg on stock firmware.
+
+password fields, e.g. rtmp_password and ADMIN_SERVER_PASSWD, read as
+"<redacted>", since snapshots are saved, printed and cached; pass
+secrets=True to take_snapshot to keep them.
+
+snapshots save as json with sorted keys and no whitespace, so equal
+configurations give equal files; gzipped when the path ends in '.gz'.
+
+    python -m epipearl.snapshot a.json.gz b.json.gz --by-name
+"""
+
+import argparse
+import gzip
+import json
+import logging
+import sys
+import time
+
+from collections import Counter
+
+from endpoints.webui_config import WebUiConfig
+from fleet import map_concurrently
+
+logger = logging.getLogger(__name__)
+
+snapshot_version = 1
+
+_default_concurrency = 16
+
+config_forms = ('timesynccfg', 'touchscreencfg', 'mhcfg')
+
+# form fields showing device state rather than settings, e.g. the clock
+_state_fields = {'timesynccfg': ('date', 'time')}
+
+# value of password fields in snapshots taken without secrets
+redacted = '<redacted>'
+
+# keys that differ between any two snapshots
+_volatile = ('device', 'taken', 'errors')
+
+
+def _read(snap, part, func, *args):
+    try:
+        return func(*args)
+    except Exception as e:
+        logger.warning('snapshot of device(%s) failed to read %s - %s' % (
+            snap['device'], part, e))
+        snap['errors'][part] = '%s: %s' % (e.__class__.__name__, e)
+        return None
+
+
+def _store(snap, keys, value):
+    """sets snap[k0][k1]..= value, unless value is None (read failed)."""
+    if value is None:
+        return
+    d = snap
+    for k in keys[:-1]:
+        d = d[k]
+    d[keys[-1]] = value
+
+
+def _layout(client, channel_id):
+    text = client.get_channel_layout(channel_id)
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def take_snapshot(client, secrets=False):
+    """reads all settings of client device; returns snapshot dict.
+
+    secrets: keep the values of password fields, rather than redacted
+    """
+    redact = None if secrets else redacted
+    snap = {
+            'version': snapshot_version,
+            'device': client.url,
+            'taken': time.time(),
+            'channels': {},
+            'recorders': {},
+            'forms': {},
+            'errors': {}}
+    infocfg = client.get_infocfg()    # without it, there is nothing to do
+    sysinfo = _read(snap, 'sysinfo', client.get_sysinfo)
+    if sysinfo is not None:
+        snap['firmware_version'] = sysinfo.get('system', {}).get(
+                'firmware', {}).get('version')
+
+    for c in infocfg.get('channels', []):
+        cid = c['id']
+        snap['channels'][cid] = {'name': c['name'].strip()}
+        _store(snap, ('channels', cid, 'params'), _read(
+            snap, 'channels/%s/params' % cid, client.get_params, cid))
+        _store(snap, ('channels', cid, 'streamsetup'), _read(
+            snap, 'channels/%s/streamsetup' % cid, WebUiConfig.get_form,
+            client, 'admin/channel%s/streamsetup' % cid, redact))
+        _store(snap, ('channels', cid, 'layout'), _read(
+            snap, 'channels/%s/layout' % cid, _layout, client, cid))
+
+    for r in infocfg.get('recorders', []):
+        rid = r['id']
+        snap['recorders'][rid] = {'name': r['name'].strip()}
+        _store(snap, ('recorders', rid, 'params'), _read(
+            snap, 'recorders/%s/params' % rid, client.get_params, 'm' + rid))
+        _store(snap, ('recorders', rid, 'archive'), _read(
+            snap, 'recorders/%s/archive' % rid, WebUiConfig.get_form,
+            client, 'admin/recorder%s/archive' % rid, redact))
+
+    for form in config_forms:
+        if not client.supports(form):
+            snap['errors']['forms/%s' % form] = \
+                'UnsupportedOperationError: not in device firmware'
+            continue
+        values = _read(snap, 'forms/%s' % form, WebUiConfig.get_form,
+                       client, 'admin/%s' % form, redact)
+        for field in _state_fields.get(form, ()):
+            (values or {}).pop(field, None)
+        _store(snap, ('forms', form), values)
+    return snap
+
+
+def snapshot_fleet(clients, concurrency=_default_concurrency, secrets=False):
+    """snapshots of many devices, read concurrently.
+
+    returns (snapshots, errors): dicts by device url; errors holds devices
+    that could not be read at all.
+    """
+    snapshots = {}
+    errors = {}
+    for (client, snap, error) in map_concurrently(
+            lambda client: take_snapshot(client, secrets=secrets), clients,
+            concurrency=concurrency):
+        if error is None:
+            snapshots[client.url] = snap
+        else:
+            errors[client.url] = '%s: %s' % (error.__class__.__name__, error)
+    return (snapshots, errors)
+
+
+def _open(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+def dumps(snapshots):
+    """compact json with sorted keys, stable across runs."""
+    return json.dumps(snapshots, sort_keys=True, separators=(',', ':'))
+
+
+def save(path, snapshots):
+    """writes snapshots, a snapshot or a dict of them by device url."""
+    with _open(path, 'wb') as f:
+        f.write(dumps(snapshots))
+
+
+def load(path):
+    with _open(path, 'rb') as f:
+        return json.loads(f.read())
+
+
+def _flatten(value, prefix, out):
+    if isinstance(value, dict) and value:
+        for (k, v) in value.items():
+            _flatten(v, prefix + (k,), out)
+    else:
+        out[prefix] = value
+    return out
+
+
+def _name_keys(items):
+    """{id: name} of channels or recorders; names shared by several ids
+    become 'name#id', so none is lost."""
+    counts = Counter(item['name'] for item in items.values())
+    return dict(
+            (i, item['name'] if counts[item['name']] == 1 else
+             '%s#%s' % (item['name'], i)) for (i, item) in items.items())
+
+
+def by_name(snap):
+    """snapshot with channels and recorders keyed by name instead of id,
+    to compare devices where the same channel got different ids.
+
+    recorder channel lists ('rc[]') are translated to names too. duplicate
+    names are keyed 'name#id'.
+    """
+    names = _name_keys(snap['channels'])
+    renamed = dict(snap)
+    renamed['channels'] = dict(
+            (names[cid], c) for (cid, c) in snap['channels'].items())
+    renamed['recorders'] = {}
+    recorder_names = _name_keys(snap['recorders'])
+    for (rid, r) in snap['recorders'].items():
+        r = dict(r)
+        if 'rc[]' in r.get('archive', {}):
+            r['archive'] = dict(r['archive'])
+            r['archive']['rc[]'] = sorted(
+                    names.get(c, c) for c in r['archive']['rc[]'])
+        renamed['recorders'][recorder_names[rid]] = r
+    return renamed
+
+
+def diff(a, b, ignore=_volatile, names=False):
+    """structural diff of two snapshots.
+
+    ignore: top level keys not compared
+    names: compare channels and recorders by name rather than by id
+
+    returns list, sorted by path, of dicts
+        {'path': 'channels/1/params/publish_type', 'a': .., 'b': ..}
+    where a or b is missing if the setting is only in the other snapshot.
+    """
+    if names:
+        (a, b) = (by_name(a), by_name(b))
+    fa = {}
+    fb = {}
+    for (k, v) in a.items():
+        if k not in ignore:
+            _flatten(v, (k,), fa)
+    for (k, v) in b.items():
+        if k not in ignore:
+            _flatten(v, (k,), fb)
+
+    changes = []
+    for path in set(fa) | set(fb):
+        in_a = path in fa
+        in_b = path in fb
+        if in_a and in_b and fa[path] == fb[path]:
+            continue
+        change = {'path': '/'.join(path)}
+        if in_a:
+            change['a'] = fa[path]
+        if in_b:
+            change['b'] = fb[path]
+        changes.append(change)
+    changes.sort(key=lambda c: c['path'])
+    return changes
+
+
+def pick(snapshots, device):
+    """snapshot from a file of one snapshot or of many by url."""
+    if 'version' in snapshots and 'channels' in snapshots:
+        return snapshots
+    if device is None:
+        if len(snapshots) != 1:
+            raise ValueError('file has %s devices, pick one with '
+                             '--device-a/b' % len(snapshots))
+        return snapshots.values()[0]
+    return snapshots[device]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+            description='diff two device configuration snapshots')
+    parser.add_argument('a', help='snapshot file')
+    parser.add_argument('b', nargs='?',
+                        help='snapshot file; defaults to a, to compare two '
+                        'devices in it')
+    parser.add_argument('--device-a', help='device url in a')
+    parser.add_argument('--device-b', help='device url in b')
+    parser.add_argument('--by-name', action='store_true',
+                        help='match channels and recorders by name')
+    args = parser.parse_args(argv)
+
+    a = pick(load(args.a), args.device_a)
+    b = pick(load(args.b or args.a), args.device_b)
+    changes = diff(a, b, names=args.by_name)
+    for change in changes:
+        sys.stdout.write(json.dumps(change, sort_keys=True) + '\n')
+    return 1 if changes else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""last-known device state kept on disk, for warm starts.
+
+a sqlite file holds one json value per device and key, e.g. 'snapshot'
+or the gateway inventory, status and params reads, with the time it was
+read. a new process starts from these values right away and revalidates
+them against the devices in the background:
+
+    cache = StateCache('/var/cache/epipearl/state.db')
+    (snapshots, refresh) = warm_snapshots(cache, clients, max_age=86400)
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from fleet import map_concurrently
+from snapshot import take_snapshot
+
+logger = logging.getLogger(__name__)
+
+_default_refresh_after = 300.0
+_default_concurrency = 16
+
+_schema = (
+        'CREATE TABLE IF NOT EXISTS state ('
+        'device TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, '
+        'updated REAL NOT NULL, PRIMARY KEY (device, key))')
+
+
+class StateCache(object):
+    """device state values by (device, key) in a sqlite file.
+
+    max_age: seconds after which values are ignored, unless get() is
+        given its own; None to keep them forever
+    """
+
+    def __init__(self, path, max_age=None):
+        self.path = path
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._db.execute(_schema)
+            self._db.commit()
+
+    def get(self, device, key, max_age=None):
+        """returns (value, updated) or None if missing or too old."""
+        with self._lock:
+            row = self._db.execute(
+                    'SELECT value, updated FROM state '
+                    'WHERE device = ? AND key = ?', (device, key)).fetchone()
+        if row is None:
+            return None
+        max_age = self.max_age if max_age is None else max_age
+        if max_age is not None and time.time() - row[1] > max_age:
+            return None
+        return (json.loads(row[0]), row[1])
+
+    def put(self, device, key, value, updated=None):
+        """stores value read from device at updated, default now."""
+        updated = time.time() if updated is None else updated
+        with self._lock:
+            self._db.execute(
+                    'INSERT OR REPLACE INTO state VALUES (?, ?, ?, ?)',
+                    (device, key, json.dumps(value, sort_keys=True),
+                     updated))
+            self._db.commit()
+
+    def keys(self, device=None):
+        """list of (device, key) stored, for one or all devices."""
+        with self._lock:
+            if device is None:
+                rows = self._db.execute('SELECT device, key FROM state')
+            else:
+                rows = self._db.execute(
+                        'SELECT device, key FROM state WHERE device = ?',
+                        (device,))
+            return [tuple(r) for r in rows.fetchall()]
+
+    def delete(self, device, key=None):
+        """drops key of device, or all of its keys."""
+        with self._lock:
+            if key is None:
+                self._db.execute(
+                        'DELETE FROM state WHERE device = ?', (device,))
+            else:
+                self._db.execute(
+                        'DELETE FROM state WHERE device = ? AND key = ?',
+                        (device, key))
+            self._db.commit()
+
+    def purge(self, older_than):
+        """drops values not updated in older_than seconds."""
+        with self._lock:
+            self._db.execute('DELETE FROM state WHERE updated < ?',
+                             (time.time() - older_than,))
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def warm_snapshots(
+        cache, clients, max_age=None, refresh_after=_default_refresh_after,
+        concurrency=_default_concurrency, on_refresh=None):
+    """device snapshots from cache now, revalidated in the background.
+
+    max_age: snapshots older than this are not returned
+    refresh_after: snapshots older than this, or missing, are read again
+        from their device and stored in cache
+    on_refresh: optional callable(client, snapshot, error) called as each
+        device is read again
+
+    returns (snapshots, thread): snapshots is a dict by device url of the
+    ones in cache; thread runs the refresh, None if nothing is stale. join
+    it to wait for fresh state.
+    """
+    snapshots = {}
+    stale = []
+    now = time.time()
+    for client in clients:
+        entry = cache.get(client.url, 'snapshot', max_age=max_age)
+        if entry is not None:
+            snapshots[client.url] = entry[0]
+        if entry is None or now - entry[1] > refresh_after:
+            stale.append(client)
+    if not stale:
+        return (snapshots, None)
+
+    def refresh():
+        for (client, snap, error) in map_concurrently(
+                take_snapshot, stale, concurrency=concurrency):
+            if error is None:
+                cache.put(client.url, 'snapshot', snap, updated=snap['taken'])
+            else:
+                logger.warning('failed to refresh state of device(%s) - %s'
+                               % (client.url, error))
+            if on_refresh is not None:
+                on_refresh(client, snap, error)
+
+    t = threading.Thread(target=refresh)
+    t.daemon = True
+    t.start()
+    return (snapshots, t)
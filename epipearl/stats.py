@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+"""small statistics helpers shared by client and tooling modules."""
+
+import math
+
+
+def percentile(values, p):
+    """nearest-rank p-th percentile (0-100) of values, or None if empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = int(math.ceil(p / 100.0 * len(ordered)))
+    return ordered[min(len(ordered), max(rank, 1)) - 1]
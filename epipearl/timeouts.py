@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""read timeouts per device and endpoint, learned from observed latency.
+
+one client timeout is too short for big pages like the time sync form or
+a long recorder archive, and far too long for get_params. clients sharing
+an AdaptiveTimeouts record the latency of each request by device and
+endpoint, and wait for the next response
+
+    clamp(percentile(recent latencies) * multiplier, floor, ceiling)
+
+once an endpoint has min_samples latencies; until then, the client
+timeout. a request that times out counts as a latency of its timeout, so
+a timeout that is too short grows back, up to ceiling.
+
+endpoints are method and url path with numbers replaced by '*', e.g.
+'GET /admin/channel*/get_params.cgi', so channels share their samples.
+"""
+
+import re
+import threading
+
+from collections import deque
+from urlparse import urlparse
+
+from stats import percentile
+
+_default_percentile = 99
+_default_multiplier = 3.0
+_default_floor = 1.0
+_default_ceiling = 30.0
+_default_min_samples = 20
+_default_window = 200
+
+_number = re.compile(r'\d+')
+
+
+def endpoint(method, url):
+    """endpoint name of request, e.g. 'GET /admin/channel*/get_params.cgi'."""
+    return '%s %s' % (method, _number.sub('*', urlparse(url).path))
+
+
+class AdaptiveTimeouts(object):
+    """read timeouts learned per (device, endpoint).
+
+    percentile: of the last `window` latencies of an endpoint
+    multiplier: headroom over that percentile
+    floor, ceiling: bounds of learned timeouts, in seconds
+    min_samples: latencies needed before the learned timeout is used
+    """
+
+    def __init__(self, percentile=_default_percentile,
+                 multiplier=_default_multiplier, floor=_default_floor,
+                 ceiling=_default_ceiling, min_samples=_default_min_samples,
+                 window=_default_window):
+        self.percentile = percentile
+        self.multiplier = multiplier
+        self.floor = floor
+        self.ceiling = ceiling
+        self.min_samples = min_samples
+        self.window = window
+        self._samples = {}
+        self._learned = {}  # timeouts computed since last sample
+        self._lock = threading.Lock()
+
+    def observe(self, device, method, url, seconds):
+        """records latency of a request to device."""
+        key = (device, endpoint(method, url))
+        with self._lock:
+            samples = self._samples.get(key)
+            if samples is None:
+                samples = self._samples[key] = deque(maxlen=self.window)
+            samples.append(seconds)
+            self._learned.pop(key, None)
+
+    def timeout(self, device, method, url, default):
+        """read timeout for a request; default until enough samples."""
+        key = (device, endpoint(method, url))
+        with self._lock:
+            learned = self._learned.get(key)
+            if learned is not None:
+                return learned
+            samples = self._samples.get(key)
+            if samples is None or len(samples) < self.min_samples:
+                return default
+            learned = self._learned[key] = self._compute(samples)
+            return learned
+
+    def _compute(self, samples):
+        value = percentile(list(samples), self.percentile) * self.multiplier
+        return min(self.ceiling, max(self.floor, value))
+
+    def snapshot(self):
+        """list of dicts {'device', 'endpoint', 'samples', 'timeout'},
+        where timeout is None while there are too few samples."""
+        with self._lock:
+            return [{
+                'device': device,
+                'endpoint': name,
+                'samples': len(samples),
+                'timeout': self._compute(samples)
+                if len(samples) >= self.min_samples else None}
+                for ((device, name), samples) in sorted(
+                    self._samples.items())]
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""compact in-memory time series for polled channel metrics.
+
+each series is a fixed-size ring of (timestamp, value) doubles kept in
+stdlib arrays, so memory per series is fixed at 16 bytes per sample no
+matter how long polling runs; the oldest samples are overwritten.
+
+series of one metric are rows of preallocated SeriesBlocks, so all
+channels of a metric can be read at once, e.g. as numpy matrices.
+"""
+
+import threading
+import time
+
+from array import array
+
+_default_capacity = 720     # e.g. 1h of 5s samples
+_min_block_rows = 16
+_max_block_rows = 1024
+
+# metrics taken from sysinfo channels[]; paths are keys into each channel
+sysinfo_metrics = {
+        'video_bitrate': ('codecs', 'video', 'bitrate'),
+        'fps': ('codecs', 'video', 'fps'),
+        'audio_bitrate': ('codecs', 'audio', 'bitrate'),
+        'recorder_time': ('recorder', 'time'),
+        'recorder_enabled': ('recorder', 'enabled'),
+        }
+
+
+class SeriesBlock(object):
+    """ring buffers of up to `rows` series side by side.
+
+    row r keeps its samples in times and values at [r * capacity,
+    (r + 1) * capacity), its oldest sample at starts[r] and its number of
+    samples in counts[r]. arrays are allocated once and never resized, so
+    buffers taken on them stay valid.
+    """
+
+    __slots__ = ('capacity', 'rows', 'used', 'keys', 'times', 'values',
+                 'starts', 'counts')
+
+    def __init__(self, capacity, rows):
+        self.capacity = capacity
+        self.rows = rows
+        self.used = 0
+        self.keys = []
+        self.times = array('d', [0.0]) * (rows * capacity)
+        self.values = array('d', [0.0]) * (rows * capacity)
+        self.starts = array('l', [0]) * rows
+        self.counts = array('l', [0]) * rows
+
+    def add(self, key):
+        """returns a RingSeries on the next free row, or None if full."""
+        if self.used == self.rows:
+            return None
+        self.keys.append(key)
+        self.used += 1
+        return RingSeries(self.capacity, block=self, row=self.used - 1)
+
+
+class RingSeries(object):
+    """fixed capacity series; samples must be appended in time order.
+
+    block: SeriesBlock to keep samples in, at row; a block of its own if
+        not given.
+    """
+
+    __slots__ = ('capacity', 'block', 'row', 'base', 'times', 'values')
+
+    def __init__(self, capacity=_default_capacity, block=None, row=0):
+        if block is None:
+            block = SeriesBlock(capacity, 1)
+            block.used = 1
+        self.capacity = capacity
+        self.block = block
+        self.row = row
+        self.base = row * capacity
+        self.times = block.times
+        self.values = block.values
+
+    @property
+    def start(self):
+        return self.block.starts[self.row]
+
+    @property
+    def count(self):
+        return self.block.counts[self.row]
+
+    def __len__(self):
+        return self.block.counts[self.row]
+
+    def append(self, timestamp, value):
+        """adds a sample; returns False if older than the last sample."""
+        block = self.block
+        count = block.counts[self.row]
+        if count and timestamp < self.times[self._physical(count - 1)]:
+            return False
+        if count < self.capacity:
+            i = self._physical(count)
+            block.counts[self.row] = count + 1
+        else:
+            start = block.starts[self.row]
+            i = self.base + start
+            block.starts[self.row] = (start + 1) % self.capacity
+        self.times[i] = timestamp
+        self.values[i] = value
+        return True
+
+    def _physical(self, i):
+        """index in times and values of logical sample i."""
+        return self.base + (self.block.starts[self.row] + i) % self.capacity
+
+    def _bisect(self, timestamp):
+        """first logical index with time >= timestamp."""
+        (lo, hi) = (0, len(self))
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.times[self._physical(mid)] < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def last(self):
+        """returns (timestamp, value) of newest sample, or None."""
+        count = len(self)
+        if not count:
+            return None
+        i = self._physical(count - 1)
+        return (self.times[i], self.values[i])
+
+    def query(self, start=None, end=None):
+        """returns [(timestamp, value)] with start <= timestamp < end."""
+        lo = 0 if start is None else self._bisect(start)
+        hi = len(self) if end is None else self._bisect(end)
+        result = []
+        for j in range(lo, hi):
+            i = self._physical(j)
+            result.append((self.times[i], self.values[i]))
+        return result
+
+    @property
+    def nbytes(self):
+        return (self.times.itemsize + self.values.itemsize) * self.capacity
+
+
+def downsample(samples, step, how='mean', origin=None):
+    """buckets [(timestamp, value)] into step seconds wide buckets.
+
+    how: 'mean', 'min', 'max' or 'last'
+    returns [(bucket_start, value)] for buckets with samples.
+    """
+    if not samples:
+        return []
+    if origin is None:
+        origin = samples[0][0] - (samples[0][0] % step)
+    result = []
+    bucket = None
+    acc = []
+    for (ts, value) in samples:
+        b = origin + ((ts - origin) // step) * step
+        if b != bucket and acc:
+            result.append((bucket, _aggregate(acc, how)))
+            acc = []
+        bucket = b
+        acc.append(value)
+    result.append((bucket, _aggregate(acc, how)))
+    return result
+
+
+def _aggregate(values, how):
+    if how == 'mean':
+        return sum(values) / float(len(values))
+    if how == 'min':
+        return min(values)
+    if how == 'max':
+        return max(values)
+    if how == 'last':
+        return values[-1]
+    raise ValueError('unknown aggregation(%s)' % how)
+
+
+class TimeSeriesStore(object):
+    """ring series indexed by (device, channel, metric).
+
+    series of a metric are rows of SeriesBlocks; each new block has twice
+    the rows of the previous one, up to _max_block_rows.
+    """
+
+    def __init__(self, capacity=_default_capacity):
+        self.capacity = capacity
+        self._series = {}
+        self._blocks = {}
+        self._lock = threading.Lock()
+
+    def series(self, device, channel, metric, create=False):
+        key = (device, channel, metric)
+        s = self._series.get(key)
+        if s is None and create:
+            with self._lock:
+                s = self._series.get(key)
+                if s is None:
+                    s = self._series[key] = self._new_series(
+                            metric, (device, channel))
+        return s
+
+    def _new_series(self, metric, key):
+        blocks = self._blocks.setdefault(metric, [])
+        s = blocks[-1].add(key) if blocks else None
+        if s is None:
+            rows = min(_max_block_rows, max(
+                _min_block_rows, 2 * blocks[-1].rows if blocks else 0))
+            blocks.append(SeriesBlock(self.capacity, rows))
+            s = blocks[-1].add(key)
+        return s
+
+    def keys(self):
+        return list(self._series.keys())
+
+    def blocks(self, metric):
+        """list of (keys, block) holding the series of metric, where keys
+        are the (device, channel) of the rows in use."""
+        with self._lock:
+            return [(list(b.keys), b) for b in self._blocks.get(metric, [])]
+
+    def record(self, device, channel, metric, value, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        return self.series(device, channel, metric, create=True).append(
+                timestamp, float(value))
+
+    def record_sysinfo(self, device, sysinfo, timestamp=None):
+        """records channel metrics from a sysinfo dict.
+
+        uses sysinfo 'time' as timestamp, if not given; metrics missing in
+        a channel, e.g. codecs of recorders, are skipped.
+        """
+        if timestamp is None:
+            timestamp = sysinfo.get('time') or time.time()
+        for c in sysinfo.get('channels', []):
+            for (metric, path) in sysinfo_metrics.items():
+                value = c
+                for k in path:
+                    value = value.get(k) if isinstance(value, dict) else None
+                if value is None or value == '':
+                    continue
+                try:
+                    value = float(value)
+                except (TypeError, ValueError):
+                    continue
+                self.record(device, c['id'], metric, value, timestamp)
+
+    def query(self, device, channel, metric, start=None, end=None,
+              step=None, how='mean'):
+        """returns [(timestamp, value)] in [start, end), downsampled to
+        step seconds buckets if step is given."""
+        s = self.series(device, channel, metric)
+        if s is None:
+            return []
+        samples = s.query(start, end)
+        if step:
+            return downsample(samples, step, how=how, origin=start)
+        return samples
+
+    @property
+    def nbytes(self):
+        return sum(s.nbytes for s in self._series.values())
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""phase timing of client operations, and opt-in profiling.
+
+a client created with a Timing instance records, for each operation, where
+its time went:
+
+    connect     dns lookup, tcp connect and tls handshake of new connections
+    ttfb        request sent until response headers, less connect
+    download    response headers until body read
+    parse       html and text parsing of device pages
+    verify      checks of settings in the page returned by a form post
+
+time not in any phase (e.g. building forms) is reported as 'other'. each
+record goes to the Timing hook and is kept in Timing.records.
+
+connect is reported only by transports that time their connections, the
+default requests and urllib3 transports do; elsewhere it is part of ttfb.
+"""
+
+import itertools
+import os
+import re
+import threading
+import time
+
+from collections import deque
+from urlparse import urlparse
+
+phases = ('connect', 'ttfb', 'download', 'parse', 'verify')
+
+# operations that parse device pages, profiled by default
+_parse_heavy = (
+        'get_infocfg', 'get_recorder_files', 'set_ntp', 'set_touchscreen',
+        'set_channel_rtmp', 'set_recorder_channels', 'set_recorder_settings',
+        'set_source_deinterlacing', 'set_mhpearl_settings')
+
+_local = threading.local()
+
+
+def current():
+    """OperationTiming being recorded in this thread, or None."""
+    return getattr(_local, 'record', None)
+
+
+def add_phase(phase, seconds):
+    """adds seconds to phase of the operation timed in this thread."""
+    record = getattr(_local, 'record', None)
+    if record is not None:
+        record.phases[phase] += seconds
+
+
+class OperationTiming(object):
+    """phase breakdown, in seconds, of one client operation."""
+
+    __slots__ = ('device', 'operation', 'start', 'total', 'requests',
+                 'phases', 'error', 'profile')
+
+    def __init__(self, device, operation):
+        self.device = device
+        self.operation = operation
+        self.start = time.time()
+        self.total = 0.0
+        self.requests = 0
+        self.phases = dict((p, 0.0) for p in phases)
+        self.error = None
+        self.profile = None
+
+    def add_request(self, seconds, connect, resp):
+        """splits a request into ttfb and download.
+
+        seconds: wall time of the request, redirects included
+        connect: connect time reported while it was sent
+        resp: response, or None if the request failed
+        """
+        self.requests += 1
+        if resp is None:
+            self.phases['ttfb'] += max(seconds - connect, 0.0)
+            return
+        elapsed = sum(r.elapsed.total_seconds()
+                      for r in list(resp.history) + [resp])
+        self.phases['ttfb'] += max(elapsed - connect, 0.0)
+        self.phases['download'] += max(seconds - elapsed, 0.0)
+
+    @property
+    def other(self):
+        return max(self.total - sum(self.phases.values()), 0.0)
+
+    def as_dict(self):
+        d = {
+                'device': self.device,
+                'operation': self.operation,
+                'start': self.start,
+                'total': self.total,
+                'requests': self.requests,
+                'error': self.error,
+                'profile': self.profile,
+                'other': self.other}
+        d.update(self.phases)
+        return d
+
+
+def _safe(text):
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', text).strip('_')
+
+
+class Timing(object):
+    """records phase timings of operations of the clients that use it.
+
+    hook: optional callable(OperationTiming) called as each operation ends,
+        in the thread that ran it
+    keep: number of recent records kept in .records
+    profile_dir: if given, operations named in profile_ops run under
+        cProfile, and their stats are written to this dir as
+        <operation>-<device>-<millis>-<seq>.prof, for pstats or snakeviz
+    profile_ops: operations to profile; defaults to those parsing pages
+    """
+
+    def __init__(self, hook=None, keep=1000, profile_dir=None,
+                 profile_ops=_parse_heavy):
+        self.hook = hook
+        self.records = deque(maxlen=keep)
+        self.profile_dir = profile_dir
+        self.profile_ops = frozenset(profile_ops)
+        self._seq = itertools.count()
+        if profile_dir is not None and not os.path.isdir(profile_dir):
+            os.makedirs(profile_dir)
+
+    def run(self, name, device, func, args, kwargs):
+        """runs func(*args, **kwargs) as operation name, timing it."""
+        record = OperationTiming(device, name)
+        _local.record = record
+        profiler = None
+        if self.profile_dir is not None and name in self.profile_ops:
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            record.error = e.__class__.__name__
+            raise
+        finally:
+            record.total = time.time() - record.start
+            _local.record = None
+            if profiler is not None:
+                profiler.disable()
+                record.profile = self._dump(profiler, record)
+            self.records.append(record)
+            if self.hook is not None:
+                self.hook(record)
+
+    def _dump(self, profiler, record):
+        path = os.path.join(self.profile_dir, '%s-%s-%d-%d.prof' % (
+            record.operation, _safe(urlparse(record.device).netloc or
+                                    record.device),
+            int(record.start * 1000), next(self._seq)))
+        profiler.dump_stats(path)
+        return path
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""tracing spans around client operations and http requests.
+
+a client created with a tracer opens a span per operation (e.g.
+'create_channel'), with a child span per http request, so latency can be
+followed across multi-step workflows and fleet jobs:
+
+    create_channel
+        HTTP GET    /admin/add_channel.cgi
+        HTTP POST   /admin/ajax/rename_channel.cgi
+
+Tracer is a no-op; RecordingTracer keeps finished spans in memory. spans
+follow the opentelemetry api in shape (set_attribute, record_exception,
+end) and use its semantic convention names for http attributes, so an
+exporter for another tracing system subclasses Tracer and implements
+start_span(). clients without a tracer skip tracing altogether.
+"""
+
+import itertools
+import threading
+import time
+
+from collections import deque
+from contextlib import contextmanager
+
+_default_max_spans = 10000
+
+
+class Span(object):
+    """no-op span; base for the spans of other tracers."""
+
+    def set_attribute(self, key, value):
+        pass
+
+    def record_exception(self, exception):
+        pass
+
+    def end(self):
+        pass
+
+
+_noop_span = Span()
+
+
+class Tracer(object):
+    """no-op tracer; tracks the current span of each thread.
+
+    subclasses implement start_span(name, attributes, parent) returning a
+    Span; span() makes it the current span while the block runs.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def start_span(self, name, attributes=None, parent=None):
+        return _noop_span
+
+    def current_span(self):
+        """innermost open span in this thread, or None."""
+        stack = getattr(self._local, 'stack', None)
+        return stack[-1] if stack else None
+
+    @contextmanager
+    def span(self, name, attributes=None, parent=None):
+        """runs block in a new span, child of parent or of the current span.
+
+        pass parent explicitly to continue a trace in another thread.
+        """
+        if parent is None:
+            parent = self.current_span()
+        span = self.start_span(name, attributes, parent)
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        stack.append(span)
+        try:
+            yield span
+        except Exception as e:
+            span.record_exception(e)
+            raise
+        finally:
+            stack.pop()
+            span.end()
+
+
+class RecordedSpan(Span):
+
+    __slots__ = ('tracer', 'name', 'attributes', 'trace_id', 'span_id',
+                 'parent_id', 'start', 'end_time', 'status', 'error')
+
+    def __init__(self, tracer, name, attributes, trace_id, span_id,
+                 parent_id):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.start = time.time()
+        self.end_time = None
+        self.status = 'ok'
+        self.error = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def record_exception(self, exception):
+        self.status = 'error'
+        self.error = '%s: %s' % (exception.__class__.__name__, exception)
+
+    def end(self):
+        if self.end_time is None:
+            self.end_time = time.time()
+            self.tracer._finished(self)
+
+    @property
+    def duration(self):
+        return None if self.end_time is None else self.end_time - self.start
+
+    def as_dict(self):
+        return {
+                'name': self.name,
+                'trace_id': self.trace_id,
+                'span_id': self.span_id,
+                'parent_id': self.parent_id,
+                'start': self.start,
+                'duration': self.duration,
+                'status': self.status,
+                'error': self.error,
+                'attributes': dict(self.attributes)}
+
+
+class RecordingTracer(Tracer):
+    """keeps finished spans in .spans, in the order they ended.
+
+    only the last max_spans are kept, so a long running process does not
+    grow without limit.
+    """
+
+    def __init__(self, max_spans=_default_max_spans):
+        super(RecordingTracer, self).__init__()
+        self.spans = deque(maxlen=max_spans)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def start_span(self, name, attributes=None, parent=None):
+        span_id = next(self._ids)
+        trace_id = span_id if parent is None else parent.trace_id
+        return RecordedSpan(
+                self, name, attributes, trace_id, span_id,
+                None if parent is None else parent.span_id)
+
+    def _finished(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def children(self, span):
+        """finished spans whose parent is span."""
+        with self._lock:
+            spans = list(self.spans)
+        return [s for s in spans if s.parent_id == span.span_id]
@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+"""streaming transfers of large files to and from epiphan pearl."""
+
+import hashlib
+import json
+import logging
+import mmap
+import os
+import re
+import threading
+import uuid
+
+import requests
+
+from errors import TransferError
+from metrics import operation
+
+_default_chunk_size = 64 * 1024
+_default_checkpoint_bytes = 8 * 1024 * 1024
+
+
+class FirmwareImage(object):
+    """read-only memory map of a firmware image file.
+
+    the image is mapped once and can be shared by any number of concurrent
+    uploads; each upload reads slices of the map, so memory use does not
+    grow with the image size.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        self._file = open(path, 'rb')
+        try:
+            self.size = os.fstat(self._file.fileno()).st_size
+            if self.size == 0:
+                raise ValueError('firmware image(%s) is empty' % path)
+            self._map = mmap.mmap(
+                    self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._file.close()
+            raise
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def slice(self, start, end):
+        """returns bytes in [start, end) of image."""
+        return self._map[start:end]
+
+    def close(self):
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+                self._file.close()
+
+
+class MultipartFileBody(object):
+    """file-like multipart/form-data body streamed from a FirmwareImage.
+
+    requests sends file-like bodies in blocks via read(); the body reports
+    its length so the upload goes out with a content-length, not chunked.
+
+    image: FirmwareImage to stream
+    field_name: form field for the file
+    fields: dict with extra form fields sent before the file
+    progress: optional callable(bytes_sent, total_bytes)
+    throttle: optional object with consume(nbytes), e.g. fleet.TokenBucket
+    """
+
+    def __init__(
+            self, image, field_name='firmware', fields=None,
+            chunk_size=_default_chunk_size, progress=None, throttle=None):
+        self.image = image
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.throttle = throttle
+        self.boundary = uuid.uuid4().hex
+        self.content_type = \
+            'multipart/form-data; boundary=%s' % self.boundary
+
+        head = []
+        for (name, value) in sorted((fields or {}).items()):
+            head.append(
+                    '--%s\r\nContent-Disposition: form-data; name="%s"'
+                    '\r\n\r\n%s\r\n' % (self.boundary, name, value))
+        head.append(
+                '--%s\r\nContent-Disposition: form-data; name="%s"; '
+                'filename="%s"\r\nContent-Type: application/octet-stream'
+                '\r\n\r\n' % (self.boundary, field_name, image.name))
+        self._head = ''.join(head)
+        self._tail = '\r\n--%s--\r\n' % self.boundary
+        self._data_start = len(self._head)
+        self._data_end = self._data_start + image.size
+        self.total = self._data_end + len(self._tail)
+        self.sent = 0
+
+    def __len__(self):
+        return self.total
+
+    def read(self, size=-1):
+        """returns next chunk of body; empty string when done.
+
+        reads are capped at chunk_size, even if size is negative, to keep
+        memory constant. callers must loop until an empty read.
+        """
+        if size is None or size < 0 or size > self.chunk_size:
+            size = self.chunk_size
+        pos = self.sent
+        if pos >= self.total:
+            return ''
+
+        if pos < self._data_start:
+            chunk = self._head[pos:min(pos + size, self._data_start)]
+        elif pos < self._data_end:
+            chunk = self.image.slice(
+                    pos - self._data_start,
+                    min(pos + size, self._data_end) - self._data_start)
+        else:
+            offset = pos - self._data_end
+            chunk = self._tail[offset:offset + size]
+
+        if self.throttle is not None:
+            self.throttle.consume(len(chunk))
+        self.sent += len(chunk)
+        if self.progress is not None:
+            self.progress(self.sent, self.total)
+        return chunk
+
+
+def _preallocate(f, size):
+    """reserves size bytes for file f; sparse if fallocate not available."""
+    fallocate = getattr(os, 'posix_fallocate', None)
+    if fallocate is not None:
+        try:
+            fallocate(f.fileno(), 0, size)
+            return
+        except OSError:
+            pass
+    f.seek(0, os.SEEK_END)
+    if f.tell() < size:
+        f.truncate(size)
+
+
+def _read_checkpoint(state_path):
+    try:
+        with open(state_path, 'r') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {'offset': 0, 'total': None}
+
+
+def _write_checkpoint(state_path, offset, total):
+    with open(state_path, 'w') as f:
+        json.dump({'offset': offset, 'total': total}, f)
+
+
+def _hash_prefix(f, nbytes, digest, chunk_size):
+    """feeds first nbytes of f to digest, chunk by chunk."""
+    f.seek(0)
+    remaining = nbytes
+    while remaining > 0:
+        chunk = f.read(min(chunk_size, remaining))
+        if not chunk:
+            raise TransferError(
+                    'partial file shorter than checkpoint(%s)' % nbytes)
+        digest.update(chunk)
+        remaining -= len(chunk)
+
+
+@operation('download', client_arg=0)
+def download(
+        client, path, dest, resume=True, hash_name='sha256',
+        chunk_size=_default_chunk_size, progress=None,
+        checkpoint_bytes=_default_checkpoint_bytes):
+    """streams file at device path to dest, in constant memory.
+
+    data goes to `dest.part`, preallocated to the final size when the
+    device reports it; the committed offset is checkpointed in
+    `dest.part.json`, so an interrupted download resumes with an http
+    range request. the hash is computed while data streams (a resumed
+    download re-reads the partial file once to hash its prefix).
+
+    progress: optional callable(bytes_done, total_bytes_or_None)
+
+    returns dict {'path': dest, 'size': bytes, 'hash': hexdigest}
+    """
+    logger = logging.getLogger(__name__)
+    part = dest + '.part'
+    state_path = part + '.json'
+
+    offset = 0
+    total = None
+    if resume and os.path.exists(part):
+        state = _read_checkpoint(state_path)
+        offset = state['offset']
+        total = state['total']
+
+    # byte offsets only make sense for the raw, not gzipped, content
+    headers = {'Accept-Encoding': 'identity'}
+    if offset > 0:
+        headers['Range'] = 'bytes=%d-' % offset
+
+    r = None
+    try:
+        r = client.get(path, extra_headers=headers, stream=True)
+    except requests.HTTPError as e:
+        status = e.response.status_code if e.response is not None else None
+        if not (offset > 0 and status == 416 and total in (None, offset)):
+            raise
+        # checkpoint already covers the whole file
+        total = offset
+
+    if r is not None and r.status_code == 206:
+        m = re.match(
+                r'bytes (\d+)-\d+/(\d+|\*)',
+                r.headers.get('content-range', ''))
+        if m is None or int(m.group(1)) != offset:
+            r.close()
+            msg = 'unexpected content-range(%s) resuming %s/%s at %s' % (
+                    r.headers.get('content-range'), client.url, path, offset)
+            logger.error(msg)
+            raise TransferError(msg)
+        total = int(m.group(2)) if m.group(2) != '*' else None
+    elif r is not None:
+        # full content: device ignored range or nothing to resume
+        offset = 0
+        length = r.headers.get('content-length')
+        total = int(length) if length is not None else None
+
+    digest = hashlib.new(hash_name)
+    mode = 'r+b' if offset > 0 else 'wb'
+    try:
+        with open(part, mode) as f:
+            if total is not None:
+                _preallocate(f, total)
+            _hash_prefix(f, offset, digest, chunk_size)
+            f.seek(offset)
+            if r is not None:
+                committed = offset
+                try:
+                    for chunk in r.iter_content(chunk_size=chunk_size):
+                        f.write(chunk)
+                        digest.update(chunk)
+                        offset += len(chunk)
+                        if progress is not None:
+                            progress(offset, total)
+                        if offset - committed >= checkpoint_bytes:
+                            f.flush()
+                            _write_checkpoint(state_path, offset, total)
+                            committed = offset
+                finally:
+                    f.flush()
+                    _write_checkpoint(state_path, offset, total)
+            if total is not None and offset < total:
+                msg = 'incomplete download %s/%s: got(%s) of(%s) bytes' % (
+                        client.url, path, offset, total)
+                logger.error(msg)
+                raise TransferError(msg)
+            f.truncate(offset)
+    finally:
+        if r is not None:
+            r.close()
+
+    os.rename(part, dest)
+    os.remove(state_path)
+    return {'path': dest, 'size': offset, 'hash': digest.hexdigest()}
+
+
+def file_hash(path, hash_name='sha256', chunk_size=_default_chunk_size):
+    """returns hexdigest of file at path, read chunk by chunk."""
+    digest = hashlib.new(hash_name)
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def reopen_for_append(dest, size):
+    """turns a completed download back into a partial one.
+
+    the next download(dest) then resumes at `size`, fetching only the bytes
+    appended on the device since; used for recordings that kept growing.
+    """
+    part = dest + '.part'
+    os.rename(dest, part)
+    _write_checkpoint(part + '.json', size, None)
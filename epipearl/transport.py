@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+"""http transports used by the epipearl client.
+
+a transport sends one request and returns a requests.Response. the client
+builds url, params, headers and auth, and hands them to its transport:
+
+    RequestsTransport   default; a requests session, with pooled connections
+    Urllib3Transport    urllib3 pool manager, without the requests adapters
+    MemoryTransport     routes requests to python handlers, no sockets
+
+to plug in another http stack (e.g. pycurl), subclass Transport and
+implement send(), or override request() to skip the shared request
+preparation and redirect handling; then register it by name:
+
+    register_transport('pycurl', PycurlTransport)
+    client = Epipearl(url, user, passwd, transport='pycurl')
+"""
+
+import io
+import time
+
+from datetime import timedelta
+from httplib import responses
+from urlparse import parse_qs
+from urlparse import urljoin
+from urlparse import urlparse
+
+import requests
+
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from urllib3.connection import HTTPConnection
+from urllib3.connection import HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool
+from urllib3.connectionpool import HTTPSConnectionPool
+
+from timing import add_phase
+
+_max_redirects = 30
+_redirect_codes = (301, 302, 303, 307, 308)
+
+
+class Transport(object):
+    """base transport: prepares requests and follows redirects.
+
+    subclasses implement send(prepared, timeout, stream) that returns a
+    requests.Response without following redirects.
+    """
+
+    max_redirects = _max_redirects
+
+    def request(self, method, url, params=None, data=None, headers=None,
+                auth=None, timeout=None, stream=False):
+        """sends request and follows redirects; returns requests.Response.
+
+        auth: (user, passwd) for http basic auth
+        timeout: seconds, or (connect, read) tuple
+        """
+        prepared = requests.Request(
+                method, url, params=params, data=data, headers=headers,
+                auth=auth).prepare()
+        history = []
+        while True:
+            start = time.time()
+            resp = self.send(prepared, timeout=timeout, stream=stream)
+            resp.elapsed = timedelta(seconds=time.time() - start)
+            location = resp.headers.get('location')
+            if resp.status_code not in _redirect_codes or not location:
+                break
+            if len(history) >= self.max_redirects:
+                raise requests.TooManyRedirects(
+                        'exceeded %s redirects' % self.max_redirects,
+                        response=resp)
+            resp.content    # release connection
+            history.append(resp)
+            prepared = self._redirected(prepared, resp, location)
+
+        resp.history = history
+        if not stream:
+            resp.content
+        return resp
+
+    def _redirected(self, prepared, resp, location):
+        """request to follow a redirect, the way browsers do."""
+        nxt = prepared.copy()
+        nxt.url = urljoin(resp.url or prepared.url, location)
+        if resp.status_code in (301, 302, 303) and prepared.method != 'HEAD':
+            nxt.method = 'GET'
+            nxt.body = None
+            for h in ('Content-Type', 'Content-Length', 'Transfer-Encoding'):
+                nxt.headers.pop(h, None)
+        return nxt
+
+    def send(self, prepared, timeout=None, stream=False):
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+
+class _TimedHTTPConnection(HTTPConnection):
+
+    def connect(self):
+        start = time.time()
+        try:
+            HTTPConnection.connect(self)
+        finally:
+            add_phase('connect', time.time() - start)
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+
+    def connect(self):
+        start = time.time()
+        try:
+            HTTPSConnection.connect(self)
+        finally:
+            add_phase('connect', time.time() - start)
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+# urllib3 pools whose connections report connect time to timing
+_timed_pool_classes = {
+        'http': _TimedHTTPConnectionPool,
+        'https': _TimedHTTPSConnectionPool,
+        }
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """requests adapter that reports connection setup time to timing."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        HTTPAdapter.init_poolmanager(self, *args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = _timed_pool_classes
+
+
+class RequestsTransport(Transport):
+    """sends requests through a requests.Session.
+
+    session: optional session to use, e.g. with custom adapters
+    pool_maxsize: if given, connections kept open per host
+    """
+
+    def __init__(self, session=None, pool_maxsize=None):
+        if session is None or pool_maxsize is not None:
+            session = session or requests.Session()
+            if pool_maxsize is None:
+                adapter = TimedHTTPAdapter()
+            else:
+                adapter = TimedHTTPAdapter(
+                        pool_connections=1, pool_maxsize=pool_maxsize)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+
+    def request(self, method, url, params=None, data=None, headers=None,
+                auth=None, timeout=None, stream=False):
+        return self.session.request(
+                method, url, params=params, data=data, headers=headers,
+                auth=auth, timeout=timeout, stream=stream)
+
+    def close(self):
+        self.session.close()
+
+
+class Urllib3Transport(Transport):
+    """sends requests through a urllib3 pool manager.
+
+    skips the session and adapter layers of requests; responses are still
+    built as requests.Response.
+    """
+
+    def __init__(self, num_pools=10, maxsize=4, **pool_kwargs):
+        import urllib3
+        self._urllib3 = urllib3
+        self.pool = urllib3.PoolManager(
+                num_pools=num_pools, maxsize=maxsize, **pool_kwargs)
+        self.pool.pool_classes_by_scheme = _timed_pool_classes
+        self._adapter = HTTPAdapter()
+
+    def _timeout(self, timeout):
+        if isinstance(timeout, tuple):
+            (connect, read) = timeout
+            return self._urllib3.Timeout(connect=connect, read=read)
+        return self._urllib3.Timeout(connect=timeout, read=timeout)
+
+    def send(self, prepared, timeout=None, stream=False):
+        try:
+            r = self.pool.urlopen(
+                    prepared.method, prepared.url, body=prepared.body,
+                    headers=dict(prepared.headers), redirect=False,
+                    retries=False, timeout=self._timeout(timeout),
+                    preload_content=False, decode_content=False)
+        except self._urllib3.exceptions.NewConnectionError as e:
+            # a subclass of ConnectTimeoutError, e.g. for a refused connection
+            raise requests.ConnectionError(e, request=prepared)
+        except self._urllib3.exceptions.ConnectTimeoutError as e:
+            raise requests.ConnectTimeout(e, request=prepared)
+        except self._urllib3.exceptions.ReadTimeoutError as e:
+            raise requests.ReadTimeout(e, request=prepared)
+        except self._urllib3.exceptions.TimeoutError as e:
+            raise requests.Timeout(e, request=prepared)
+        except self._urllib3.exceptions.HTTPError as e:
+            raise requests.ConnectionError(e, request=prepared)
+        return self._adapter.build_response(prepared, r)
+
+    def close(self):
+        self.pool.clear()
+
+
+class MemoryRequest(object):
+    """request as seen by MemoryTransport handlers.
+
+    form holds the first value of each urlencoded form field; getlist()
+    returns all values of a field, e.g. for 'rc[]'.
+    """
+
+    def __init__(self, method, url, headers=None, body=None):
+        self.method = method
+        self.url = url
+        parsed = urlparse(url)
+        self.host = parsed.netloc
+        self.path = parsed.path
+        self.query = dict(
+                (k, v[0]) for (k, v) in
+                parse_qs(parsed.query, keep_blank_values=True).items())
+        self.headers = CaseInsensitiveDict(headers or {})
+        if hasattr(body, 'read'):
+            # file-like bodies may return a chunk per read, e.g. a
+            # transfer.MultipartFileBody
+            chunks = []
+            while True:
+                chunk = body.read()
+                if not chunk:
+                    break
+                chunks.append(chunk)
+            body = ''.join(chunks)
+        self.body = body or ''
+        self._form = {}
+        if self.headers.get('Content-Type', '').startswith(
+                'application/x-www-form-urlencoded'):
+            self._form = parse_qs(self.body, keep_blank_values=True)
+        self.form = dict((k, v[0]) for (k, v) in self._form.items())
+
+    @classmethod
+    def from_prepared(cls, prepared):
+        return cls(prepared.method, prepared.url, prepared.headers,
+                   prepared.body)
+
+    def getlist(self, name):
+        return list(self._form.get(name, []))
+
+
+def make_response(prepared, status, headers=None, body=''):
+    """builds a requests.Response with body served from memory."""
+    if isinstance(body, unicode):
+        body = body.encode('utf-8')
+    resp = requests.Response()
+    resp.status_code = status
+    resp.reason = responses.get(status, '')
+    resp.headers = CaseInsensitiveDict(headers or {})
+    resp.headers.setdefault('Content-Length', str(len(body)))
+    resp.encoding = get_encoding_from_headers(resp.headers)
+    resp.raw = io.BytesIO(body)
+    resp.url = prepared.url
+    resp.request = prepared
+    return resp
+
+
+class MemoryTransport(Transport):
+    """routes requests to python handlers, in the calling thread.
+
+    handler(request) gets a MemoryRequest and returns
+    (status, headers, body). routes match on url path; app, if given,
+    handles everything not routed. unmatched paths get 404.
+    """
+
+    def __init__(self, app=None):
+        self.app = app
+        self.routes = {}
+        self.requests = []
+
+    def route(self, path, handler, methods=('GET', 'POST')):
+        path = '/' + path.lstrip('/')
+        for method in methods:
+            self.routes[(method, path)] = handler
+
+    def send(self, prepared, timeout=None, stream=False):
+        request = MemoryRequest.from_prepared(prepared)
+        self.requests.append(request)
+        handler = self.routes.get((request.method, request.path), self.app)
+        if handler is None:
+            return make_response(prepared, 404, body='not found')
+        (status, headers, body) = handler(request)
+        return make_response(prepared, status, headers, body)
+
+
+_transports = {
+        'requests': RequestsTransport,
+        'urllib3': Urllib3Transport,
+        'memory': MemoryTransport,
+        }
+
+
+def register_transport(name, factory):
+    """makes factory(**kwargs) available as transport `name`."""
+    _transports[name] = factory
+
+
+def make_transport(transport=None, **kwargs):
+    """returns a transport instance.
+
+    transport: None for the default, a registered name, or an instance
+    """
+    if transport is None:
+        transport = 'requests'
+    if isinstance(transport, basestring):
+        try:
+            factory = _transports[transport]
+        except KeyError:
+            raise ValueError('unknown transport(%s)' % transport)
+        return factory(**kwargs)
+    return transport
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""typed change events from device state diffs.
+
+the watcher keeps the last known state per device and channel, and turns
+each new snapshot (get_params values, infocfg, sysinfo) into change events
+for subscribers; the first snapshot of anything is the baseline and emits
+no events.
+"""
+
+import logging
+import threading
+import time
+
+from Queue import Empty
+from Queue import Full
+from Queue import Queue
+
+logger = logging.getLogger(__name__)
+
+RECORDING_STARTED = 'recording_started'
+RECORDING_STOPPED = 'recording_stopped'
+STREAM_STARTED = 'stream_started'
+STREAM_STOPPED = 'stream_stopped'
+CHANNEL_DOWN = 'channel_down'
+CHANNEL_UP = 'channel_up'
+CHANNEL_ADDED = 'channel_added'
+CHANNEL_REMOVED = 'channel_removed'
+CHANNEL_RENAMED = 'channel_renamed'
+RECORDER_ADDED = 'recorder_added'
+RECORDER_REMOVED = 'recorder_removed'
+RECORDER_RENAMED = 'recorder_renamed'
+PARAM_CHANGED = 'param_changed'
+
+
+class ChangeEvent(object):
+
+    __slots__ = ('type', 'device', 'channel', 'field', 'old', 'new',
+                 'timestamp')
+
+    def __init__(self, type, device, channel, field=None, old=None,
+                 new=None):
+        self.type = type
+        self.device = device
+        self.channel = channel
+        self.field = field
+        self.old = old
+        self.new = new
+        self.timestamp = time.time()
+
+    def as_dict(self):
+        return dict((k, getattr(self, k)) for k in self.__slots__)
+
+    def __repr__(self):
+        return 'ChangeEvent(%s, %s, channel(%s), %s: %r -> %r)' % (
+                self.type, self.device, self.channel, self.field,
+                self.old, self.new)
+
+
+class Subscription(object):
+    """bounded queue of events for one subscriber; iterate to consume.
+
+    block: if true, publishing waits while the queue is full, which slows
+        down whoever feeds the watcher (e.g. poller workers); otherwise
+        the oldest event is dropped and counted in `dropped`.
+    types: optional set of event types to receive
+    """
+
+    def __init__(self, maxsize=1000, block=False, types=None):
+        self.queue = Queue(maxsize)
+        self.block = block
+        self.types = set(types) if types else None
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, event):
+        if self.block:
+            self.queue.put(event)
+            return
+        while True:
+            try:
+                self.queue.put_nowait(event)
+                return
+            except Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except Empty:
+                    pass
+
+    def get(self, timeout=None):
+        """returns next event, or None on timeout."""
+        try:
+            return self.queue.get(True, timeout)
+        except Empty:
+            return None
+
+    def __iter__(self):
+        while not self.closed:
+            event = self.get(timeout=0.1)
+            if event is not None:
+                yield event
+
+    def close(self):
+        self.closed = True
+
+
+class StateWatcher(object):
+
+    def __init__(self):
+        self._params = {}
+        self._infocfg = {}
+        self._sysinfo = {}
+        self._lock = threading.Lock()
+        self._subscriptions = []
+        self._callbacks = []
+
+    def subscribe(self, callback=None, maxsize=1000, block=False,
+                  types=None):
+        """registers a subscriber.
+
+        with callback, events are passed to callback(event) as they are
+        detected, in the thread feeding the watcher; returns None.
+        otherwise returns a Subscription to iterate over.
+        """
+        with self._lock:
+            if callback is not None:
+                self._callbacks.append((callback, types and set(types)))
+                return None
+            s = Subscription(maxsize=maxsize, block=block, types=types)
+            self._subscriptions.append(s)
+            return s
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscription.close()
+            self._subscriptions.remove(subscription)
+
+    def publish(self, events):
+        with self._lock:
+            callbacks = list(self._callbacks)
+            subscriptions = list(self._subscriptions)
+        for event in events:
+            for (callback, types) in callbacks:
+                if types is None or event.type in types:
+                    try:
+                        callback(event)
+                    except Exception as e:
+                        logger.error('event callback failed - %s' % e)
+            for s in subscriptions:
+                if s.types is None or event.type in s.types:
+                    s.put(event)
+
+    def _swap(self, store, key, new):
+        with self._lock:
+            old = store.get(key)
+            store[key] = new
+        return old
+
+    def update_params(self, device, channel, values):
+        """diffs get_params values for a channel; returns events."""
+        old = self._swap(self._params, (device, channel), dict(values))
+        events = []
+        if old is not None:
+            for field in sorted(set(old) | set(values)):
+                (a, b) = (old.get(field), values.get(field))
+                if a == b:
+                    continue
+                if field == 'rec_enabled':
+                    etype = RECORDING_STARTED if b == 'on' \
+                        else RECORDING_STOPPED
+                elif field == 'publish_type':
+                    etype = STREAM_STOPPED if b in ('0', None) \
+                        else STREAM_STARTED
+                else:
+                    etype = PARAM_CHANGED
+                events.append(ChangeEvent(etype, device, channel, field, a, b))
+        self.publish(events)
+        return events
+
+    def update_infocfg(self, device, infocfg):
+        """diffs channel and recorder lists from get_infocfg; returns events.
+        """
+        new = {}
+        for (kind, prefix) in (('channels', ''), ('recorders', 'm')):
+            for c in infocfg.get(kind, []):
+                new[prefix + c['id']] = c['name'].strip()
+        old = self._swap(self._infocfg, device, new)
+        events = []
+        if old is not None:
+            for channel in sorted(set(old) | set(new)):
+                recorder = channel.startswith('m')
+                if channel not in old:
+                    etype = RECORDER_ADDED if recorder else CHANNEL_ADDED
+                elif channel not in new:
+                    etype = RECORDER_REMOVED if recorder else CHANNEL_REMOVED
+                elif old[channel] != new[channel]:
+                    etype = RECORDER_RENAMED if recorder else CHANNEL_RENAMED
+                else:
+                    continue
+                events.append(ChangeEvent(
+                    etype, device, channel, 'name',
+                    old.get(channel), new.get(channel)))
+        self.publish(events)
+        return events
+
+    def update_sysinfo(self, device, sysinfo):
+        """diffs channel state and recorder state in sysinfo; returns events.
+        """
+        new = {}
+        for c in sysinfo.get('channels', []):
+            new[c['id']] = {
+                    'name': c.get('name'),
+                    'state': c.get('state'),
+                    'recording': bool(c.get('recorder', {}).get('enabled'))}
+        old = self._swap(self._sysinfo, device, new)
+        events = []
+        if old is not None:
+            for channel in sorted(set(old) | set(new)):
+                recorder = channel.startswith('m')
+                if channel not in old:
+                    events.append(ChangeEvent(
+                        RECORDER_ADDED if recorder else CHANNEL_ADDED,
+                        device, channel, 'name', None,
+                        new[channel]['name']))
+                    continue
+                if channel not in new:
+                    events.append(ChangeEvent(
+                        RECORDER_REMOVED if recorder else CHANNEL_REMOVED,
+                        device, channel, 'name', old[channel]['name'], None))
+                    continue
+                (a, b) = (old[channel], new[channel])
+                if a['name'] != b['name']:
+                    events.append(ChangeEvent(
+                        RECORDER_RENAMED if recorder else CHANNEL_RENAMED,
+                        device, channel, 'name', a['name'], b['name']))
+                if a['state'] != b['state']:
+                    events.append(ChangeEvent(
+                        CHANNEL_UP if b['state'] == 'OK' else CHANNEL_DOWN,
+                        device, channel, 'state', a['state'], b['state']))
+                if a['recording'] != b['recording']:
+                    events.append(ChangeEvent(
+                        RECORDING_STARTED if b['recording']
+                        else RECORDING_STOPPED,
+                        device, channel, 'recorder.enabled',
+                        a['recording'], b['recording']))
+        self.publish(events)
+        return events
+
+    def poll_callback(self, target, values, previous):
+        """feeds poller.Poller reads into the watcher.
+
+        use as Poller(callback=watcher.poll_callback); targets added with
+        add_params or add_sysinfo are recognized by their key.
+        """
+        (device, channel) = target.key
+        if channel == 'sysinfo':
+            return self.update_sysinfo(device, values)
+        return self.update_params(device, channel, values)
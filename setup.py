@@ -63,6 +63,12 @@ setup(
         'Programming Language :: Python :: 2.7'
     ],
     install_requires=requirements,
+    extras_require={
+        'analysis': ['numpy'],
+    },
+    entry_points={
+        'console_scripts': ['epipearl = epipearl.cli:main'],
+    },
     tests_require=test_requirements,
     zip_safe=False
 )
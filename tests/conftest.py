@@ -10,6 +10,18 @@ def pytest_addoption(parser):
     parser.addoption(
             "--runlive", action="store_true",
             help="test with live capture agents")
+    parser.addoption(
+            "--runbench", action="store_true",
+            help="run hot path benchmarks")
+    parser.addoption(
+            "--bench-save", action="store", default=None,
+            help="save benchmark results as json baseline to this path")
+    parser.addoption(
+            "--bench-compare", action="store", default=None,
+            help="fail benchmarks that regressed against this baseline")
+    parser.addoption(
+            "--bench-threshold", action="store", type=float, default=0.2,
+            help="max ops/sec drop, as fraction of baseline")
 
 
 def resp_datafile(config_type, error_type=None, ext='html'):
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_anomaly
+----------------------------------
+
+Tests for `epipearl` fleet anomaly detection.
+"""
+
+import os
+os.environ['TESTING'] = 'True'
+
+import copy
+import json
+import time
+
+import pytest
+
+from conftest import resp_datafile
+from epipearl.timeseries import TimeSeriesStore
+
+np = pytest.importorskip('numpy')
+from epipearl import anomaly
+
+benchtest = pytest.mark.skipif(
+        not pytest.config.getoption("--runbench"),
+        reason="need --runbench option to run")
+
+
+def kinds(flags):
+    return sorted((f['type'], f['device'], f['channel']) for f in flags)
+
+
+class TestAnomaly(object):
+
+    def setup_method(self, method):
+        self.sysinfo = json.loads(resp_datafile('sysinfo', ext='json'))
+        self.store = TimeSeriesStore(capacity=20)
+
+    def poll(self, device, n, change=None):
+        for i in range(n):
+            s = copy.deepcopy(self.sysinfo)
+            s['time'] += i * 5
+            if change is not None:
+                change(s, i)
+            self.store.record_sysinfo(device, s)
+
+    def test_healthy_fleet(self):
+        for d in range(3):
+            self.poll('dev%s' % d, 10)
+        assert anomaly.detect_anomalies(self.store, window=10) == []
+
+    def test_bitrate_drop_and_fps(self):
+        def degrade(s, i):
+            if i == 9:
+                s['channels'][2]['codecs']['video']['bitrate'] = '1000000'
+                s['channels'][0]['codecs']['video']['fps'] = '20.0'
+        self.poll('dev0', 10, degrade)
+        self.poll('dev1', 10)
+
+        flags = anomaly.detect_anomalies(self.store, window=10)
+        assert kinds(flags) == [
+                (anomaly.BITRATE_DROP, 'dev0', '3'),
+                (anomaly.FPS_DEVIATION, 'dev0', '1')]
+        drop = [f for f in flags if f['type'] == anomaly.BITRATE_DROP][0]
+        assert drop['value'] == 1000000.0
+        assert drop['baseline'] == 6467000.0
+
+        # per channel expected fps; unknown channels are skipped
+        flags = anomaly.fps_deviations(
+                self.store, expected_fps={('dev1', '1'): 60.0})
+        assert kinds(flags) == [(anomaly.FPS_DEVIATION, 'dev1', '1')]
+
+    def test_stalled_recorder(self):
+        def recording(s, i):
+            for c in s['channels'][:2]:
+                c['recorder']['enabled'] = True
+            # channel 1 recorder advances, channel 2 recorder is stuck
+            s['channels'][0]['recorder']['time'] = i * 5
+            s['channels'][1]['recorder']['time'] = 42
+        self.poll('dev0', 5, recording)
+
+        flags = anomaly.stalled_recorders(self.store, samples=3)
+        assert kinds(flags) == [(anomaly.RECORDER_STALLED, 'dev0', '2')]
+
+    fleet_metrics = (
+            'video_bitrate', 'audio_bitrate', 'fps', 'recorder_time')
+
+    def _fleet(self):
+        # 2000 channels x 4 metrics
+        store = TimeSeriesStore(capacity=60)
+        for m in self.fleet_metrics:
+            for d in range(500):
+                for c in range(4):
+                    for t in range(10):
+                        store.record('dev%s' % d, str(c), m, 3430000.0, t)
+        return store
+
+    def test_fleet(self):
+        store = self._fleet()
+        (keys, matrix) = anomaly.recent_matrix(store, 'fps', 60)
+        assert matrix.shape == (2000, 60)
+        assert keys == sorted(keys)
+        assert np.isnan(matrix[:, :50]).all()
+        assert (matrix[:, 50:] == 3430000.0).all()
+        assert anomaly.bitrate_drops(store, window=60) == []
+
+    @benchtest
+    def test_fleet_is_fast(self):
+        # each metric read in a few milliseconds
+        store = self._fleet()
+        metrics = self.fleet_metrics
+        best = None
+        for i in range(3):
+            start = time.time()
+            for m in metrics:
+                (keys, matrix) = anomaly.recent_matrix(store, m, 60)
+            elapsed = time.time() - start
+            best = elapsed if best is None else min(best, elapsed)
+        assert matrix.shape == (2000, 60)
+        assert best < 0.05
+        assert anomaly.bitrate_drops(store, window=60) == []
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_archive_sync
+----------------------------------
+
+Tests for `epipearl` incremental recorder archive sync.
+"""
+
+import os
+os.environ['TESTING'] = 'True'
+
+import hashlib
+import re
+import shutil
+import tempfile
+
+import httpretty
+
+from epipearl import Epipearl
+from epipearl.archive_sync import ArchiveIndex
+from epipearl.archive_sync import local_path
+from epipearl.archive_sync import sync_archives
+
+epiphan_user = "user"
+epiphan_passwd = "passwd"
+
+
+class FakeArchive(object):
+    """recorder1 archive in a fake device, served via httpretty."""
+
+    def __init__(self, url):
+        self.url = url
+        self.files = {}
+        self.listed_sizes = {}  # sizes shown, if not the exact ones
+        self.ranges = []
+        self.deleted = []
+        base = '%s/admin/recorder1/archive' % url
+        httpretty.register_uri(
+                httpretty.GET, base, body=self.listing)
+        httpretty.register_uri(
+                httpretty.POST, base, body=self.delete)
+        httpretty.register_uri(
+                httpretty.GET, re.compile(re.escape(base) + '/.+'),
+                body=self.content)
+
+    def page(self):
+        rows = ''.join(
+                '<tr><td><a href="/admin/recorder1/archive/%s">%s</a></td>'
+                '<td>%s bytes</td></tr>' % (
+                    n, n, self.listed_sizes.get(n, len(c)))
+                for (n, c) in sorted(self.files.items()))
+        return '<html><body><table>%s</table></body></html>' % rows
+
+    def listing(self, request, uri, headers):
+        return (200, headers, self.page())
+
+    def delete(self, request, uri, headers):
+        name = request.parsed_body['deletefile'][0]
+        self.deleted.append(name)
+        del self.files[name]
+        return (200, headers, self.page())
+
+    def content(self, request, uri, headers):
+        content = self.files[uri.split('/')[-1]]
+        rng = request.headers.get('Range')
+        self.ranges.append(rng)
+        if rng is None:
+            return (200, headers, content)
+        start = int(re.match(r'bytes=(\d+)-', rng).group(1))
+        if start >= len(content):
+            return (416, headers, '')
+        headers['content-range'] = 'bytes %d-%d/%d' % (
+                start, len(content) - 1, len(content))
+        return (206, headers, content[start:])
+
+
+class TestArchiveSync(object):
+
+    def setup_method(self, method):
+        self.tmpdir = tempfile.mkdtemp()
+        self.clients = [
+                Epipearl('http://fake%s.example.edu' % i,
+                         epiphan_user, epiphan_passwd)
+                for i in range(3)]
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmpdir)
+
+    def sync(self, **kwargs):
+        results = sync_archives(
+                self.clients, self.tmpdir, recorder_ids=['1'],
+                per_device=1, concurrency=4, **kwargs)
+        return sorted(
+                (r['device'], r['name'], r['action'], r['error'])
+                for r in results)
+
+    @httpretty.activate
+    def test_sync_new_grown_and_delete(self):
+        devices = [FakeArchive(c.url) for c in self.clients]
+        for d in devices:
+            d.files['a.mp4'] = 'a' * 5000
+            d.files['b.mp4'] = 'b' * 3000
+
+        results = self.sync()
+        assert len(results) == 6
+        assert all(r[2] == 'download' and r[3] is None for r in results)
+        path = local_path(self.tmpdir, self.clients[0].url, '1', 'a.mp4')
+        assert open(path).read() == 'a' * 5000
+
+        # nothing changed, nothing to do
+        assert self.sync() == []
+
+        # b grows in device 1, c is new in device 2
+        devices[1].files['b.mp4'] += 'B' * 1000
+        devices[2].files['c.mp4'] = 'c' * 10
+        results = self.sync()
+        assert results == [
+                (self.clients[1].url, 'b.mp4', 'resume', None),
+                (self.clients[2].url, 'c.mp4', 'download', None)]
+        assert devices[1].ranges[-1] == 'bytes=3000-'
+        path = local_path(self.tmpdir, self.clients[1].url, '1', 'b.mp4')
+        assert open(path).read() == 'b' * 3000 + 'B' * 1000
+
+        index = ArchiveIndex(os.path.join(self.tmpdir, 'archive_index.json'))
+        entry = index.get(self.clients[1].url, '1', 'b.mp4')
+        assert entry['size'] == 4000
+        assert entry['hash'] == hashlib.sha256(
+                'b' * 3000 + 'B' * 1000).hexdigest()
+
+        # delete files that stopped growing and verify against index
+        devices[0].files['a.mp4'] += 'A'
+        results = self.sync(delete_verified=True)
+        actions = dict(((r[0], r[1]), r[2]) for r in results)
+        assert actions[(self.clients[0].url, 'a.mp4')] == 'resume'
+        assert actions[(self.clients[0].url, 'b.mp4')] == 'delete'
+        assert devices[0].deleted == ['b.mp4']
+        assert sorted(devices[2].deleted) == ['a.mp4', 'b.mp4', 'c.mp4']
+        assert devices[0].files.keys() == ['a.mp4']
+        assert all(r[3] is None for r in results)
+
+    @httpretty.activate
+    def test_sync_skips_delete_on_checksum_mismatch(self):
+        device = FakeArchive(self.clients[0].url)
+        device.files['a.mp4'] = 'a' * 100
+        self.clients = self.clients[:1]
+        self.sync()
+
+        path = local_path(self.tmpdir, self.clients[0].url, '1', 'a.mp4')
+        with open(path, 'wb') as f:
+            f.write('corrupted')
+
+        results = self.sync(delete_verified=True)
+        assert results[0][2] == 'delete'
+        assert 'checksum mismatch' in results[0][3]
+        assert device.deleted == []
+
+    @httpretty.activate
+    def test_sync_resumes_file_grown_within_listed_size(self):
+        device = FakeArchive(self.clients[0].url)
+        device.files['a.mp4'] = 'a' * 100
+        device.listed_sizes['a.mp4'] = 1000
+        self.clients = self.clients[:1]
+        self.sync()
+
+        # the web ui rounds sizes; the listing did not change
+        device.files['a.mp4'] += 'A' * 10
+        results = self.sync(delete_verified=True)
+        assert results == [(self.clients[0].url, 'a.mp4', 'resume', None)]
+        assert device.deleted == []
+        assert device.ranges[-2:] == ['bytes=100-', 'bytes=100-']
+        path = local_path(self.tmpdir, self.clients[0].url, '1', 'a.mp4')
+        assert open(path).read() == 'a' * 100 + 'A' * 10
+
+        results = self.sync(delete_verified=True)
+        assert results == [(self.clients[0].url, 'a.mp4', 'delete', None)]
+        assert device.ranges[-1] == 'bytes=110-'
+        assert device.deleted == ['a.mp4']
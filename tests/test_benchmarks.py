@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_benchmarks
+----------------------------------
+
+Benchmarks for `epipearl` parsing and verification hot paths, on the
+recorded device pages; requests go through the in-memory transport, so no
+socket mocking is measured.
+
+run with:
+    py.test tests/test_benchmarks.py --runbench --bench-save baseline.json
+    py.test tests/test_benchmarks.py --runbench --bench-compare baseline.json
+"""
+
+import os
+os.environ['TESTING'] = 'True'
+
+import pytest
+
+from bs4 import BeautifulSoup
+
+from conftest import resp_datafile
+from epipearl import Epipearl
+from epipearl.bench import compare
+from epipearl.bench import format_results
+from epipearl.bench import load_results
+from epipearl.bench import run_benchmark
+from epipearl.bench import run_suite
+from epipearl.bench import save_results
+from epipearl.endpoints.webui_channel import WebUiChannel
+from epipearl.endpoints.webui_config import WebUiConfig
+from epipearl.transport import MemoryTransport
+
+epiphan_url = "http://fake.example.edu"
+epiphan_user = "user"
+epiphan_passwd = "passwd"
+
+benchtest = pytest.mark.skipif(
+        not pytest.config.getoption("--runbench"),
+        reason="need --runbench option to run")
+
+
+def _client(routes):
+    transport = MemoryTransport()
+    for (path, body) in routes.items():
+        transport.route(path, lambda req, body=body: (200, {}, body))
+    return Epipearl(epiphan_url, epiphan_user, epiphan_passwd,
+                    transport=transport)
+
+
+def hot_paths():
+    """returns [(name, func)], each func returning a checkable result."""
+    ntp_ok = resp_datafile('set_date_and_time', 'ok')
+    invalid_proto = resp_datafile('set_date_and_time', 'invalid_proto')
+    infocfg = resp_datafile('get_infocfg', 'ok')
+    rtmp = resp_datafile('set_channel_rtmp', 'ok')
+    params = ''.join('param%02d = value %d\n' % (i, i) for i in range(40))
+    invalid_soup = BeautifulSoup(invalid_proto, 'html.parser')
+
+    c = _client({
+        '/admin/timesynccfg': ntp_ok,
+        '/admin/infocfg': infocfg,
+        '/admin/channel39/streamsetup': rtmp,
+        '/admin/channel1/get_params.cgi': params})
+
+    return [
+        ('configuration_set_ntp', lambda: WebUiConfig.set_ntp(
+            client=c, server='north-america.pool.ntp.org',
+            timezone='US/Alaska')),
+        ('configuration_set_channel_rtmp',
+         lambda: WebUiChannel.set_channel_rtmp(
+            client=c, channel_id='39',
+            rtmp_url='http://fake-fake.akamai.com',
+            rtmp_stream=(
+                'dev-epiphan002-presenter-delivery.'
+                'stream-1920x540_1_200@355694'),
+            rtmp_usr='superfakeuser', rtmp_pwd='superfakeuser')),
+        ('scrape_error_parsed', lambda: WebUiConfig._scrape_error(
+            invalid_soup)),
+        ('scrape_error_with_parse', lambda: WebUiConfig._scrape_error(
+            BeautifulSoup(invalid_proto, 'html.parser'))),
+        ('get_infocfg', lambda: c.get_infocfg()),
+        ('get_params', lambda: c.get_params('1')),
+        ]
+
+
+class TestHotPaths(object):
+
+    def test_hot_paths_results(self):
+        results = dict((name, func()) for (name, func) in hot_paths())
+        assert results['configuration_set_ntp'] is True
+        assert results['configuration_set_channel_rtmp'] is True
+        assert results['scrape_error_parsed']
+        assert results['scrape_error_with_parse'] == \
+            results['scrape_error_parsed']
+        assert len(results['get_infocfg']['channels']) == 4
+        assert len(results['get_params']) == 40
+
+    def test_run_benchmark(self):
+        r = run_benchmark('noop', lambda: [0] * 10, min_time=0.001, rounds=2)
+        assert r['ops_per_sec'] > 0
+        assert r['rounds'] == 2
+        assert r['allocations']
+
+    def test_compare(self):
+        baseline = {'a': {'ops_per_sec': 100.0}, 'b': {'ops_per_sec': 100.0}}
+        results = {
+                'a': {'ops_per_sec': 85.0},
+                'b': {'ops_per_sec': 70.0},
+                'c': {'ops_per_sec': 1.0}}
+        regressions = compare(results, baseline, threshold=0.2)
+        assert [r['name'] for r in regressions] == ['b']
+        assert round(regressions[0]['change'], 2) == -0.3
+
+    @benchtest
+    def test_benchmark_hot_paths(self):
+        config = pytest.config
+        results = run_suite(hot_paths())
+        baseline = None
+        path = config.getoption('--bench-compare')
+        if path:
+            baseline = load_results(path)
+        print('\n' + format_results(results, baseline))
+        if config.getoption('--bench-save'):
+            save_results(config.getoption('--bench-save'), results)
+        if baseline is not None:
+            regressions = compare(
+                    results, baseline,
+                    threshold=config.getoption('--bench-threshold'))
+            assert not regressions, 'hot paths regressed: %s' % ', '.join(
+                    '%s(%+.1f%%)' % (r['name'], 100 * r['change'])
+                    for r in regressions)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_capabilities
+----------------------------------
+
+Tests for `epipearl` firmware capability detection.
+"""
+
+import os
+os.environ['TESTING'] = 'True'
+
+import pytest
+import shutil
+import tempfile
+import time
+
+from epipearl import Epipearl
+from epipearl.capabilities import Capabilities
+from epipearl.capabilities import probe
+from epipearl.errors import UnsupportedOperationError
+from epipearl.fakepearl import FakePearl
+from epipearl.snapshot import take_snapshot
+from epipearl.state_cache import StateCache
+
+
+class TestCapabilities(object):
+
+    def setup_method(self, method):
+        self.tmpdir = tempfile.mkdtemp()
+        self.fake = FakePearl(firmware_version='4.1.2')
+        self.transport = self.fake.transport()
+        self.mhcfg_calls = []
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmpdir)
+
+    def _stock_firmware(self):
+        def not_found(request):
+            self.mhcfg_calls.append(request.method)
+            return (404, {}, 'not found')
+        self.transport.route('admin/mhcfg', not_found)
+
+    def _client(self, capabilities):
+        return Epipearl('http://pearl', 'admin', 'secret',
+                        transport=self.transport, capabilities=capabilities)
+
+    def test_probe(self):
+        c = self._client(None)
+        assert probe(c) == {
+                'firmware_version': '4.1.2', 'product': 'Pearl',
+                'features': {'sysinfo_json': True, 'mhcfg': True}}
+        self._stock_firmware()
+        assert probe(c)['features']['mhcfg'] is False
+
+        self.transport.route('admin/sysinfo.cgi',
+                             lambda request: (200, {}, '<html>old</html>'))
+        assert probe(c)['firmware_version'] is None
+        assert probe(c)['features']['sysinfo_json'] is False
+
+    def test_short_circuit(self):
+        self._stock_firmware()
+        c = self._client(Capabilities())
+        assert c.supports('mhcfg') is False
+        assert c.supports('not_probed') is True
+        with pytest.raises(UnsupportedOperationError) as e:
+            c.set_mhpearl_settings(device_name='room-101')
+        assert 'firmware(4.1.2)' in str(e.value)
+        # probed once, no doomed post
+        assert self.mhcfg_calls == ['GET']
+        assert self.fake.settings['mhcfg'] == {}
+
+        snap = take_snapshot(c)
+        assert 'forms/mhcfg' in snap['errors']
+        assert self.mhcfg_calls == ['GET']
+
+    def test_supported(self):
+        c = self._client(Capabilities())
+        assert c.set_mhpearl_settings(device_name='room-101')
+        assert c.get_sysinfo()['system']['product'] == 'Pearl'
+
+    def test_cached_per_firmware_version(self):
+        self._stock_firmware()
+        store = StateCache(os.path.join(self.tmpdir, 'state.db'))
+        assert not self._client(Capabilities(store)).supports('mhcfg')
+        assert self.mhcfg_calls == ['GET']
+
+        # another process: firmware known, endpoints not probed again
+        assert not self._client(Capabilities(store)).supports('mhcfg')
+        assert self.mhcfg_calls == ['GET']
+
+        # new firmware is probed again
+        self.fake.firmware_version = '4.2.0'
+        caps = Capabilities(store)
+        assert not self._client(caps).supports('mhcfg')
+        assert self.mhcfg_calls == ['GET', 'GET']
+        assert caps.get(self._client(caps))['firmware_version'] == '4.2.0'
+
+    def test_firmware_change_is_noticed(self):
+        caps = Capabilities(recheck_interval=0)
+        c = self._client(caps)
+        assert c.supports('mhcfg')
+
+        # upgraded to stock firmware behind the cache's back
+        self._stock_firmware()
+        assert c.supports('mhcfg')
+        self.fake.firmware_version = '4.2.0'
+        assert not c.supports('mhcfg')
+        assert caps.get(c)['firmware_version'] == '4.2.0'
+
+    def test_rebooting_device_not_cached(self):
+        # no sysinfo yet while the device boots
+        self.transport.route('admin/sysinfo.cgi',
+                             lambda request: (404, {}, 'not found'))
+        store = StateCache(os.path.join(self.tmpdir, 'state.db'))
+        caps = Capabilities(store, unknown_ttl=0.1)
+        c = self._client(caps)
+        assert c.supports('sysinfo_json') is False
+        assert store.keys() == []
+
+        del self.transport.routes[('GET', '/admin/sysinfo.cgi')]
+        assert c.supports('sysinfo_json') is False
+        time.sleep(0.15)
+        assert c.supports('sysinfo_json') is True
+        assert store.keys() == [('http://pearl', 'capabilities/4.1.2')]
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_cli
+----------------------------------
+
+Tests for `epipearl` command line fleet tool.
+"""
+
+import os
+os.environ['TESTING'] = 'True'
+
+import json
+import pytest
+import shutil
+import tempfile
+
+from StringIO import StringIO
+
+from epipearl import Epipearl
+from epipearl.cli import main
+from epipearl.fakepearl import FakePearl
+from epipearl.fakepearl import FakePearlFleet
+from epipearl.fleet import provision
+from epipearl.snapshot import load
+
+spec = {
+        'channels': [
+            {'name': '{name}-presenter',
+             'rtmp': {'url': 'rtmp://live.example.edu/{name}',
+                      'stream': 'presenter', 'user': 'u', 'passwd': 'p'}},
+            {'name': '{name}-presentation'}],
+        'recorders': [
+            {'name': '{name}-vod',
+             'channels': ['{name}-presenter', '{name}-presentation'],
+             'settings': {'output_format': 'mp4'}}],
+        'mhpearl': {'device_name': '{name}', 'device_channel': '{name}-vod',
+                    'admin_server_url': 'http://mh.example.edu'},
+        'ntp': {'server': 'pool.ntp.org', 'timezone': 'US/Eastern'},
+        'touchscreen': {'screen_timeout': 300}}
+
+
+class TestProvision(object):
+
+    def setup_method(self, method):
+        self.fake = FakePearl()
+        self.c = Epipearl('http://pearl', 'admin', 'secret',
+                          transport=self.fake.transport())
+
+    def test_provision(self):
+        r = provision(self.c, spec, name='room-101')
+        assert sorted(r['channels']) == [
+                'room-101-presentation', 'room-101-presenter']
+        (recorder_id,) = r['recorders'].values()
+        presenter = self.fake.channels[r['channels']['room-101-presenter']]
+        assert presenter['rtmp']['rtmp_url'] == \
+            'rtmp://live.example.edu/room-101'
+        assert sorted(self.fake.recorders[recorder_id]['channels']) == \
+            sorted(r['channels'].values())
+        assert self.fake.settings['mhcfg']['DEVICE_CHANNEL'] == recorder_id
+
+    def test_provision_replaces(self):
+        provision(self.c, spec, name='room-101')
+        provision(self.c, spec, name='room-101')
+        names = [c['name'] for c in self.c.get_infocfg()['channels']]
+        assert names.count('room-101-presenter') == 1
+
+
+class TestCli(object):
+
+    # one fleet for all tests; stopping its servers takes a while
+    @classmethod
+    def setup_class(cls):
+        cls.tmpdir = tempfile.mkdtemp()
+        cls.fleet = FakePearlFleet(3).start()
+        cls.inventory = os.path.join(cls.tmpdir, 'devices.json')
+        with open(cls.inventory, 'w') as f:
+            json.dump(cls.fleet.inventory(), f)
+
+    @classmethod
+    def teardown_class(cls):
+        cls.fleet.stop()
+        shutil.rmtree(cls.tmpdir)
+
+    def _run(self, *argv):
+        out = StringIO()
+        status = main(['-i', self.inventory] + list(argv), out=out)
+        lines = [json.loads(line) for line in out.getvalue().splitlines()]
+        return (status, dict((line['device'], line) for line in lines))
+
+    def test_params(self):
+        (status, lines) = self._run('set-params', '1', 'publish_type=6')
+        assert status == 0
+        assert len(lines) == 3
+        assert all(line['ok'] and line['result'] is True
+                   for line in lines.values())
+
+        (status, lines) = self._run('get-params', '1', 'publish_type')
+        assert set(line['result']['publish_type']
+                   for line in lines.values()) == set(['6'])
+
+    def test_provision_inventory_and_delete(self):
+        path = os.path.join(self.tmpdir, 'room.json')
+        with open(path, 'w') as f:
+            json.dump(spec, f)
+        (status, lines) = self._run('-c', '2', 'provision', '--spec', path)
+        assert status == 0
+        name = self.fleet.inventory()[0]['name']
+        assert '%s-vod' % name in lines[name]['result']['recorders']
+
+        (status, lines) = self._run('--only', name, 'inventory')
+        assert list(lines) == [name]
+        channels = [c['name'] for c in lines[name]['result']['channels']]
+        assert '%s-presenter' % name in channels
+
+        (status, lines) = self._run(
+                '--only', name, 'delete-by-name', '%s-presenter' % name)
+        assert lines[name]['result'] is True
+        path = os.path.join(self.tmpdir, 'snapshots.json.gz')
+        (status, lines) = self._run(
+                '--only', name, 'snapshot', '--save', path)
+        snap = lines[name]['result']
+        assert '%s-presenter' % name not in [
+                c['name'] for c in snap['channels'].values()]
+        assert load(path) == {lines[name]['url']: snap}
+        assert snap['forms']['mhcfg']['DEVICE_PASSWORD'] == '<redacted>'
+
+        (status, lines) = self._run('--only', name, 'snapshot', '--secrets')
+        assert lines[name]['result']['forms']['mhcfg'][
+            'DEVICE_PASSWORD'] != '<redacted>'
+
+    def test_reboot_and_failures(self):
+        (status, lines) = self._run('reboot')
+        assert status == 0
+        assert all(line['result'] is True for line in lines.values())
+
+        self.fleet.devices[0].fail_next(1, status=500)
+        (status, lines) = self._run('inventory')
+        assert status == 1
+        failed = [line for line in lines.values() if not line['ok']]
+        assert len(failed) == 1
+        assert failed[0]['error'].startswith('HTTPError')
+
+    def test_capabilities(self):
+        (status, lines) = self._run('capabilities')
+        assert status == 0
+        assert all(line['result']['features'] == {
+            'sysinfo_json': True, 'mhcfg': True} for line in lines.values())
+
+    def test_bad_params(self):
+        with pytest.raises(SystemExit):
+            main(['-i', self.inventory, 'set-params', '1', 'novalue'],
+                 out=StringIO())
+
+    def test_clone(self):
+        (golden, target) = self.fleet.inventory()[:2]
+        self._run('--only', golden['name'], 'set-params', '2',
+                  'framesize=1920x1080')
+        (status, lines) = self._run(
+                'clone', '--golden', golden['name'], '--dry-run')
+        assert status == 0
+        assert lines[golden['name']]['result']['steps'] == []
+        assert {'op': 'set_params', 'channel': 'channel 2',
+                'args': {'params': {'framesize': '1920x1080'}}} in \
+            lines[target['name']]['result']['steps']
+
+        (status, lines) = self._run('clone', '--golden', golden['url'])
+        assert status == 0
+        (status, lines) = self._run('get-params', '2', 'framesize')
+        assert set(line['result']['framesize'] for line in lines.values()) == \
+            set(['1920x1080'])
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_clone
+----------------------------------
+
+Tests for `epipearl` golden-device cloning.
+"""
+
+import os
+os.environ['TESTING'] = 'True'
+
+from bs4 import BeautifulSoup
+
+from conftest import resp_datafile
+from epipearl import Epipearl
+from epipearl.clone import clone
+from epipearl.clone import clone_fleet
+from epipearl.clone import plan_clone
+from epipearl.clone import recorder_settings
+from epipearl.endpoints.webui_config import WebUiConfig
+from epipearl.fakepearl import FakePearl
+from epipearl.fleet import provision
+from epipearl.snapshot import diff
+from epipearl.snapshot import take_snapshot
+
+spec = {
+        'channels': [
+            {'name': 'presenter',
+             'rtmp': {'url': 'rtmp://live.example.edu/x',
+                      'stream': 'presenter', 'user': 'u', 'passwd': 'p'},
+             'layout': {'video': [{'type': 'source', 'position': [0, 0]}]}},
+            {'name': 'presentation'}],
+        'recorders': [
+            {'name': 'vod', 'channels': ['presenter', 'presentation'],
+             'settings': {'output_format': 'mp4',
+                          'recording_timelimit_in_minutes': 90,
+                          'afu_enabled': ''}}],
+        'mhpearl': {'device_name': 'golden', 'device_channel': 'vod',
+                    'admin_server_url': 'http://mh.example.edu',
+                    'update_frequency_in_seconds': '60'},
+        'ntp': {'server': 'pool.ntp.org', 'timezone': 'US/Eastern'},
+        'touchscreen': {'screen_timeout': 300}}
+
+
+class TestClone(object):
+
+    def setup_method(self, method):
+        self.fakes = [FakePearl(name='pearl%s' % i) for i in range(3)]
+        self.clients = [
+                Epipearl('http://pearl%s' % i, 'admin', 'secret',
+                         transport=fake.transport())
+                for (i, fake) in enumerate(self.fakes)]
+        provision(self.clients[0], spec)
+        self.clients[0].set_params('1', {'framesize': '1920x1080'})
+        self.golden = take_snapshot(self.clients[0])
+
+    def _assert_cloned(self, client):
+        changes = diff(self.golden, take_snapshot(client), names=True)
+        # mhcfg keeps the device name of the target
+        assert changes == [{'path': 'forms/mhcfg/DEVICE_NAME', 'a': 'golden',
+                            'b': ''}]
+
+    def test_clone(self):
+        result = clone(self.golden, self.clients[1])
+        self._assert_cloned(self.clients[1])
+        ops = [s['op'] for s in result['steps']]
+        assert ops.count('create_channel') == 2
+        assert 'set_channel_layout' in ops
+        assert sorted(result['ids']['channels']) == [
+                'channel 1', 'channel 2', 'presentation', 'presenter']
+
+        # translated ids: golden and target created channels in order
+        vod = self.fakes[1].recorders[result['ids']['recorders']['vod']]
+        assert sorted(vod['channels']) == sorted([
+            result['ids']['channels']['presenter'],
+            result['ids']['channels']['presentation']])
+        assert self.fakes[1].settings['mhcfg']['DEVICE_CHANNEL'] == \
+            result['ids']['recorders']['vod']
+
+        # nothing left to do
+        assert clone(self.golden, self.clients[1])['steps'] == []
+
+    def test_only_differences(self):
+        clone(self.golden, self.clients[1])
+        self.clients[1].set_params('1', {'framesize': '640x480'})
+        self.clients[1].set_touchscreen(screen_timeout=60)
+        plan = plan_clone(self.golden, take_snapshot(self.clients[1]))
+        assert plan['steps'] == [
+                {'op': 'set_params', 'channel': 'channel 1',
+                 'args': {'params': {'framesize': '1920x1080'}}},
+                {'op': 'set_touchscreen', 'args': {'screen_timeout': 300}}]
+
+    def test_ids_differ(self):
+        # target has channels named as in golden, with other ids
+        self.clients[1].delete_channel('1')
+        self.clients[1].create_channel('presentation')
+        self.clients[1].create_channel('channel 1')
+        result = clone(self.golden, self.clients[1], device_name='room-2')
+        assert result['ids']['channels']['presentation'] == '3'
+        self._assert_cloned_name(self.clients[1], 'room-2')
+
+    def _assert_cloned_name(self, client, name):
+        snap = take_snapshot(client)
+        assert snap['forms']['mhcfg']['DEVICE_NAME'] == name
+        snap['forms']['mhcfg']['DEVICE_NAME'] = 'golden'
+        assert diff(self.golden, snap, names=True) == []
+
+    def test_redacted_passwords(self):
+        # a redacted golden leaves the passwords of the target alone
+        self.clients[1].set_channel_rtmp(
+                '1', 'rtmp://live.example.edu/y', 'room-1', 'u1', 'p1')
+        clone(self.golden, self.clients[1])
+        rtmp = self.fakes[1].channels['1']['rtmp']
+        assert rtmp['rtmp_password'] == 'p1'
+        channel_id = [cid for (cid, c) in self.fakes[1].channels.items()
+                      if c['name'] == 'presenter'][0]
+        assert self.fakes[1].channels[channel_id]['rtmp'][
+            'rtmp_password'] == ''
+
+        # a golden client is read with its passwords
+        clone_fleet(self.clients[0], self.clients[2:])
+        channel_id = [cid for (cid, c) in self.fakes[2].channels.items()
+                      if c['name'] == 'presenter'][0]
+        assert self.fakes[2].channels[channel_id]['rtmp'][
+            'rtmp_password'] == 'p'
+
+    def test_afu_disabled(self):
+        # golden has auto-upload off, target has it on
+        golden = take_snapshot(self.clients[1])
+        self.clients[2].set_recorder_settings('1', afu_enabled='')
+        clone(golden, self.clients[2])
+        assert self.fakes[2].recorders['1']['settings']['afu_enabled'] == \
+            'on'
+
+    def test_duplicate_names(self):
+        # golden has two channels named 'dup', with different params
+        (a, b) = [self.fakes[0].add_channel('dup') for i in range(2)]
+        self.clients[0].set_params(a, {'framesize': '640x480'})
+        self.clients[0].set_params(b, {'framesize': '1024x768'})
+        golden = take_snapshot(self.clients[0])
+
+        # target has one 'dup', with another id
+        self.fakes[1].add_channel('other')
+        dup = self.fakes[1].add_channel('dup')
+        result = clone(golden, self.clients[1])
+        assert result['ids']['channels']['dup#%s' % a] == dup
+        assert {'op': 'create_channel', 'channel': 'dup#%s' % b,
+                'name': 'dup'} in result['steps']
+        dups = sorted(
+                (cid, c['params']['framesize'])
+                for (cid, c) in self.fakes[1].channels.items()
+                if c['name'] == 'dup')
+        assert [size for (cid, size) in dups] == ['640x480', '1024x768']
+        assert clone(golden, self.clients[1])['steps'] == []
+
+    def test_dry_run(self):
+        result = clone(self.golden, self.clients[1], dry_run=True)
+        assert result['steps']
+        assert result['ids']['channels'] == {'channel 1': '1',
+                                             'channel 2': '2'}
+        assert len(self.fakes[1].channels) == 2
+
+    def test_clone_fleet(self):
+        self.fakes[2].fail_next(1, status=500)
+        results = clone_fleet(self.clients[0], self.clients, concurrency=3)
+        assert results['http://pearl0']['steps'] == []
+        assert results['http://pearl1']['error'] is None
+        self._assert_cloned(self.clients[1])
+        assert results['http://pearl2']['error'].startswith('500')
+
+        # retry picks up where it failed
+        results = clone_fleet(self.golden, self.clients[2:])
+        assert results['http://pearl2']['error'] is None
+        self._assert_cloned(self.clients[2])
+
+
+class TestMhcfgForm(object):
+
+    def _snapshot(self, form):
+        return {'channels': {}, 'recorders': {'6': {'name': 'vod'}},
+                'forms': {'mhcfg': form}}
+
+    def test_device_page(self):
+        form = WebUiConfig._form_values(BeautifulSoup(
+            resp_datafile('set_mhpearl_settings', 'ok'), 'html.parser'))
+        plan = plan_clone(self._snapshot(form), self._snapshot({}),
+                          device_name='room-2')
+        assert plan['steps'] == [
+                {'op': 'set_mhpearl_settings', 'recorder': 'vod',
+                 'args': {'device_name': 'room-2',
+                          'file_search_range_in_seconds': '100',
+                          'admin_server_url': 'http://52.72.59.90:80',
+                          'admin_server_usr': 'jane',
+                          'admin_server_pwd': 'doe',
+                          'update_frequency_in_seconds': '122',
+                          'backup_agent': True}}]
+
+    def test_golden_without_mhcfg(self):
+        # an empty form must not wipe the settings of target
+        plan = plan_clone(self._snapshot({}), self._snapshot({}),
+                          device_name='room-2')
+        assert plan['steps'] == []
+
+
+class TestRecorderSettings(object):
+
+    def test_device_timelimits(self):
+        soup = BeautifulSoup(
+                resp_datafile('set_recorder_settings', 'ok'), 'html.parser')
+        archive = WebUiConfig._form_values(soup)
+        options = [o['value'] for o in soup.find(id='timelimit')('option')]
+        assert options[0] == '05:00'
+        minutes = []
+        for value in options:
+            archive['timelimit'] = value
+            minutes.append(
+                recorder_settings(archive)['recording_timelimit_in_minutes'])
+        assert minutes == [5, 10, 20, 30, 45, 60, 120, 180, 360]
+
+    def test_clone_sub_hour_timelimit(self):
+        fakes = [FakePearl(name='pearl%s' % i) for i in range(2)]
+        clients = [
+                Epipearl('http://pearl%s' % i, 'admin', 'secret',
+                         transport=fake.transport())
+                for (i, fake) in enumerate(fakes)]
+        clients[0].set_recorder_settings(
+                '1', recording_timelimit_in_minutes=45, output_format='mp4')
+        assert fakes[0].recorders['1']['settings']['timelimit'] == '45:00'
+        clone(take_snapshot(clients[0]), clients[1])
+        assert fakes[1].recorders['1']['settings']['timelimit'] == '45:00'
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_fakepearl
+----------------------------------
+
+Tests for `epipearl` fake device server, driven by the epipearl client.
+"""
+
+import os
+os.environ['TESTING'] = 'True'
+
+import hashlib
+import shutil
+import tempfile
+import threading
+import time
+
+import pytest
+import requests
+
+from epipearl import Epipearl
+from epipearl import SettingConfigError
+from epipearl.fakepearl import FakePearl
+from epipearl.fakepearl import FakePearlFleet
+from epipearl.fakepearl import _file_bytes
+from epipearl.fleet import clients_from_inventory
+from epipearl.fleet import map_concurrently
+
+
+class TestFakePearl(object):
+
+    def setup_method(self, method):
+        self.fake = FakePearl()
+        self.c = Epipearl('http://pearl', 'admin', 'secret',
+                          transport=self.fake.transport())
+        self.tmpdir = tempfile.mkdtemp()
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmpdir)
+
+    def test_params_and_infocfg(self):
+        assert self.c.set_params('1', {'publish_type': '6'})
+        assert self.c.get_params('1', {'publish_type': ''}) == \
+            {'publish_type': '6'}
+
+        channel_id = self.c.create_channel('lecture')
+        recorder_id = self.c.create_recorder('lecture rec')
+        infocfg = self.c.get_infocfg()
+        assert {'id': channel_id, 'name': 'lecture'} in infocfg['channels']
+        assert {'id': recorder_id, 'name': 'lecture rec'} in \
+            infocfg['recorders']
+
+        assert self.c.delete_channel(channel_id)
+        assert self.c.delete_recorder(recorder_id)
+        infocfg = self.c.get_infocfg()
+        assert channel_id not in [c['id'] for c in infocfg['channels']]
+        assert recorder_id not in [r['id'] for r in infocfg['recorders']]
+
+    def test_web_ui_forms(self):
+        assert self.c.set_channel_rtmp(
+                '1', 'rtmp://example.edu/live', 'stream', 'usr', 'pwd')
+        assert self.c.set_recorder_channels('1', ['2'])
+        assert self.fake.recorders['1']['channels'] == ['2']
+        assert self.c.set_recorder_settings(
+                '1', recording_timelimit_in_minutes=90,
+                recording_sizelimit_in_kbytes=1024, output_format='mp4')
+        assert self.c.set_mhpearl_settings(
+                device_name='room-101', device_channel='1',
+                file_search_range_in_seconds='60',
+                admin_server_url='http://mh.example.edu',
+                admin_server_usr='mh', admin_server_pwd='mhpwd')
+        assert self.c.set_ntp('pool.ntp.org', 'US/Eastern')
+        assert self.c.set_touchscreen(screen_timeout=300)
+
+    def test_unauthorized(self):
+        c = Epipearl('http://pearl', 'admin', 'wrong',
+                     transport=self.fake.transport())
+        with pytest.raises(requests.HTTPError) as e:
+            c.get_params('1', {'publish_type': ''})
+        assert e.value.response.status_code == 401
+
+    def test_recording_makes_archive_file(self):
+        before = self.c.get_sysinfo()['system']['data']['available']
+        assert self.c.set_params('m1', {'rec_enabled': 'on'})
+        sysinfo = self.c.get_sysinfo()
+        recorder = [ch for ch in sysinfo['channels'] if ch['id'] == 'm1'][0]
+        assert recorder['recorder']['enabled']
+        assert self.c.set_params('m1', {'rec_enabled': 'off'})
+
+        files = self.c.list_recorder_files('1')
+        assert len(files) == 1
+        assert self.c.get_sysinfo()['system']['data']['available'] < before
+
+        name = files[0]['name']
+        size = self.fake.recorders['1']['files'][0]['size']
+        dest = os.path.join(self.tmpdir, name)
+        result = self.c.download_recorder_file('1', name, dest)
+        assert result['size'] == size
+        assert result['hash'] == hashlib.sha256(
+                _file_bytes(name, 0, size)).hexdigest()
+
+        assert self.c.delete_recorder_file('1', name)
+        assert self.c.list_recorder_files('1') == []
+
+    def test_range_request(self):
+        self.fake.add_file('1', 'a.mp4', 5000)
+        r = self.c.get('/admin/recorder1/archive/a.mp4',
+                       extra_headers={'Range': 'bytes=4000-'})
+        assert r.status_code == 206
+        assert r.headers['content-range'] == 'bytes 4000-4999/5000'
+        assert r.content == _file_bytes('a.mp4', 0, 5000)[4000:]
+
+    def test_failures(self):
+        self.fake.fail_next(2, status=503)
+        for i in range(2):
+            with pytest.raises(requests.HTTPError):
+                self.c.get_sysinfo()
+        assert self.c.get_sysinfo()['system']['serial'] == 'fakepearl'
+        assert self.fake.stats == {'requests': 3, 'failures': 2}
+
+        flaky = FakePearl(failure_rate=1.0)
+        c = Epipearl('http://pearl', 'admin', 'secret',
+                     transport=flaky.transport())
+        with pytest.raises(requests.HTTPError):
+            c.get_sysinfo()
+
+    def test_set_config_error(self):
+        # device drops unknown channels, so the form check fails
+        with pytest.raises(SettingConfigError):
+            self.c.set_recorder_channels('1', ['1', '9'])
+
+    def test_serialized_requests(self):
+        fake = FakePearl(latency=0.05)
+        c = Epipearl('http://pearl', 'admin', 'secret',
+                     transport=fake.transport())
+        start = time.time()
+        threads = [threading.Thread(target=c.get_sysinfo) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert time.time() - start >= 0.2
+
+
+class TestFakePearlFleet(object):
+
+    def test_fleet_over_http(self):
+        with FakePearlFleet(5, latency=0.01) as fleet:
+            inventory = fleet.inventory()
+            assert len(set(d['url'] for d in inventory)) == 5
+            clients = clients_from_inventory(inventory)
+            results = dict(
+                    (c.url, (result, error)) for (c, result, error) in
+                    map_concurrently(
+                        lambda c: c.get_sysinfo()['system']['serial'],
+                        clients))
+            assert sorted(r for (r, e) in results.values()) == \
+                ['fakepearl%03d' % i for i in range(5)]
+
+            c = clients[0]
+            channel_id = c.create_channel('over http')
+            assert {'id': channel_id, 'name': 'over http'} in \
+                c.get_infocfg()['channels']
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_firmware
+----------------------------------
+
+Tests for `epipearl` firmware upload and fleet helpers.
+"""
+
+import os
+os.environ['TESTING'] = 'True'
+
+import shutil
+import tempfile
+
+import pytest
+import httpretty
+
+from conftest import resp_datafile
+from epipearl import Epipearl
+from epipearl import FirmwareUpdateError
+from epipearl.fakepearl import FakePearl
+from epipearl.fleet import TokenBucket
+from epipearl.fleet import map_concurrently
+from epipearl.fleet import update_firmware
+from epipearl.transfer import FirmwareImage
+from epipearl.transfer import MultipartFileBody
+
+epiphan_url = "http://fake.example.edu"
+epiphan_user = "user"
+epiphan_passwd = "passwd"
+
+
+def make_image(dirpath):
+    path = os.path.join(dirpath, 'pearl-3.16.0.bin')
+    with open(path, 'wb') as f:
+        f.write('\x00\x01pearlfw' * 10000)
+    return path
+
+
+@pytest.fixture
+def image_path(tmpdir):
+    return make_image(str(tmpdir))
+
+
+def read_all(body):
+    chunks = []
+    while True:
+        c = body.read(8192)
+        if not c:
+            break
+        chunks.append(c)
+    return ''.join(chunks)
+
+
+class TestFirmwareBody(object):
+
+    def test_multipart_body(self, image_path):
+        progress = []
+        with FirmwareImage(image_path) as image:
+            body = MultipartFileBody(
+                    image, fields={'fn': 'upgrade'}, chunk_size=1000,
+                    progress=lambda sent, total: progress.append(sent))
+            data = read_all(body)
+
+        assert len(data) == len(body)
+        assert progress[-1] == len(body)
+        assert max(b - a for (a, b) in zip([0] + progress, progress)) <= 1000
+        assert data.startswith('--%s\r\n' % body.boundary)
+        assert data.endswith('\r\n--%s--\r\n' % body.boundary)
+        assert 'name="fn"\r\n\r\nupgrade\r\n' in data
+        assert 'filename="pearl-3.16.0.bin"' in data
+        assert open(image_path, 'rb').read() in data
+
+    def test_shared_image(self, image_path):
+        with FirmwareImage(image_path) as image:
+            one = MultipartFileBody(image)
+            two = MultipartFileBody(image)
+            one.read(100)
+            assert read_all(two).count('pearlfw') == 10000
+            assert read_all(one).count('pearlfw') == 10000
+
+    def test_empty_image(self, tmpdir):
+        p = tmpdir.join('empty.bin')
+        p.write('')
+        with pytest.raises(ValueError):
+            FirmwareImage(str(p))
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=1000000, burst=10)
+        bucket.consume(5)
+        bucket.consume(5)
+        bucket.consume(1000)   # sleeps ~1ms, debt paid
+        assert bucket._tokens < 0
+
+    def test_map_concurrently(self):
+        def f(x):
+            if x == 3:
+                raise ValueError('three')
+            return x * 2
+        results = dict(
+                (i, (r, e)) for (i, r, e) in
+                map_concurrently(f, range(10), concurrency=4))
+        assert results[2] == (4, None)
+        assert isinstance(results[3][1], ValueError)
+        assert len(results) == 10
+
+
+class TestUpdateFirmware(object):
+
+    def setup_method(self, method):
+        self.c = Epipearl(epiphan_url, epiphan_user, epiphan_passwd)
+        self.tmpdir = tempfile.mkdtemp()
+        self.image_path = make_image(self.tmpdir)
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmpdir)
+
+    @httpretty.activate
+    def test_update_firmware_ok(self):
+        httpretty.register_uri(
+                httpretty.POST,
+                '%s/admin/firmwarecfg' % epiphan_url,
+                body='<html><body>upgrading...</body></html>')
+        httpretty.register_uri(
+                httpretty.GET,
+                '%s/admin/sysinfo.cgi' % epiphan_url,
+                body=resp_datafile('sysinfo', ext='json'))
+
+        version = self.c.update_firmware(
+                self.image_path, expected_version='3.15.3f',
+                verify_interval=0)
+        assert version == '3.15.3f'
+
+        upload = httpretty.HTTPretty.latest_requests[0]
+        assert upload.headers['Content-Type'].startswith(
+                'multipart/form-data; boundary=')
+        assert int(upload.headers['Content-Length']) > 90000
+
+    @httpretty.activate
+    def test_update_firmware_wrong_version(self):
+        httpretty.register_uri(
+                httpretty.POST,
+                '%s/admin/firmwarecfg' % epiphan_url,
+                body='<html><body>upgrading...</body></html>')
+        httpretty.register_uri(
+                httpretty.GET,
+                '%s/admin/sysinfo.cgi' % epiphan_url,
+                body=resp_datafile('sysinfo', ext='json'))
+
+        with pytest.raises(FirmwareUpdateError) as e:
+            self.c.update_firmware(
+                    self.image_path, expected_version='3.16.0',
+                    verify_timeout=0, verify_interval=0)
+        assert 'got(3.15.3f)' in e.value.message
+
+    @httpretty.activate
+    def test_fleet_update_firmware(self):
+        clients = []
+        for i in range(3):
+            url = 'http://fake%s.example.edu' % i
+            clients.append(Epipearl(url, epiphan_user, epiphan_passwd))
+            httpretty.register_uri(
+                    httpretty.POST, '%s/admin/firmwarecfg' % url,
+                    body='<html><body>upgrading...</body></html>',
+                    status=500 if i == 2 else 200)
+            httpretty.register_uri(
+                    httpretty.GET, '%s/admin/sysinfo.cgi' % url,
+                    body=resp_datafile('sysinfo', ext='json'))
+
+        progress = {}
+
+        def report(client, sent, total):
+            progress[client.url] = (sent, total)
+
+        results = update_firmware(
+                clients, self.image_path, expected_version='3.15.3f',
+                concurrency=2, bandwidth_limit=10 * 1024 * 1024,
+                progress=report, verify_interval=0)
+
+        assert results['http://fake0.example.edu']['firmware_version'] \
+            == '3.15.3f'
+        assert results['http://fake1.example.edu']['error'] is None
+        assert '500' in results['http://fake2.example.edu']['error']
+        (sent, total) = progress['http://fake0.example.edu']
+        assert sent == total
+
+
+class TestUpdateFirmwareFake(object):
+
+    def setup_method(self, method):
+        self.fake = FakePearl()
+        self.transport = self.fake.transport()
+        self.c = Epipearl('http://pearl', 'admin', 'secret',
+                          transport=self.transport)
+        self.tmpdir = tempfile.mkdtemp()
+        self.image_path = make_image(self.tmpdir)
+        self.timeouts = []
+        send = self.transport.send
+
+        def record(prepared, timeout=None, stream=False):
+            self.timeouts.append((prepared.method, timeout))
+            return send(prepared, timeout=timeout, stream=stream)
+        self.transport.send = record
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmpdir)
+
+    def test_waits_for_new_version(self):
+        reads = []
+
+        def sysinfo(request):
+            # old version until the device reboots on the 3rd read
+            reads.append(1)
+            if len(reads) == 3:
+                self.fake.firmware_version = '3.16.0'
+            return self.fake._sysinfo(request)
+        self.transport.route('admin/sysinfo.cgi', sysinfo)
+
+        version = self.c.update_firmware(self.image_path, verify_interval=0)
+        assert version == '3.16.0'
+        assert len(reads) == 3
+
+        # whole body read, with the long upload timeout
+        body = len(open(self.image_path, 'rb').read())
+        assert self.fake.firmware_uploads[0] > body > 64 * 1024
+        assert ('POST', (600, 600)) in self.timeouts
+
+    def test_version_unchanged(self):
+        with pytest.raises(FirmwareUpdateError) as e:
+            self.c.update_firmware(
+                    self.image_path, verify_timeout=0, verify_interval=0,
+                    upload_timeout=60)
+        assert 'other than 3.15.3f' in e.value.message
+        assert ('POST', (60, 60)) in self.timeouts
+
+    def test_fleet_upload_timeout(self):
+        results = update_firmware(
+                [self.c], self.image_path, expected_version='3.15.3f',
+                verify_interval=0, upload_timeout=1200)
+        assert results['http://pearl']['error'] is None
+        assert ('POST', (1200, 1200)) in self.timeouts
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_forecast
+----------------------------------
+
+Tests for `epipearl` disk capacity forecasting.
+"""
+
+import os
+os.environ['TESTING'] = 'True'
+
+import copy
+import json
+
+from conftest import resp_datafile
+from epipearl.forecast import DiskForecaster
+from epipearl.forecast import channel_write_rate
+
+
+class TestForecast(object):
+
+    def setup_method(self, method):
+        self.sysinfo = json.loads(resp_datafile('sysinfo', ext='json'))
+        self.f = DiskForecaster(smoothing=0.5)
+
+    def poll(self, device, t, available, recording=()):
+        s = copy.deepcopy(self.sysinfo)
+        s['time'] += t
+        s['system']['data']['available'] = available
+        for c in s['channels']:
+            c['recorder']['enabled'] = c['id'] in recording
+        return self.f.update(device, s)
+
+    def test_channel_write_rate(self):
+        c = self.sysinfo['channels'][2]
+        assert channel_write_rate(c) == (6467000 + 320000) / 8.0
+        assert channel_write_rate(self.sysinfo['channels'][4]) == 0.0
+
+    def test_idle_device_not_at_risk(self):
+        self.poll('idle', 0, 974922156)
+        self.poll('idle', 60, 974922156)
+        assert self.f.devices['idle'].hours_left() is None
+        assert self.f.at_risk(hours=24) == []
+
+    def test_recording_rate_and_observed_rate(self):
+        # recording channel 3 writes ~848kB/s; 930GiB lasts ~13.6 days
+        state = self.poll('rec', 0, 974922156, recording=('3',))
+        assert state.free == 974922156 * 1024
+        assert state.recording_rate == (6467000 + 320000) / 8.0
+        assert 326 < state.hours_left() < 328
+
+        # observed fill of 1GiB/s beats the bitrate estimate
+        self.poll('fast', 0, 974922156)
+        self.poll('fast', 10, 964922156)
+        state = self.poll('fast', 20, 954922156)
+        assert state.observed_rate == 1024000000.0
+        assert abs(state.hours_left() - 954922156 / 1e6 / 3600) < 1e-9
+
+        self.poll('idle', 0, 974922156)
+        assert [r['device'] for r in self.f.at_risk(hours=400)] == [
+                'fast', 'rec']
+        assert [r['device'] for r in self.f.at_risk(hours=1)] == ['fast']
+
+    def test_recorder_mapping_and_sizelimit(self):
+        # 1TB limit does not fit in 930GiB free
+        self.f.set_recorder(
+                'dev', '2', channel_ids=['1', '2'],
+                sizelimit_kbytes=1000000000)
+        state = self.poll('dev', 0, 974922156, recording=('m2',))
+        assert state.recording_rate == 2 * (3430000 + 160000) / 8.0
+
+        self.f.set_recorder('small', '2', sizelimit_kbytes=64000000)
+        self.poll('small', 0, 974922156)
+        risk = self.f.at_risk(hours=0)
+        assert [r['device'] for r in risk] == ['dev']
+        assert risk[0]['sizelimit_exceeds_free']
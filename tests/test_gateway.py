@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_gateway
+----------------------------------
+
+Tests for `epipearl` local caching gateway.
+"""
+
+import os
+os.environ['TESTING'] = 'True'
+
+import json
+import shutil
+import tempfile
+import threading
+import time
+
+import requests
+
+from epipearl.gateway import Gateway
+from epipearl.gateway import StaleWhileRevalidateCache
+from epipearl.state_cache import StateCache
+
+
+class FakeClient(object):
+
+    def __init__(self):
+        self.calls = []
+        self.params = {'publish_type': '0'}
+        self.lock = threading.Lock()
+
+    def _count(self, name):
+        with self.lock:
+            self.calls.append(name)
+
+    def get_infocfg(self):
+        self._count('infocfg')
+        return {'channels': [{'id': '1', 'name': 'one'}]}
+
+    def get_sysinfo(self):
+        self._count('sysinfo')
+        time.sleep(0.05)
+        return {'time': 1}
+
+    def get_params(self, channel, params):
+        self._count('get_params')
+        return dict((k, self.params.get(k, '')) for k in params)
+
+    def set_params(self, channel, params):
+        self._count('set_params')
+        self.params.update(params)
+        return True
+
+
+class TestCache(object):
+
+    def test_fresh_stale_and_expired(self):
+        cache = StaleWhileRevalidateCache(ttl=0.05, stale_ttl=0.2)
+        values = iter(range(10))
+
+        def fetch():
+            return next(values)
+        assert cache.get('k', fetch) == 0
+        assert cache.get('k', fetch) == 0
+        assert cache.hits == 1
+
+        time.sleep(0.07)
+        # stale: old value served, refreshed in background
+        assert cache.get('k', fetch) == 0
+        assert cache.stale_hits == 1
+        time.sleep(0.02)
+        assert cache.get('k', fetch) == 1
+
+        time.sleep(0.25)
+        assert cache.get('k', fetch) == 2
+        assert cache.misses == 2
+
+    def test_single_flight(self):
+        cache = StaleWhileRevalidateCache()
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            time.sleep(0.1)
+            return 'v'
+        results = []
+        threads = [threading.Thread(
+            target=lambda: results.append(cache.get('k', fetch)))
+            for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert results == ['v'] * 8
+        assert len(calls) == 1
+
+    def test_invalidate(self):
+        cache = StaleWhileRevalidateCache()
+        cache.get(('a', 1), lambda: 'a1')
+        cache.get(('b', 1), lambda: 'b1')
+        cache.invalidate(lambda k: k[0] == 'a')
+        assert cache.get(('a', 1), lambda: 'new') == 'new'
+        assert cache.get(('b', 1), lambda: 'new') == 'b1'
+
+    def test_invalidate_during_fetch(self):
+        # a read in flight when a write invalidates its key
+        cache = StaleWhileRevalidateCache()
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_fetch():
+            started.set()
+            release.wait()
+            return 'before write'
+        results = []
+        t = threading.Thread(
+                target=lambda: results.append(cache.get('k', slow_fetch)))
+        t.start()
+        started.wait()
+        cache.invalidate(lambda k: k == 'k')
+        assert cache.get('k', lambda: 'after write') == 'after write'
+        release.set()
+        t.join()
+
+        assert results == ['before write']
+        assert cache.get('k', lambda: 'refetched') == 'after write'
+
+    def test_invalidate_during_store(self):
+        # a write invalidates the key after the fetch, before its put
+        tmpdir = tempfile.mkdtemp()
+        try:
+            store = StateCache(os.path.join(tmpdir, 'state.db'))
+            cache = StaleWhileRevalidateCache(store=store)
+            put = store.put
+
+            def invalidated_put(*args, **kwargs):
+                cache.invalidate(lambda k: k[0] == 'a')
+                put(*args, **kwargs)
+            store.put = invalidated_put
+            assert cache.get(('a', 'status'), lambda: 'before write') == \
+                'before write'
+            assert store.get('a', '["status"]') is None
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_warm_start_from_store(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'state.db')
+            cache = StaleWhileRevalidateCache(store=StateCache(path))
+            cache.get(('a', 'status'), lambda: {'v': 1})
+            cache.get(('a', 'params', '1'), lambda: {'p': 1})
+            cache.invalidate(lambda k: k[1] == 'params')
+
+            # restarted: old value served at once, refreshed in background
+            calls = []
+
+            def fetch():
+                calls.append(1)
+                return {'v': 2}
+            cache = StaleWhileRevalidateCache(
+                    ttl=0, store=StateCache(path), store_max_age=3600)
+            assert cache.get(('a', 'status'), fetch) == {'v': 1}
+            assert cache.stale_hits == 1
+            time.sleep(0.05)
+            assert calls == [1]
+            assert StateCache(path).get('a', '["status"]')[0] == {'v': 2}
+            assert StateCache(path).get('a', '["params", "1"]') is None
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class TestGatewayServer(object):
+
+    def setup_method(self, method):
+        self.client = FakeClient()
+        self.gateway = Gateway({'pearl1': self.client}, ttl=30)
+        self.server = self.gateway.make_server('127.0.0.1', 0)
+        self.url = 'http://127.0.0.1:%s' % self.server.server_address[1]
+        t = threading.Thread(target=self.server.serve_forever)
+        t.daemon = True
+        t.start()
+
+    def teardown_method(self, method):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_reads_are_shared(self):
+        r = requests.get(self.url + '/devices')
+        assert r.json() == ['pearl1']
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            requests.get(self.url + '/devices/pearl1/status').json()))
+            for i in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert results == [{'time': 1}] * 5
+        assert self.client.calls.count('sysinfo') == 1
+
+        r = requests.get(self.url + '/devices/pearl1/inventory')
+        assert r.json()['channels'][0]['name'] == 'one'
+
+    def test_write_invalidates_params(self):
+        path = self.url + '/devices/pearl1/params/1?keys=publish_type'
+        assert requests.get(path).json() == {'publish_type': '0'}
+        assert requests.get(path).json() == {'publish_type': '0'}
+        assert self.client.calls.count('get_params') == 1
+
+        r = requests.post(
+                self.url + '/devices/pearl1/params/1',
+                data=json.dumps({'publish_type': '6'}))
+        assert r.json() == {'ok': True}
+        assert requests.get(path).json() == {'publish_type': '6'}
+        assert self.client.calls.count('get_params') == 2
+
+    def test_unknown_device(self):
+        r = requests.get(self.url + '/devices/nope/status')
+        assert r.status_code == 404
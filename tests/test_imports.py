@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_imports
+----------------------------------
+
+Tests for `epipearl` import time, which short-lived pollers pay each run.
+"""
+
+import os
+os.environ['TESTING'] = 'True'
+
+import json
+import subprocess
+import sys
+
+import pytest
+
+from epipearl.epipearl import default_useragent
+
+# seconds `import epipearl` and its command line may take on top of
+# importing requests, which they need anyway; generous, so only real
+# regressions fail
+_import_budget = 0.15
+
+benchtest = pytest.mark.skipif(
+        not pytest.config.getoption("--runbench"),
+        reason="need --runbench option to run")
+
+_probe = '''
+import json, sys, time
+start = time.time()
+import requests
+requests_done = time.time()
+import epipearl
+import epipearl.cli
+modules = sorted(sys.modules)
+client = epipearl.Epipearl('http://pearl', 'admin', 'secret')
+done = time.time()
+print(json.dumps({
+    'requests': requests_done - start,
+    'epipearl': done - requests_done,
+    'modules': modules}))
+'''
+
+
+def _cold_import():
+    out = subprocess.check_output(
+            [sys.executable, '-c', _probe],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return json.loads(out.decode('utf-8').strip().splitlines()[-1])
+
+
+class TestImports(object):
+
+    def test_web_ui_is_not_imported(self):
+        modules = _cold_import()['modules']
+        for m in ('bs4', 'platform', 'cProfile', 'mmap',
+                  'epipearl.endpoints.webui_channel',
+                  'epipearl.endpoints.webui_config',
+                  'epipearl.endpoints.webui_mhpearl',
+                  'epipearl.preview', 'epipearl.transfer'):
+            assert m not in modules
+
+    @benchtest
+    def test_import_budget(self):
+        # best of a few runs, to ignore a busy machine
+        best = min(_cold_import()['epipearl'] for i in range(3))
+        assert best < _import_budget
+
+    def test_useragent_is_cached(self):
+        assert default_useragent() is default_useragent()
+        assert default_useragent().startswith('epipearl.epipearl/')
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_loadtest
+----------------------------------
+
+Tests for `epipearl` fleet load harness.
+"""
+
+import os
+os.environ['TESTING'] = 'True'
+
+import pytest
+
+from epipearl.loadtest import OpRecorder
+from epipearl.loadtest import format_report
+from epipearl.loadtest import run_load
+from epipearl.stats import percentile
+
+
+class TestLoadHarness(object):
+
+    def test_percentile(self):
+        values = range(1, 101)
+        assert percentile(values, 50) == 50
+        assert percentile(values, 95) == 95
+        assert percentile(values, 99) == 99
+        assert percentile(values, 100) == 100
+        assert percentile([3.0], 99) == 3.0
+        assert percentile([], 50) is None
+
+    def test_op_recorder(self):
+        rec = OpRecorder()
+        assert rec.timed('ok', lambda: 1) == 1
+
+        def boom():
+            raise ValueError('boom')
+        with pytest.raises(ValueError):
+            rec.timed('bad', boom)
+        rec.count_request('a')
+        rec.count_request('a')
+        rec.count_request('b')
+
+        summary = rec.summary()
+        assert summary['ops']['ok']['count'] == 1
+        assert summary['ops']['bad']['errors'] == {'ValueError': 1}
+        assert summary['requests_total'] == 3
+        assert summary['requests_per_device'] == {
+                'min': 1, 'max': 2, 'mean': 1.5}
+
+    def test_provision_in_memory(self):
+        report = run_load('provision', 6, concurrency=3)
+        assert report['devices'] == 6
+        assert report['failed_devices'] == []
+        assert report['ops']['create_channel']['count'] == 12
+        assert report['ops']['set_ntp']['count'] == 6
+        # add (redirect followed in the same call) + rename for two
+        # channels and a recorder, plus one request per form
+        assert report['requests_per_device']['min'] == 13
+        assert report['makespan'] > 0
+        assert report['peak_rss_bytes'] >= report['rss_growth_bytes'] >= 0
+        assert 'create_channel' in format_report(report)
+
+    def test_failures_are_reported(self):
+        report = run_load('ntp', 10, concurrency=4, failure_rate=1.0)
+        assert len(report['failed_devices']) == 10
+        assert report['ops']['set_ntp']['errors'] == {'HTTPError': 10}
+
+    def test_poll_over_http(self):
+        report = run_load(
+                'poll', 3, concurrency=3, mode='http', latency=0.001,
+                rounds=2)
+        assert report['failed_devices'] == []
+        assert report['ops']['get_sysinfo']['count'] == 6
+        # 2 channels per fake device
+        assert report['ops']['get_params']['count'] == 12
+        assert report['requests_per_device']['max'] == 1 + 2 * 3
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_metrics
+----------------------------------
+
+Tests for `epipearl` per device and per operation metrics.
+"""
+
+import os
+os.environ['TESTING'] = 'True'
+
+import pytest
+import requests
+
+from epipearl import Epipearl
+from epipearl.endpoints.webui_channel import WebUiChannel
+from epipearl.fakepearl import FakePearl
+from epipearl.metrics import Histogram
+from epipearl.metrics import Metrics
+from epipearl.metrics import current_operation
+from epipearl.metrics import operation
+
+
+class TestHistogram(object):
+
+    def test_cumulative(self):
+        h = Histogram((1, 5, 10))
+        for v in (0.5, 1, 3, 7, 20):
+            h.observe(v)
+        assert h.cumulative() == [
+                (1, 2), (5, 3), (10, 4), (float('inf'), 5)]
+        assert h.sum == 31.5
+        assert h.as_dict()['buckets'][-1] == ['+Inf', 5]
+
+
+class TestMetrics(object):
+
+    def setup_method(self, method):
+        self.fake = FakePearl()
+        self.metrics = Metrics()
+        self.c = Epipearl('http://pearl', 'admin', 'secret',
+                          transport=self.fake.transport(),
+                          metrics=self.metrics)
+
+    def _series(self, op):
+        return [s for s in self.metrics.snapshot() if s['operation'] == op]
+
+    def test_operations_are_named(self):
+        self.c.get_params('1', {'publish_type': ''})
+        self.c.get_infocfg()
+        self.c.set_channel_rtmp('1', 'rtmp://x', 'stream', 'usr', 'pwd')
+        self.c.create_channel('new')
+        self.c.get('admin/sysinfo.cgi')
+
+        ops = sorted(s['operation'] for s in self.metrics.snapshot())
+        assert ops == ['create_channel', 'get', 'get_infocfg', 'get_params',
+                       'set_channel_rtmp']
+        # add and rename are accounted to the workflow
+        assert self._series('create_channel')[0]['requests'] == 2
+        infocfg = self._series('get_infocfg')[0]
+        assert infocfg['device'] == 'http://pearl'
+        assert infocfg['requests'] == 1
+        assert infocfg['bytes']['count'] == 1
+        assert infocfg['bytes']['sum'] > 0
+        assert infocfg['parse']['count'] == 1
+        assert self._series('get_params')[0]['parse']['count'] == 1
+        assert current_operation() is None
+
+    def test_errors_by_class(self):
+        self.fake.fail_next(1, status=500)
+        with pytest.raises(requests.HTTPError):
+            self.c.get_sysinfo()
+        self.c.get_sysinfo()
+        s = self._series('get_sysinfo')[0]
+        assert s['requests'] == 2
+        assert s['errors'] == {'HTTPError': 1}
+
+    def test_prometheus_text(self):
+        self.fake.fail_next(1, status=500)
+        with pytest.raises(requests.HTTPError):
+            self.c.get_infocfg()
+        self.c.get_infocfg()
+        text = self.metrics.prometheus_text()
+        assert '# TYPE epipearl_requests_total counter' in text
+        assert 'epipearl_requests_total{device="http://pearl",' \
+            'operation="get_infocfg"} 2' in text
+        assert 'epipearl_request_errors_total{device="http://pearl",' \
+            'error="HTTPError",operation="get_infocfg"} 1' in text
+        assert 'epipearl_request_duration_seconds_bucket{' \
+            'device="http://pearl",le="+Inf",operation="get_infocfg"} 2' \
+            in text
+        assert 'epipearl_parse_duration_seconds_count{' \
+            'device="http://pearl",operation="get_infocfg"} 1' in text
+        assert text.endswith('\n')
+
+    def test_disabled(self):
+        seen = []
+
+        class Probe(object):
+            @classmethod
+            @operation('probe')
+            def call(cls, client):
+                seen.append(current_operation())
+
+        Probe.call(client=self.c)
+        c = Epipearl('http://pearl', 'admin', 'secret',
+                     transport=self.fake.transport())
+        Probe.call(c)
+        assert seen == ['probe', None]
+
+        WebUiChannel.get_infocfg(client=c)
+        assert c.metrics is None
+        assert self.metrics.snapshot() == []
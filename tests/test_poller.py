@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_poller
+----------------------------------
+
+Tests for `epipearl` status poller.
+"""
+
+import os
+os.environ['TESTING'] = 'True'
+
+import heapq
+import threading
+import time
+
+import httpretty
+
+from epipearl import Epipearl
+from epipearl.poller import Poller
+from epipearl.poller import PollTarget
+
+epiphan_url = "http://fake.example.edu"
+epiphan_user = "user"
+epiphan_passwd = "passwd"
+
+
+class TestPoller(object):
+
+    def test_next_interval(self):
+        p = Poller(min_interval=1, max_interval=8, speedup=0.5, slowdown=2)
+        t = PollTarget('k', 'dev', None, interval=4)
+        assert p.next_interval(t, changed=True) == 2
+        assert p.next_interval(t, changed=False) == 8
+        t.interval = 8
+        assert p.next_interval(t, changed=False) == 8
+        t.interval = 1
+        assert p.next_interval(t, changed=True) == 1
+
+    def test_adaptive_polling(self):
+        counter = {'n': 0}
+
+        def changing():
+            counter['n'] += 1
+            return {'rec_enabled': str(counter['n'])}
+
+        def stable():
+            return {'rec_enabled': 'on'}
+
+        # runs due reads in order on a fake clock, without threads
+        clock = {'now': 1000.0}
+        p = Poller(min_interval=1, max_interval=16, interval=4,
+                   slowdown=1.5, speedup=0.5, jitter=0,
+                   clock=lambda: clock['now'], spread=False)
+        fast = p.add('fast', 'dev1', changing)
+        slow = p.add('slow', 'dev2', stable)
+        polls = {'fast': [], 'slow': []}
+        while p._heap[0][0] <= 1060:
+            (due, seq, target) = heapq.heappop(p._heap)
+            clock['now'] = due
+            polls[target.key].append(due)
+            p._inflight[target.device] = 1
+            p._poll(target)
+
+        # first read is unchanged; then fast speeds up, slow backs off
+        assert polls['slow'] == [1000, 1006, 1015, 1028.5, 1044.5]
+        assert polls['fast'][:5] == [1000, 1006, 1009, 1010.5, 1011.5]
+        assert len(polls['fast']) == 53
+        assert fast.interval == 1
+        assert slow.interval == 16
+        assert slow.changes == 0
+        assert fast.changes == fast.polls - 1
+
+    def test_first_reads_spread(self):
+        p = Poller(interval=10, clock=lambda: 1000.0)
+        targets = [p.add(i, 'dev%s' % i, dict) for i in range(1000)]
+        dues = sorted(t.due for t in targets)
+        assert 1000 <= dues[0] and dues[-1] < 1010
+        # not bunched: every second of the interval has first reads
+        assert set(int(due) for due in dues) == set(range(1000, 1010))
+
+    def test_per_device_limit(self):
+        state = {'inflight': 0, 'max': 0}
+        lock = threading.Lock()
+
+        def fetch():
+            with lock:
+                state['inflight'] += 1
+                state['max'] = max(state['max'], state['inflight'])
+            time.sleep(0.02)
+            with lock:
+                state['inflight'] -= 1
+            return {}
+
+        p = Poller(min_interval=0.01, interval=0.01, per_device=2,
+                   concurrency=8)
+        targets = [p.add(i, 'samedevice', fetch) for i in range(6)]
+        p.start()
+        time.sleep(0.3)
+        p.stop()
+
+        assert state['max'] == 2
+        assert all(t.polls > 0 for t in targets)
+
+    def test_errors_and_remove(self):
+        errors = []
+
+        def broken():
+            raise ValueError('device down')
+
+        p = Poller(min_interval=0.01, interval=0.01, slowdown=1,
+                   on_error=lambda t, e: errors.append(t.key))
+        t = p.add('broken', 'dev', broken)
+        p.start()
+        time.sleep(0.1)
+        p.remove('broken')
+        n = len(errors)
+        time.sleep(0.1)
+        p.stop()
+
+        assert n > 0
+        assert len(errors) <= n + 1
+        assert t.errors == len(errors)
+        assert 'broken' not in p.targets
+
+    @httpretty.activate
+    def test_add_params(self):
+        httpretty.register_uri(
+                httpretty.GET,
+                '%s/admin/channel1/get_params.cgi' % epiphan_url,
+                body='rec_enabled = on\npublish_type = 6')
+        c = Epipearl(epiphan_url, epiphan_user, epiphan_passwd)
+        seen = []
+
+        p = Poller(callback=lambda t, v, prev: seen.append((t.key, v)),
+                   concurrency=1, spread=False)
+        p.add_params(c, '1', ['rec_enabled', 'publish_type'])
+        p.start()
+        time.sleep(0.1)
+        p.stop()
+
+        assert seen[0] == ((epiphan_url, '1'), {
+            'rec_enabled': 'on', 'publish_type': '6'})
+        path = httpretty.last_request().path
+        assert 'publish_type=' in path and 'rec_enabled=' in path
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_preview
+----------------------------------
+
+Tests for `epipearl` channel preview grabber.
+"""
+
+import os
+os.environ['TESTING'] = 'True'
+
+import io
+import StringIO
+import threading
+import time
+
+from Queue import Queue
+
+import pytest
+import httpretty
+
+from epipearl import Epipearl
+from epipearl import TransferError
+from epipearl.fakepearl import FakePearl
+from epipearl.preview import BufferPool
+from epipearl.preview import PreviewGrabber
+from epipearl.preview import grab_frame
+from epipearl.preview import read_into
+
+epiphan_url = "http://fake.example.edu"
+epiphan_user = "user"
+epiphan_passwd = "passwd"
+
+
+def serve_preview(request, uri, headers):
+    channel = request.querystring['channel'][0]
+    headers['content-type'] = 'image/jpeg'
+    return (200, headers, 'jpeg-of-channel-%s' % channel)
+
+
+class TestPreview(object):
+
+    def setup_method(self, method):
+        self.c = Epipearl(epiphan_url, epiphan_user, epiphan_passwd)
+
+    @httpretty.activate
+    def test_get_preview(self):
+        httpretty.register_uri(
+                httpretty.GET, '%s/preview.cgi' % epiphan_url,
+                body=serve_preview)
+
+        buf = bytearray(1024)
+        frame = self.c.get_preview('3', buf=buf)
+        assert frame.data.tobytes() == 'jpeg-of-channel-3'
+        assert frame.content_type == 'image/jpeg'
+        assert frame._buf is buf
+
+    @httpretty.activate
+    def test_grab_frame_grows_buffer(self):
+        httpretty.register_uri(
+                httpretty.GET, '%s/preview.cgi' % epiphan_url,
+                body='x' * 5000)
+
+        pooled = bytearray(100)
+        (buf, size, ctype) = grab_frame(self.c, '1', pooled)
+        assert size == 5000
+        assert buf is pooled
+        assert len(buf) == 5000
+        assert buf[:size] == 'x' * 5000
+
+    def test_read_into(self):
+        assert read_into(io.BytesIO('abc'), bytearray(10)) == 3
+        buf = bytearray(10)
+        assert read_into(StringIO.StringIO('abcdef'), buf) == 6
+        assert buf[:6] == 'abcdef'
+        with pytest.raises(TransferError):
+            read_into(io.BytesIO('x' * 11), bytearray(10))
+
+    def test_grabber_reuses_buffers(self):
+        # fake devices, as httpretty mixes up responses across threads
+        clients = []
+        for i in range(4):
+            clients.append(Epipearl(
+                'http://fake%s.example.edu' % i, 'admin', 'secret',
+                transport=FakePearl(name='fake%s' % i).transport()))
+
+        seen = {}
+        buffers = set()
+        lock = threading.Lock()
+
+        def callback(frame):
+            with lock:
+                seen[(frame.client.url, frame.channel)] = \
+                    frame.data.tobytes()
+                buffers.add(id(frame._buf))
+
+        targets = [(c, str(ch)) for c in clients for ch in (1, 2)]
+        grabber = PreviewGrabber(
+                targets, rate=50, concurrency=2, callback=callback,
+                frame_size=1024).start()
+        time.sleep(0.3)
+        grabber.stop()
+
+        assert len(seen) == 8
+        assert seen[('http://fake1.example.edu', '2')] == \
+            '\xff\xd8' + 'preview 2 ' * 64 + '\xff\xd9'
+        assert len(buffers) <= 4   # pool of concurrency * 2
+        assert grabber.errors == 0
+
+    @httpretty.activate
+    def test_grabber_iterator(self):
+        httpretty.register_uri(
+                httpretty.GET, '%s/preview.cgi' % epiphan_url,
+                body=serve_preview)
+
+        grabber = PreviewGrabber(
+                [(self.c, '1')], rate=100, concurrency=1, pool_size=2)
+        frames = []
+        for frame in grabber:
+            frames.append(frame.data.tobytes())
+            if len(frames) == 5:
+                break
+        grabber.stop()
+        assert frames == ['jpeg-of-channel-1'] * 5
+
+    @httpretty.activate
+    def test_grabber_skips_pending_targets(self):
+        def slow_preview(request, uri, headers):
+            time.sleep(0.05)
+            return serve_preview(request, uri, headers)
+        httpretty.register_uri(
+                httpretty.GET, '%s/preview.cgi' % epiphan_url,
+                body=slow_preview)
+
+        queued = []
+
+        class CountingQueue(Queue):
+            def put(self, item, *args, **kwargs):
+                queued.append(item)
+                Queue.put(self, item, *args, **kwargs)
+
+        # asks for 200 grabs/s of 3 channels; one thread does ~20
+        grabber = PreviewGrabber(
+                [(self.c, str(ch)) for ch in range(3)], rate=200,
+                concurrency=1, callback=lambda frame: None)
+        due = CountingQueue()
+        grabber._threads = [
+                threading.Thread(target=grabber._schedule, args=(due,)),
+                threading.Thread(target=grabber._grab, args=(due,))]
+        for t in grabber._threads:
+            t.start()
+        time.sleep(0.3)
+        grabber.stop()
+
+        assert due.qsize() <= 3
+        assert len(queued) < 20
+        assert sorted(set(queued)) == [0, 1, 2]
+
+    def test_buffer_pool(self):
+        pool = BufferPool(2, size=10)
+        a = pool.acquire()
+        b = pool.acquire()
+        assert len(a) == 10 and a is not b
+        pool.release(a)
+        assert pool.acquire() is a
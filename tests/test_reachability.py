@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_reachability
+----------------------------------
+
+Tests for `epipearl` connect timeouts and negative cache of unreachable
+devices.
+"""
+
+import os
+os.environ['TESTING'] = 'True'
+
+import pytest
+import requests
+import socket
+import threading
+import time
+
+from urllib3.exceptions import NewConnectionError
+from urllib3.exceptions import ProtocolError
+
+from epipearl import Epipearl
+from epipearl.errors import DeviceUnreachableError
+from epipearl.reachability import NegativeCache
+from epipearl.reachability import probe_connect
+from epipearl.transport import MemoryTransport
+
+
+class FlakyTransport(MemoryTransport):
+    """refuses connections while down, or raises error if set; records
+    timeouts."""
+
+    def __init__(self):
+        MemoryTransport.__init__(self, app=lambda request: (
+            200, {}, 'publish_type = 6\n'))
+        self.down = False
+        self.error = None
+        self.sent = 0
+        self.timeouts = []
+
+    def send(self, prepared, timeout=None, stream=False):
+        self.sent += 1
+        self.timeouts.append(timeout)
+        if self.down:
+            raise requests.ConnectionError(
+                    NewConnectionError(None, 'connection refused'))
+        if self.error is not None:
+            raise self.error
+        return MemoryTransport.send(self, prepared, timeout, stream)
+
+
+class TestTimeouts(object):
+
+    def test_connect_and_read_timeouts(self):
+        t = FlakyTransport()
+        Epipearl('http://pearl', 'admin', 'secret',
+                 transport=t).get_params('1')
+        Epipearl('http://pearl', 'admin', 'secret', transport=t,
+                 timeout=30, connect_timeout=0.5).get_params('1')
+        Epipearl('http://pearl', 'admin', 'secret', transport=t,
+                 timeout=1).get_params('1')
+        assert t.timeouts == [(2, 5), (0.5, 30), (1, 1)]
+
+
+class TestNegativeCache(object):
+
+    def setup_method(self, method):
+        self.up = False
+        self.cache = NegativeCache(
+                window=0.2, reprobe_interval=None, probe=lambda url: self.up)
+        self.t = FlakyTransport()
+        self.c = Epipearl('http://pearl', 'admin', 'secret',
+                          transport=self.t, negative_cache=self.cache)
+
+    def test_fail_fast_within_window(self):
+        self.t.down = True
+        with pytest.raises(requests.ConnectionError):
+            self.c.get_params('1')
+        assert self.cache.unreachable() == ['http://pearl']
+        with pytest.raises(DeviceUnreachableError) as e:
+            self.c.get_params('1')
+        assert 'ConnectionError: None: connection refused' in str(e.value)
+        assert self.t.sent == 1
+
+        # window over: one call goes through, and clears the device
+        time.sleep(0.25)
+        self.t.down = False
+        assert self.c.get_params('1') == {'publish_type': '6'}
+        assert self.cache.unreachable() == []
+
+    def test_other_errors_are_not_cached(self):
+        self.t.route('/admin/channel1/get_params.cgi',
+                     lambda request: (500, {}, 'oops'))
+        for i in range(2):
+            with pytest.raises(requests.HTTPError):
+                self.c.get_params('1')
+        assert self.t.sent == 2
+
+        # connected, then reset mid-response
+        self.t.error = requests.ConnectionError(
+                ProtocolError('Connection aborted.'))
+        for i in range(2):
+            with pytest.raises(requests.ConnectionError):
+                self.c.get_params('1')
+        assert self.t.sent == 4
+        assert self.cache.unreachable() == []
+
+    def test_connect_timeout_is_cached(self):
+        self.t.error = requests.ConnectTimeout('timed out')
+        with pytest.raises(requests.ConnectTimeout):
+            self.c.get_params('1')
+        assert self.cache.unreachable() == ['http://pearl']
+
+    def test_reprobe_clears(self):
+        self.cache = NegativeCache(
+                window=60, reprobe_interval=0.02, probe=lambda url: self.up)
+        self.c.negative_cache = self.cache
+        self.t.down = True
+        with pytest.raises(requests.ConnectionError):
+            self.c.get_params('1')
+        time.sleep(0.05)
+        with pytest.raises(DeviceUnreachableError):
+            self.c.get_params('1')
+
+        self.up = True
+        self.t.down = False
+        time.sleep(0.2)
+        assert self.cache.unreachable() == []
+        assert self.c.get_params('1') == {'publish_type': '6'}
+
+    def test_reprobe_backs_off_and_stops(self):
+        probes = []
+        cache = NegativeCache(
+                window=0.4, reprobe_interval=0.02,
+                probe=lambda url: probes.append(time.time()))
+        cache.failed('http://pearl', Exception('refused'))
+        time.sleep(0.6)
+        # probes at ~0, .04, .12, .28: then the window is over
+        assert 3 <= len(probes) <= 5
+        gaps = [b - a for (a, b) in zip(probes, probes[1:])]
+        assert gaps == sorted(gaps)
+        assert cache._failed == {}
+        assert cache._prober is None
+
+    def test_reprobe_in_parallel(self):
+        probed = []
+        lock = threading.Lock()
+
+        def slow_probe(url):
+            time.sleep(0.2)
+            with lock:
+                probed.append(url)
+            return True
+        cache = NegativeCache(window=60, reprobe_interval=0.01,
+                              probe=slow_probe)
+        for i in range(5):
+            cache.failed('http://pearl%s' % i, Exception('refused'))
+        time.sleep(0.4)
+        assert len(probed) == 5
+        assert cache.unreachable() == []
+
+    def test_probe_connect(self):
+        s = socket.socket()
+        s.bind(('127.0.0.1', 0))
+        s.listen(1)
+        url = 'http://127.0.0.1:%s' % s.getsockname()[1]
+        assert probe_connect(url)
+        s.close()
+        assert not probe_connect(url, timeout=0.5)
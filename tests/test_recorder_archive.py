@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_recorder_archive
+----------------------------------
+
+Tests for `epipearl` recorder archive listing and downloads.
+"""
+
+import os
+os.environ['TESTING'] = 'True'
+
+import hashlib
+import json
+import re
+import shutil
+import tempfile
+
+import pytest
+import httpretty
+
+from conftest import resp_datafile
+from epipearl import Epipearl
+from epipearl import TransferError
+
+epiphan_url = "http://fake.example.edu"
+epiphan_user = "user"
+epiphan_passwd = "passwd"
+
+recording = ''.join(chr(i % 251) for i in range(300000))
+recording_path = \
+    '/admin/recorder2/archive/recorder2_2016-06-03_14-00-01.mp4'
+
+
+def serve_range(content, ranges_seen):
+    """httpretty callback that honors `Range: bytes=N-` headers."""
+    def f(request, uri, headers):
+        rng = request.headers.get('Range')
+        ranges_seen.append(rng)
+        if rng is None:
+            headers['content-length'] = str(len(content))
+            return (200, headers, content)
+        start = int(re.match(r'bytes=(\d+)-', rng).group(1))
+        if start >= len(content):
+            return (416, headers, '')
+        headers['content-range'] = 'bytes %d-%d/%d' % (
+                start, len(content) - 1, len(content))
+        headers['content-length'] = str(len(content) - start)
+        return (206, headers, content[start:])
+    return f
+
+
+class TestRecorderArchive(object):
+
+    def setup_method(self, method):
+        self.c = Epipearl(epiphan_url, epiphan_user, epiphan_passwd)
+        self.tmpdir = tempfile.mkdtemp()
+        self.dest = os.path.join(self.tmpdir, 'rec.mp4')
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmpdir)
+
+    @httpretty.activate
+    def test_list_recorder_files(self):
+        httpretty.register_uri(
+                httpretty.GET,
+                '%s/admin/recorder2/archive' % epiphan_url,
+                body=resp_datafile('get_recorder_archive', 'ok'))
+
+        files = self.c.list_recorder_files(recorder_id='2')
+        assert len(files) == 3
+        assert files[0] == {
+                'name': 'recorder2_2016-06-03_14-00-01.mp4',
+                'path': recording_path,
+                'size': int(1.5 * 1024 ** 3)}
+        assert files[1]['size'] == int(812.4 * 1024 ** 2)
+        assert files[2]['size'] == 2048
+
+    @httpretty.activate
+    def test_list_recorder_files_empty(self):
+        httpretty.register_uri(
+                httpretty.GET,
+                '%s/admin/recorder2/archive' % epiphan_url,
+                body=resp_datafile('set_recorder_settings', 'ok'))
+
+        assert self.c.list_recorder_files(recorder_id='2') == []
+
+    @httpretty.activate
+    def test_download_full(self):
+        seen = []
+        httpretty.register_uri(
+                httpretty.GET, '%s%s' % (epiphan_url, recording_path),
+                body=serve_range(recording, seen))
+        progress = []
+
+        result = self.c.download_recorder_file(
+                recorder_id='2',
+                filename='recorder2_2016-06-03_14-00-01.mp4',
+                dest=self.dest,
+                progress=lambda done, total: progress.append((done, total)))
+
+        assert seen == [None]
+        assert result['size'] == len(recording)
+        assert result['hash'] == hashlib.sha256(recording).hexdigest()
+        assert open(self.dest, 'rb').read() == recording
+        assert progress[-1] == (len(recording), len(recording))
+        assert not os.path.exists(self.dest + '.part')
+        assert not os.path.exists(self.dest + '.part.json')
+
+    @httpretty.activate
+    def test_download_resume(self):
+        seen = []
+        httpretty.register_uri(
+                httpretty.GET, '%s%s' % (epiphan_url, recording_path),
+                body=serve_range(recording, seen))
+        # simulate an interrupted download: preallocated part file with
+        # the first 100000 bytes committed
+        with open(self.dest + '.part', 'wb') as f:
+            f.write(recording[:100000] + '\0' * (len(recording) - 100000))
+        with open(self.dest + '.part.json', 'w') as f:
+            json.dump({'offset': 100000, 'total': len(recording)}, f)
+
+        result = self.c.download_recorder_file(
+                recorder_id='2',
+                filename='recorder2_2016-06-03_14-00-01.mp4',
+                dest=self.dest, hash_name='md5')
+
+        assert seen == ['bytes=100000-']
+        assert result['hash'] == hashlib.md5(recording).hexdigest()
+        assert open(self.dest, 'rb').read() == recording
+
+    @httpretty.activate
+    def test_download_resume_already_complete(self):
+        seen = []
+        httpretty.register_uri(
+                httpretty.GET, '%s%s' % (epiphan_url, recording_path),
+                body=serve_range(recording, seen))
+        with open(self.dest + '.part', 'wb') as f:
+            f.write(recording)
+        with open(self.dest + '.part.json', 'w') as f:
+            json.dump({'offset': len(recording), 'total': len(recording)}, f)
+
+        result = self.c.download_recorder_file(
+                recorder_id='2',
+                filename='recorder2_2016-06-03_14-00-01.mp4',
+                dest=self.dest)
+
+        assert seen == ['bytes=%d-' % len(recording)]
+        assert result['size'] == len(recording)
+        assert result['hash'] == hashlib.sha256(recording).hexdigest()
+
+    @httpretty.activate
+    def test_download_truncated(self):
+        def short(request, uri, headers):
+            headers['content-length'] = str(len(recording))
+            return (200, headers, recording[:1000])
+        httpretty.register_uri(
+                httpretty.GET, '%s%s' % (epiphan_url, recording_path),
+                body=short)
+
+        with pytest.raises(TransferError):
+            self.c.download_recorder_file(
+                    recorder_id='2',
+                    filename='recorder2_2016-06-03_14-00-01.mp4',
+                    dest=self.dest)
+        assert not os.path.exists(self.dest)
+        state = json.load(open(self.dest + '.part.json'))
+        assert state['offset'] <= 1000
+        assert state['total'] == len(recording)
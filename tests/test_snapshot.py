@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_snapshot
+----------------------------------
+
+Tests for `epipearl` configuration snapshots and diffs.
+"""
+
+import os
+os.environ['TESTING'] = 'True'
+
+import json
+import shutil
+import tempfile
+
+from bs4 import BeautifulSoup
+
+from conftest import resp_datafile
+from epipearl import Epipearl
+from epipearl.endpoints.webui_config import WebUiConfig
+from epipearl.fakepearl import FakePearl
+from epipearl.snapshot import by_name
+from epipearl.snapshot import diff
+from epipearl.snapshot import dumps
+from epipearl.snapshot import load
+from epipearl.snapshot import redacted
+from epipearl.snapshot import save
+from epipearl.snapshot import snapshot_fleet
+from epipearl.snapshot import take_snapshot
+
+
+class TestFormValues(object):
+
+    def test_timesync_form(self):
+        soup = BeautifulSoup(
+                resp_datafile('set_date_and_time', 'ok'), 'html.parser')
+        values = WebUiConfig._form_values(soup)
+        assert values['tz'] == 'US/Alaska'
+        assert values['rdate_proto'] == 'NTP'
+        assert values['rdate'] == 'auto'
+        assert values['server'] == 'north-america.pool.ntp.org'
+        assert values['localserver'] == ''
+
+    def test_multivalue_fields(self):
+        soup = BeautifulSoup(
+                '<form><input type="checkbox" name="rc[]" value="1" checked>'
+                '<input type="checkbox" name="rc[]" value="2">'
+                '<input type="checkbox" name="rc[]" value="3" checked>'
+                '<select name="s" multiple><option value="a" selected>'
+                '<option value="b"></select>'
+                '<select name="one"><option value="x"><option value="y">'
+                '</select><input type="submit" name="go" value="Apply">'
+                '<textarea name="notes">hi</textarea></form>',
+                'html.parser')
+        assert WebUiConfig._form_values(soup) == {
+                'rc[]': ['1', '3'], 's': ['a'], 'one': 'x', 'notes': 'hi'}
+
+    def test_checkbox_hidden_fallback(self):
+        # the archive page posts a hidden value for an unchecked checkbox
+        soup = BeautifulSoup(
+                resp_datafile('set_recorder_settings', 'ok'), 'html.parser')
+        values = WebUiConfig._form_values(soup)
+        assert values['afu_enabled'] == 'on'
+        assert values['upnp_enabled'] == ''
+
+        soup = BeautifulSoup(
+                '<form><input type="checkbox" name="afu" value="" checked>'
+                '<input type="hidden" name="afu" value="on">'
+                '<input type="checkbox" name="upnp" value="on" checked>'
+                '<input type="hidden" name="upnp" value="">'
+                '<input type="checkbox" name="plain" value="on"></form>',
+                'html.parser')
+        assert WebUiConfig._form_values(soup) == {
+                'afu': '', 'upnp': 'on', 'plain': ''}
+
+
+class TestSnapshot(object):
+
+    def setup_method(self, method):
+        self.fakes = [FakePearl(name='pearl%s' % i) for i in range(3)]
+        self.clients = [
+                Epipearl('http://pearl%s' % i, 'admin', 'secret',
+                         transport=fake.transport())
+                for (i, fake) in enumerate(self.fakes)]
+        for c in self.clients:
+            c.set_ntp('pool.ntp.org', 'US/Eastern')
+        self.tmpdir = tempfile.mkdtemp()
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmpdir)
+
+    def test_take_snapshot(self):
+        snap = take_snapshot(self.clients[0])
+        assert sorted(snap['channels']) == ['1', '2']
+        assert snap['channels']['1']['params']['publish_type'] == '0'
+        assert 'rtmp_url' in snap['channels']['1']['streamsetup']
+        assert snap['recorders']['1']['archive']['rc[]'] == ['1', '2']
+        assert snap['forms']['timesynccfg']['server'] == 'pool.ntp.org'
+        assert 'epiScreenTimeout' in snap['forms']['touchscreencfg']
+        assert snap['errors'] == {}
+        assert snap['firmware_version']
+
+    def test_redacts_passwords(self):
+        self.clients[0].set_channel_rtmp(
+                '1', 'rtmp://live.example.edu/x', 'presenter', 'u',
+                'rtmp-secret')
+        self.clients[0].set_mhpearl_settings(
+                device_name='room-1', device_channel='1',
+                admin_server_url='http://mh.example.edu',
+                admin_server_usr='mh', admin_server_pwd='mh-secret')
+        snap = take_snapshot(self.clients[0])
+        assert snap['channels']['1']['streamsetup']['rtmp_password'] == \
+            redacted
+        assert snap['forms']['mhcfg']['ADMIN_SERVER_PASSWD'] == redacted
+        assert snap['forms']['mhcfg']['DEVICE_PASSWORD'] == redacted
+        assert 'secret' not in dumps(snap)
+
+        snap = take_snapshot(self.clients[0], secrets=True)
+        assert snap['channels']['1']['streamsetup']['rtmp_password'] == \
+            'rtmp-secret'
+        assert snap['forms']['mhcfg']['ADMIN_SERVER_PASSWD'] == 'mh-secret'
+
+    def test_unreadable_parts(self):
+        # stock firmware has no mhcfg page
+        self.clients[0].transport.route(
+                'admin/mhcfg', lambda request: (404, {}, 'not found'))
+        self.clients[0].transport.route(
+                'admin/channel1/get_params.cgi',
+                lambda request: (500, {}, 'oops'))
+        snap = take_snapshot(self.clients[0])
+        assert sorted(snap['errors']) == ['channels/1/params', 'forms/mhcfg']
+        assert 'mhcfg' not in snap['forms']
+        assert 'params' not in snap['channels']['1']
+        assert 'params' in snap['channels']['2']
+
+    def test_fleet_and_diff(self):
+        self.clients[1].set_params('1', {'publish_type': '6'})
+        self.clients[2].set_touchscreen(screen_timeout=60)
+        (snaps, errors) = snapshot_fleet(self.clients, concurrency=3)
+        assert errors == {}
+        assert len(snaps) == 3
+
+        a = snaps['http://pearl0']
+        assert diff(a, a) == []
+        assert diff(a, snaps['http://pearl1']) == [{
+                'path': 'channels/1/params/publish_type',
+                'a': '0', 'b': '6'}]
+        changes = dict((c['path'], c) for c in diff(
+            a, snaps['http://pearl2']))
+        assert changes['forms/touchscreencfg/epiScreenTimeout']['b'] == '60'
+
+    def test_diff_afu(self):
+        self.clients[1].set_recorder_settings(
+                '1', output_format='mp4', afu_enabled='')
+        (snaps, errors) = snapshot_fleet(self.clients[:2])
+        assert diff(snaps['http://pearl0'], snaps['http://pearl1']) == [{
+                'path': 'recorders/1/archive/afu_enabled',
+                'a': 'on', 'b': ''}]
+
+    def test_diff_by_name(self):
+        # same channel names, different ids
+        self.clients[1].delete_channel('1')
+        self.clients[1].create_channel('channel 1')
+        a = take_snapshot(self.clients[0])
+        b = take_snapshot(self.clients[1])
+        assert diff(a, b)
+        changes = diff(a, b, names=True)
+        # recorder 1 on the second device lost channel 1 when it was deleted
+        assert changes == [{
+                'path': 'recorders/recorder 1/archive/rc[]',
+                'a': ['channel 1', 'channel 2'], 'b': ['channel 2']}]
+
+        c = dict(a)
+        del c['channels']['2']
+        assert {'path': 'channels/2/name', 'a': 'channel 2'} in \
+            diff(take_snapshot(self.clients[0]), c)
+
+    def test_diff_by_name_duplicates(self):
+        # two channels named alike are both kept, keyed by name and id
+        for fake in self.fakes[:2]:
+            fake.channels['2']['name'] = 'channel 1'
+        self.clients[1].set_params('2', {'framesize': '640x480'})
+        a = take_snapshot(self.clients[0])
+        b = take_snapshot(self.clients[1])
+        changes = diff(a, b, names=True)
+        assert changes == [{
+                'path': 'channels/channel 1#2/params/framesize',
+                'a': '1280x720', 'b': '640x480'}]
+        assert sorted(by_name(a)['recorders']['recorder 1']['archive'][
+            'rc[]']) == ['channel 1#1', 'channel 1#2']
+
+    def test_save_and_load(self):
+        (snaps, errors) = snapshot_fleet(self.clients)
+        for name in ('fleet.json', 'fleet.json.gz'):
+            path = os.path.join(self.tmpdir, name)
+            save(path, snaps)
+            assert load(path) == json.loads(dumps(snaps))
+        # stable: equal snapshots dump to equal bytes
+        assert dumps(snaps) == dumps(json.loads(dumps(snaps)))
+        assert ' ' not in dumps({'a': [1, 2]})
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_state_cache
+----------------------------------
+
+Tests for `epipearl` persistent device state cache.
+"""
+
+import os
+os.environ['TESTING'] = 'True'
+
+import shutil
+import tempfile
+import time
+
+from epipearl import Epipearl
+from epipearl.fakepearl import FakePearl
+from epipearl.state_cache import StateCache
+from epipearl.state_cache import warm_snapshots
+
+
+class TestStateCache(object):
+
+    def setup_method(self, method):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'state.db')
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmpdir)
+
+    def test_put_get_and_reopen(self):
+        cache = StateCache(self.path)
+        assert cache.get('http://pearl', 'inventory') is None
+        cache.put('http://pearl', 'inventory', {'channels': ['1']},
+                  updated=100.0)
+        cache.put('http://pearl', 'firmware_version', '4.1.2')
+        cache.close()
+
+        cache = StateCache(self.path)
+        assert cache.get('http://pearl', 'inventory') == (
+                {'channels': ['1']}, 100.0)
+        assert sorted(cache.keys()) == [
+                ('http://pearl', 'firmware_version'),
+                ('http://pearl', 'inventory')]
+        cache.delete('http://pearl', 'inventory')
+        assert cache.keys('http://pearl') == [
+                ('http://pearl', 'firmware_version')]
+
+    def test_max_age(self):
+        cache = StateCache(self.path, max_age=60)
+        cache.put('d', 'old', 1, updated=time.time() - 120)
+        cache.put('d', 'new', 2)
+        assert cache.get('d', 'old') is None
+        assert cache.get('d', 'old', max_age=300)[0] == 1
+        assert cache.get('d', 'new')[0] == 2
+        cache.purge(older_than=60)
+        assert cache.keys() == [('d', 'new')]
+
+    def test_warm_snapshots(self):
+        fakes = [FakePearl() for i in range(2)]
+        clients = [Epipearl('http://pearl%s' % i, 'admin', 'secret',
+                            transport=fake.transport())
+                   for (i, fake) in enumerate(fakes)]
+        cache = StateCache(self.path)
+
+        # cold start: nothing cached, all devices read in background
+        (snaps, refresh) = warm_snapshots(cache, clients)
+        assert snaps == {}
+        refresh.join()
+        requests = [f.stats['requests'] for f in fakes]
+
+        # warm start: served from cache with no device requests
+        (snaps, refresh) = warm_snapshots(StateCache(self.path), clients)
+        assert refresh is None
+        assert sorted(snaps) == ['http://pearl0', 'http://pearl1']
+        assert snaps['http://pearl0']['channels']['1']['name'] == 'channel 1'
+        assert [f.stats['requests'] for f in fakes] == requests
+
+        # stale: served, then revalidated
+        fakes[0].channels['1']['name'] = 'renamed'
+        refreshed = []
+        (snaps, refresh) = warm_snapshots(
+                cache, clients, refresh_after=0,
+                on_refresh=lambda c, s, e: refreshed.append(c.url))
+        assert snaps['http://pearl0']['channels']['1']['name'] == 'channel 1'
+        refresh.join()
+        assert sorted(refreshed) == ['http://pearl0', 'http://pearl1']
+        (snaps, refresh) = warm_snapshots(cache, clients)
+        assert snaps['http://pearl0']['channels']['1']['name'] == 'renamed'
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_timeouts
+----------------------------------
+
+Tests for `epipearl` adaptive timeouts learned from latency.
+"""
+
+import os
+os.environ['TESTING'] = 'True'
+
+import pytest
+import requests
+
+from epipearl import Epipearl
+from epipearl.timeouts import AdaptiveTimeouts
+from epipearl.timeouts import endpoint
+from epipearl.transport import MemoryTransport
+
+
+class SlowTransport(MemoryTransport):
+    """answers after `latency` seconds, without sleeping."""
+
+    def __init__(self, latency):
+        MemoryTransport.__init__(self, app=lambda request: (
+            200, {}, 'publish_type = 6\n'))
+        self.latency = latency
+        self.timeouts = []
+
+    def request(self, method, url, **kwargs):
+        self.timeouts.append(kwargs['timeout'])
+        latency = self.latency.get(endpoint(method, url), 0.01)
+        if latency > kwargs['timeout'][1]:
+            raise requests.ReadTimeout('read timed out')
+        resp = MemoryTransport.request(self, method, url, **kwargs)
+        resp.elapsed = resp.elapsed.__class__(seconds=latency)
+        return resp
+
+
+class TestAdaptiveTimeouts(object):
+
+    def test_endpoint(self):
+        assert endpoint('GET', 'http://pearl/admin/channel12/get_params.cgi'
+                        '?publish_type=') == \
+            'GET /admin/channel*/get_params.cgi'
+
+    def test_learned_and_clamped(self):
+        t = AdaptiveTimeouts(percentile=99, multiplier=2, floor=0.5,
+                             ceiling=10, min_samples=3)
+        url = 'http://pearl/admin/timesynccfg'
+        assert t.timeout('http://pearl', 'GET', url, default=5) == 5
+        for latency in (1.0, 1.5, 2.0):
+            t.observe('http://pearl', 'GET', url, latency)
+        assert t.timeout('http://pearl', 'GET', url, default=5) == 4.0
+        # per device and method
+        assert t.timeout('http://other', 'GET', url, default=5) == 5
+        assert t.timeout('http://pearl', 'POST', url, default=5) == 5
+
+        for latency in (0.01, 0.01, 0.01):
+            t.observe('http://pearl', 'GET', url + 'x', latency)
+        assert t.timeout('http://pearl', 'GET', url + 'x', default=5) == 0.5
+        for latency in (30, 30, 30):
+            t.observe('http://pearl', 'GET', url, latency)
+        assert t.timeout('http://pearl', 'GET', url, default=5) == 10
+        assert [s['timeout'] for s in t.snapshot()] == [10, 0.5]
+
+    def test_client(self):
+        transport = SlowTransport({
+            'GET /admin/channel*/get_params.cgi': 0.02,
+            'GET /admin/timesynccfg': 7.0})
+        timeouts = AdaptiveTimeouts(min_samples=5, floor=0.1)
+        c = Epipearl('http://pearl', 'admin', 'secret', transport=transport,
+                     adaptive_timeouts=timeouts)
+        for i in range(6):
+            c.get_params('1')
+        # fast endpoint: timeout shrinks to floor
+        assert transport.timeouts[0] == (2, 5)
+        assert transport.timeouts[-1] == (2, 0.1)
+
+        # slow endpoint: default is too short; timeouts count as latency
+        # and the learned timeout grows past it
+        for i in range(5):
+            with pytest.raises(requests.ReadTimeout):
+                c.get('admin/timesynccfg')
+        assert c.get('admin/timesynccfg').status_code == 200
+        assert transport.timeouts[-1] == (2, 15.0)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_timeseries
+----------------------------------
+
+Tests for `epipearl` in-memory metrics time series.
+"""
+
+import os
+os.environ['TESTING'] = 'True'
+
+import json
+
+from conftest import resp_datafile
+from epipearl.timeseries import RingSeries
+from epipearl.timeseries import TimeSeriesStore
+from epipearl.timeseries import downsample
+
+device = "http://fake.example.edu"
+
+
+class TestTimeSeries(object):
+
+    def test_ring_wraps(self):
+        s = RingSeries(capacity=4)
+        for i in range(10):
+            assert s.append(float(i), i * 10.0)
+        assert len(s) == 4
+        assert s.query() == [(6, 60), (7, 70), (8, 80), (9, 90)]
+        assert s.query(start=7, end=9) == [(7, 70), (8, 80)]
+        assert s.last() == (9, 90)
+        assert s.nbytes == 64
+        assert not s.append(5.0, 1.0)
+
+    def test_downsample(self):
+        samples = [(0, 1.0), (1, 3.0), (2, 5.0), (5, 7.0), (11, 9.0)]
+        assert downsample(samples, 5) == [(0, 3.0), (5, 7.0), (10, 9.0)]
+        assert downsample(samples, 5, how='max') == \
+            [(0, 5.0), (5, 7.0), (10, 9.0)]
+        assert downsample(samples, 10, how='last') == [(0, 7.0), (10, 9.0)]
+
+    def test_record_sysinfo(self):
+        store = TimeSeriesStore(capacity=10)
+        sysinfo = json.loads(resp_datafile('sysinfo', ext='json'))
+        store.record_sysinfo(device, sysinfo)
+        sysinfo['time'] += 5
+        sysinfo['channels'][2]['codecs']['video']['bitrate'] = '1000'
+        store.record_sysinfo(device, sysinfo)
+
+        assert store.query(device, '3', 'video_bitrate') == [
+                (1464965678, 6467000.0), (1464965683, 1000.0)]
+        assert store.query(device, '1', 'fps') == [
+                (1464965678, 30.0), (1464965683, 30.0)]
+        assert store.query(
+                device, '3', 'video_bitrate', start=1464965670,
+                step=10) == [(1464965670, 6467000.0), (1464965680, 1000.0)]
+        assert store.query(device, '1', 'recorder_enabled') == [
+                (1464965678, 0.0), (1464965683, 0.0)]
+        # recorders have no codecs, but do have recorder time
+        assert store.series(device, 'm2', 'video_bitrate') is None
+        assert len(store.series(device, 'm2', 'recorder_time')) == 2
+        assert store.query(device, '9', 'fps') == []
+        # 4 channels * 5 metrics + 2 recorders * 2 metrics
+        assert len(store.keys()) == 24
+        assert store.nbytes == 24 * 10 * 16
+
+    def test_blocks(self):
+        store = TimeSeriesStore(capacity=4)
+        for c in range(40):
+            store.record(device, str(c), 'fps', 30.0, 1)
+        blocks = store.blocks('fps')
+        assert [b.rows for (keys, b) in blocks] == [16, 32]
+        assert [len(keys) for (keys, b) in blocks] == [16, 24]
+        assert blocks[1][0][0] == (device, '16')
+        # rows share the block arrays
+        s = store.series(device, '17', 'fps')
+        s.append(2, 25.0)
+        assert blocks[1][1].values[1 * 4 + 1] == 25.0
+        assert s.query() == [(1, 30.0), (2, 25.0)]
+        assert store.blocks('audio_bitrate') == []
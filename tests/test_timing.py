@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_timing
+----------------------------------
+
+Tests for `epipearl` phase timing and profiling of operations.
+"""
+
+import os
+os.environ['TESTING'] = 'True'
+
+import pstats
+import pytest
+import requests
+import shutil
+import tempfile
+
+from epipearl import Epipearl
+from epipearl.fakepearl import FakePearl
+from epipearl.fakepearl import FakePearlFleet
+from epipearl.fleet import clients_from_inventory
+from epipearl.metrics import Metrics
+from epipearl.timing import Timing
+from epipearl.timing import current
+
+
+class TestTiming(object):
+
+    def setup_method(self, method):
+        self.fake = FakePearl(latency=0.01)
+        self.hooked = []
+        self.timing = Timing(hook=self.hooked.append)
+        self.c = Epipearl('http://pearl', 'admin', 'secret',
+                          transport=self.fake.transport(),
+                          timing=self.timing)
+        self.tmpdir = tempfile.mkdtemp()
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmpdir)
+
+    def test_phases(self):
+        self.c.set_recorder_settings('1', output_format='mp4')
+        self.c.get_params('1', {'publish_type': ''})
+
+        assert [r.operation for r in self.hooked] == [
+                'set_recorder_settings', 'get_params']
+        assert list(self.timing.records) == self.hooked
+        rs = self.hooked[0]
+        assert rs.device == 'http://pearl'
+        assert rs.requests == 1
+        assert rs.error is None
+        assert rs.phases['ttfb'] >= 0.01
+        assert rs.phases['parse'] > 0
+        assert rs.phases['verify'] > 0
+        assert rs.phases['connect'] == 0
+        assert sum(rs.phases.values()) <= rs.total
+        d = rs.as_dict()
+        assert set(d) >= set(['ttfb', 'download', 'parse', 'verify', 'other'])
+        assert self.hooked[1].phases['parse'] > 0
+        assert current() is None
+
+    def test_workflow_is_one_operation(self):
+        self.c.create_channel('timed')
+        ops = [(r.operation, r.requests) for r in self.hooked]
+        # add channel, redirected to the new channel page, then rename
+        assert ops == [('create_channel', 2)]
+
+    def test_error(self):
+        self.fake.fail_next(1, status=500)
+        with pytest.raises(requests.HTTPError):
+            self.c.get_infocfg()
+        assert self.hooked[0].error == 'HTTPError'
+        assert self.hooked[0].requests == 1
+        assert self.hooked[0].phases['parse'] == 0
+
+    def test_with_metrics(self):
+        metrics = Metrics()
+        self.c.metrics = metrics
+        self.c.get_infocfg()
+        assert self.hooked[0].phases['parse'] > 0
+        assert metrics.snapshot()[0]['parse']['count'] == 1
+
+    def test_profile(self):
+        timing = Timing(profile_dir=os.path.join(self.tmpdir, 'prof'))
+        self.c.timing = timing
+        self.c.get_infocfg()
+        self.c.get_sysinfo()    # not parse heavy
+        (infocfg, sysinfo) = timing.records
+        assert sysinfo.profile is None
+        assert os.path.dirname(infocfg.profile) == \
+            os.path.join(self.tmpdir, 'prof')
+        assert os.path.basename(infocfg.profile).startswith(
+                'get_infocfg-pearl-')
+        stats = pstats.Stats(infocfg.profile)
+        assert any(fn == 'get_infocfg' for (f, l, fn) in stats.stats)
+
+
+class TestTimingOverHttp(object):
+
+    def test_connect_is_timed(self):
+        timing = Timing()
+        with FakePearlFleet(1, latency=0.01) as fleet:
+            (c,) = clients_from_inventory(fleet.inventory(), timing=timing)
+            c.get_sysinfo()
+            c.get_sysinfo()
+        (first, second) = timing.records
+        assert first.phases['connect'] > 0
+        assert second.phases['connect'] == 0    # connection reused
+        assert first.phases['ttfb'] >= 0.01
+        assert first.phases['download'] > 0
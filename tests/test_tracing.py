@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_tracing
+----------------------------------
+
+Tests for `epipearl` tracing spans.
+"""
+
+import os
+os.environ['TESTING'] = 'True'
+
+import pytest
+import requests
+
+from epipearl import Epipearl
+from epipearl.fakepearl import FakePearl
+from epipearl.fleet import map_concurrently
+from epipearl.tracing import RecordingTracer
+from epipearl.tracing import Tracer
+
+
+class TestTracing(object):
+
+    def setup_method(self, method):
+        self.fake = FakePearl()
+        self.tracer = RecordingTracer()
+        self.c = Epipearl('http://pearl', 'admin', 'secret',
+                          transport=self.fake.transport(),
+                          tracer=self.tracer)
+
+    def _named(self, name):
+        return [s for s in self.tracer.spans if s.name == name]
+
+    def test_workflow_spans(self):
+        self.c.create_channel('traced')
+
+        (workflow,) = self._named('create_channel')[-1:]
+        assert workflow.parent_id is None
+        assert workflow.attributes['epipearl.device'] == 'http://pearl'
+        steps = [s.name for s in self.tracer.children(workflow)]
+        # endpoint calls nest under the workflow of the same name
+        assert steps == ['create_channel', 'rename_channel']
+        (add, rename) = self.tracer.children(workflow)
+        (create,) = self.tracer.children(add)
+        assert create.name == 'create_channel_or_recorder'
+        (get,) = self.tracer.children(create)
+        assert get.name == 'HTTP GET'
+        assert get.attributes['http.status_code'] == 200
+        assert get.attributes['http.redirect_count'] == 1
+        assert get.attributes['http.url'].endswith('/admin/add_channel.cgi')
+        (post,) = self.tracer.children(rename)
+        assert post.name == 'HTTP POST'
+        assert post.attributes['http.redirect_count'] == 0
+        assert len(set(s.trace_id for s in self.tracer.spans)) == 1
+        assert self.tracer.current_span() is None
+
+    def test_error_spans(self):
+        self.fake.fail_next(1, status=500)
+        with pytest.raises(requests.HTTPError):
+            self.c.get_infocfg()
+        (http,) = self._named('HTTP GET')
+        assert http.status == 'error'
+        assert http.attributes['http.status_code'] == 500
+        (op,) = self._named('get_infocfg')
+        assert op.status == 'error'
+        assert op.error.startswith('HTTPError')
+        assert op.as_dict()['duration'] >= 0
+
+    def test_fleet_job(self):
+        clients = [Epipearl('http://pearl%s' % i, 'admin', 'secret',
+                            transport=FakePearl().transport(),
+                            tracer=self.tracer) for i in range(4)]
+        results = list(map_concurrently(
+            lambda c: c.get_sysinfo(), clients, concurrency=2,
+            tracer=self.tracer, name='sysinfo_sweep'))
+        assert all(e is None for (c, r, e) in results)
+
+        (job,) = self._named('sysinfo_sweep')
+        assert job.attributes['epipearl.items'] == 4
+        assert job.attributes['epipearl.errors'] == 0
+        items = self.tracer.children(job)
+        assert sorted(s.attributes['epipearl.device'] for s in items) == \
+            sorted(c.url for c in clients)
+        for item in items:
+            (op,) = self.tracer.children(item)
+            assert op.name == 'get_sysinfo'
+            assert op.trace_id == job.trace_id
+
+    def test_max_spans(self):
+        tracer = RecordingTracer(max_spans=3)
+        for name in 'abcde':
+            with tracer.span(name):
+                pass
+        assert [s.name for s in tracer.spans] == ['c', 'd', 'e']
+
+    def test_noop_tracer(self):
+        self.c.tracer = Tracer()
+        assert self.c.create_channel('untraced')
+        with self.c.tracer.span('outer') as span:
+            span.set_attribute('k', 'v')
+            assert self.c.tracer.current_span() is span
+        assert self.c.tracer.current_span() is None
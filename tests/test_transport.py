@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_transport
+----------------------------------
+
+Tests for `epipearl` pluggable http transports.
+"""
+
+import os
+os.environ['TESTING'] = 'True'
+
+import base64
+
+import httpretty
+import pytest
+import requests
+
+from epipearl import Epipearl
+from epipearl.endpoints.webui_channel import WebUiChannel
+from epipearl.transport import MemoryTransport
+from epipearl.transport import RequestsTransport
+from epipearl.transport import Transport
+from epipearl.transport import Urllib3Transport
+from epipearl.transport import make_transport
+from epipearl.transport import register_transport
+
+epiphan_url = "http://fake.example.edu"
+epiphan_user = "user"
+epiphan_passwd = "passwd"
+
+
+class TestMemoryTransport(object):
+
+    def setup_method(self, method):
+        self.transport = MemoryTransport()
+        self.c = Epipearl(epiphan_url, epiphan_user, epiphan_passwd,
+                          transport=self.transport)
+
+    def test_get_params(self):
+        self.transport.route(
+                '/admin/channel2/get_params.cgi',
+                lambda req: (200, {}, 'publish_type = 6\n'))
+        assert self.c.get_params(2, {'publish_type': ''}) == \
+            {'publish_type': '6'}
+
+        req = self.transport.requests[0]
+        assert req.query == {'publish_type': ''}
+        assert req.headers['Authorization'] == 'Basic %s' % \
+            base64.b64encode('%s:%s' % (epiphan_user, epiphan_passwd))
+
+    def test_redirect_history(self):
+        self.transport.route(
+                '/admin/add_channel.cgi',
+                lambda req: (
+                    302, {'Location': '/admin/channel57/mediasources'}, ''))
+        self.transport.route(
+                '/admin/channel57/mediasources', lambda req: (200, {}, 'ok'))
+        assert WebUiChannel.create_channel(client=self.c) == '57'
+
+    def test_post_form(self):
+        self.transport.route(
+                '/admin/ajax/rename_channel.cgi',
+                lambda req: (200, {}, req.form['value']), methods=('POST',))
+        assert WebUiChannel.rename_channel(
+            client=self.c, channel_id='3', channel_name='new name') == \
+            'new name'
+        assert self.transport.requests[0].form['channel'] == '3'
+
+    def test_app_and_errors(self):
+        t = MemoryTransport(app=lambda req: (500, {}, 'boom'))
+        c = Epipearl(epiphan_url, epiphan_user, epiphan_passwd, transport=t)
+        with pytest.raises(requests.HTTPError):
+            c.get('admin/anything')
+
+        with pytest.raises(requests.HTTPError) as e:
+            self.c.get('admin/unrouted')
+        assert e.value.response.status_code == 404
+
+    def test_stream(self):
+        self.transport.route('/big', lambda req: (200, {}, 'x' * 10000))
+        r = self.c.get('big', stream=True)
+        assert sum(len(c) for c in r.iter_content(chunk_size=4096)) == 10000
+
+
+class TestTransportRegistry(object):
+
+    def test_make_transport(self):
+        assert isinstance(make_transport(), RequestsTransport)
+        assert isinstance(make_transport('memory'), MemoryTransport)
+        t = MemoryTransport()
+        assert make_transport(t) is t
+        with pytest.raises(ValueError):
+            make_transport('nope')
+
+    def test_register_transport(self):
+
+        class Custom(MemoryTransport):
+            pass
+        register_transport('custom', Custom)
+        c = Epipearl(epiphan_url, epiphan_user, epiphan_passwd,
+                     transport='custom')
+        assert isinstance(c.transport, Custom)
+
+    def test_too_many_redirects(self):
+
+        class Loop(Transport):
+            max_redirects = 3
+
+            def send(self, prepared, timeout=None, stream=False):
+                t = MemoryTransport(
+                        app=lambda req: (302, {'Location': '/again'}, ''))
+                return t.send(prepared, timeout, stream)
+        with pytest.raises(requests.TooManyRedirects):
+            Loop().request('GET', epiphan_url)
+
+
+class TestUrllib3Transport(object):
+
+    def setup_method(self, method):
+        self.c = Epipearl(epiphan_url, epiphan_user, epiphan_passwd,
+                          transport=Urllib3Transport())
+
+    @httpretty.activate
+    def test_get_params(self):
+        httpretty.register_uri(
+                httpretty.GET,
+                '%s/admin/channel2/get_params.cgi' % epiphan_url,
+                body='publish_type = 6\n')
+        assert self.c.get_params(2, {'publish_type': ''}) == \
+            {'publish_type': '6'}
+
+    @httpretty.activate
+    def test_redirect_history(self):
+        httpretty.register_uri(
+                httpretty.GET,
+                '%s/admin/add_channel.cgi' % epiphan_url,
+                status=302,
+                location='/admin/channel57/mediasources')
+        httpretty.register_uri(
+                httpretty.GET,
+                '%s/admin/channel57/mediasources' % epiphan_url, status=200)
+        assert WebUiChannel.create_channel(client=self.c) == '57'
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_watcher
+----------------------------------
+
+Tests for `epipearl` change events from device state.
+"""
+
+import os
+os.environ['TESTING'] = 'True'
+
+import copy
+import json
+
+from conftest import resp_datafile
+from epipearl import watcher
+from epipearl.poller import PollTarget
+from epipearl.watcher import StateWatcher
+
+device = "http://fake.example.edu"
+
+
+def kinds(events):
+    return [(e.type, e.channel) for e in events]
+
+
+class TestWatcher(object):
+
+    def setup_method(self, method):
+        self.w = StateWatcher()
+
+    def test_params_events(self):
+        assert self.w.update_params(
+                device, '1', {'rec_enabled': '', 'publish_type': '6'}) == []
+        events = self.w.update_params(
+                device, '1', {'rec_enabled': 'on', 'publish_type': '0',
+                              'framesize': '1280x720'})
+        assert kinds(events) == [
+                (watcher.PARAM_CHANGED, '1'),
+                (watcher.STREAM_STOPPED, '1'),
+                (watcher.RECORDING_STARTED, '1')]
+        assert events[1].old == '6' and events[1].new == '0'
+        assert self.w.update_params(
+                device, '1', {'rec_enabled': 'on', 'publish_type': '0',
+                              'framesize': '1280x720'}) == []
+
+    def test_infocfg_events(self):
+        infocfg = {
+                'channels': [{'id': '1', 'name': 'dce_pr'},
+                             {'id': '2', 'name': 'dce_live'}],
+                'recorders': [{'id': '1', 'name': 'dce_prpn'}]}
+        self.w.update_infocfg(device, infocfg)
+        infocfg = {
+                'channels': [{'id': '1', 'name': 'dce_pn'}],
+                'recorders': [{'id': '1', 'name': 'dce_prpn'},
+                              {'id': '2', 'name': 'backup'}]}
+        events = self.w.update_infocfg(device, infocfg)
+        assert kinds(events) == [
+                (watcher.CHANNEL_RENAMED, '1'),
+                (watcher.CHANNEL_REMOVED, '2'),
+                (watcher.RECORDER_ADDED, 'm2')]
+        assert (events[0].old, events[0].new) == ('dce_pr', 'dce_pn')
+
+    def test_sysinfo_events(self):
+        sysinfo = json.loads(resp_datafile('sysinfo', ext='json'))
+        assert self.w.update_sysinfo(device, sysinfo) == []
+
+        changed = copy.deepcopy(sysinfo)
+        changed['channels'][0]['recorder']['enabled'] = True
+        changed['channels'][2]['state'] = 'NO_SIGNAL'
+        changed['channels'][4]['name'] = 'Recorder two'
+        del changed['channels'][5]
+        events = self.w.update_sysinfo(device, changed)
+        assert kinds(events) == [
+                (watcher.RECORDING_STARTED, '1'),
+                (watcher.CHANNEL_DOWN, '3'),
+                (watcher.RECORDER_RENAMED, 'm2'),
+                (watcher.RECORDER_REMOVED, 'm3')]
+
+    def test_subscriptions(self):
+        received = []
+        self.w.subscribe(callback=received.append,
+                         types=[watcher.RECORDING_STOPPED])
+        sub = self.w.subscribe(maxsize=2)
+
+        self.w.update_params(device, '1', {'rec_enabled': 'on'})
+        for i in range(3):
+            self.w.update_params(device, '1', {'rec_enabled': ''})
+            self.w.update_params(device, '1', {'rec_enabled': 'on'})
+
+        assert kinds(received) == [(watcher.RECORDING_STOPPED, '1')] * 3
+        # bounded queue kept the 2 newest events
+        assert sub.dropped == 4
+        events = [sub.get(timeout=0), sub.get(timeout=0)]
+        assert kinds(events) == [
+                (watcher.RECORDING_STOPPED, '1'),
+                (watcher.RECORDING_STARTED, '1')]
+        assert sub.get(timeout=0) is None
+
+        self.w.unsubscribe(sub)
+        self.w.update_params(device, '1', {'rec_enabled': ''})
+        assert sub.get(timeout=0) is None
+
+    def test_poll_callback(self):
+        t = PollTarget((device, '1'), device, None, 1)
+        self.w.poll_callback(t, {'publish_type': '6'}, None)
+        events = self.w.poll_callback(
+                t, {'publish_type': '0'}, {'publish_type': '6'})
+        assert kinds(events) == [(watcher.STREAM_STOPPED, '1')]